@@ -13,38 +13,200 @@ mtDNA Fusion Merger - 基于 mtDNA-Server 2 融合模式的变异合并工具
 
 import argparse
 import gzip
+import hashlib
 import json
+import os
+import resource
+import shutil
+import struct
 import sys
-from collections import defaultdict
-from dataclasses import dataclass, field
+import tempfile
+import zlib
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field, fields
+from itertools import groupby, islice
+from operator import attrgetter
 from pathlib import Path
-from typing import Optional
+from time import perf_counter, process_time
+from typing import BinaryIO, Iterable, Iterator, Optional
 
 
-@dataclass
-class Variant:
-    chrom: str
-    pos: int
-    ref: str
-    alt: str
-    qual: float
-    filter_status: str
-    info: dict
-    format_fields: list
-    sample_data: list
-    source: str
-    is_indel: bool = field(init=False)
+class VcfRecord:
+    """
+    一行 VCF 数据, 只解码定位和融合所需的 CHROM/POS/REF/FILTER (ALT 在 Variant 上);
+    QUAL 和 INFO 起的其余列保留为原始字节, 输出时直接拷贝, 访问时才解码并缓存.
+    多等位位点拆分出的 Variant 共享同一条记录
+    """
+    __slots__ = ('chrom', 'pos', 'ref', 'filter_status', 'qual_bytes', 'tail', 'info_end',
+                 '_info', '_format', '_samples')
+    
+    def __init__(self, chrom: str, pos: int, ref: str, filter_status: str, qual_bytes: bytes, tail: bytes):
+        self.chrom = chrom
+        self.pos = pos
+        self.ref = ref
+        self.filter_status = filter_status
+        self.qual_bytes = qual_bytes
+        # tail 是 INFO 列及其后的所有列, info_end 是 INFO 列结束的位置
+        self.tail = tail
+        info_end = tail.find(b'\t')
+        self.info_end = info_end if info_end >= 0 else len(tail)
+        self._info: Optional[dict] = None
+        self._format: Optional[list] = None
+        self._samples: Optional[list] = None
+    
+    @property
+    def qual(self) -> float:
+        return float(self.qual_bytes) if self.qual_bytes != b'.' else 0.0
+    
+    @property
+    def info_raw(self) -> str:
+        return self.tail[:self.info_end].decode()
+    
+    def _trailing_columns(self) -> list[bytes]:
+        return self.tail[self.info_end + 1:].split(b'\t', 1) if self.info_end < len(self.tail) else []
+    
+    @property
+    def format_raw(self) -> Optional[str]:
+        columns = self._trailing_columns()
+        return columns[0].decode() if columns else None
+    
+    @property
+    def samples_raw(self) -> Optional[str]:
+        columns = self._trailing_columns()
+        return columns[1].decode() if len(columns) > 1 else None
+    
+    @property
+    def info(self) -> dict:
+        if self._info is None:
+            info_dict: dict = {}
+            for item in self.info_raw.split(';'):
+                if '=' in item:
+                    k, v = item.split('=', 1)
+                    info_dict[k] = v
+                else:
+                    info_dict[item] = True
+            self._info = info_dict
+        return self._info
+    
+    @property
+    def format_fields(self) -> list:
+        if self._format is None:
+            format_raw = self.format_raw
+            self._format = format_raw.split(':') if format_raw is not None else []
+        return self._format
+    
+    @property
+    def sample_data(self) -> list:
+        if self._samples is None:
+            samples_raw = self.samples_raw
+            self._samples = [s.split(':') for s in samples_raw.split('\t')] if samples_raw is not None else []
+        return self._samples
     
-    def __post_init__(self):
-        self.is_indel = len(self.ref) != len(self.alt) or len(self.ref) > 1
+    def format_and_samples(self) -> bytes:
+        """FORMAT 及样本列 (以制表符开头) 原样拷贝; 缺失时补 GT 和 0/1"""
+        rest = self.tail[self.info_end:]
+        if rest.count(b'\t') >= 2 and not rest.startswith(b'\t\t'):
+            return rest
+        columns = self._trailing_columns()
+        format_bytes = columns[0] if columns and columns[0] else b'GT'
+        samples_bytes = columns[1] if len(columns) > 1 and columns[1] else b'0/1'
+        return b'\t' + format_bytes + b'\t' + samples_bytes
+
+
+# 输入里已有的融合标签 (例如再次融合上一次的输出) 在写出前去掉, 避免重复
+FUSION_TAG_PREFIX = b'FUSION_'
+
 
+class Variant:
+    """单个 ALT 等位基因; 融合只用到位置、REF/ALT 和来源, 其余字段委托给共享的 VcfRecord"""
+    __slots__ = ('record', 'alt', 'alt_index', 'source', 'is_indel', 'fusion_info')
+    
+    def __init__(self, record: VcfRecord, alt: str, source: str, alt_index: int = 1):
+        self.record = record
+        self.alt = alt
+        self.alt_index = alt_index
+        self.source = source
+        self.is_indel = len(record.ref) != len(alt) or len(record.ref) > 1
+        self.fusion_info: Optional[dict] = None
+    
+    @property
+    def chrom(self) -> str:
+        return self.record.chrom
+    
+    @property
+    def pos(self) -> int:
+        return self.record.pos
+    
+    @property
+    def ref(self) -> str:
+        return self.record.ref
+    
+    @property
+    def qual(self) -> float:
+        return self.record.qual
+    
+    @property
+    def filter_status(self) -> str:
+        return self.record.filter_status
+    
+    @property
+    def info(self) -> dict:
+        if not self.fusion_info:
+            return self.record.info
+        return {**self.record.info, **self.fusion_info}
+    
+    @property
+    def format_fields(self) -> list:
+        return self.record.format_fields
+    
+    @property
+    def sample_data(self) -> list:
+        return self.record.sample_data
+    
+    def set_info(self, key: str, value) -> None:
+        if self.fusion_info is None:
+            self.fusion_info = {}
+        self.fusion_info[key] = value
+    
+    def info_bytes(self) -> bytes:
+        """原始 INFO 字节加上本等位基因的融合标签; 原始 INFO 中的 FUSION_* 和同名标签先去掉"""
+        info = self.record.tail[:self.record.info_end]
+        if not self.fusion_info:
+            return info if info not in (b'', b'.') else b'.'
+        keys = self.fusion_info.keys()
+        if FUSION_TAG_PREFIX in info or any(key.encode() in info for key in keys):
+            info = b';'.join(
+                item for item in info.split(b';')
+                if not item.startswith(FUSION_TAG_PREFIX) and item.split(b'=', 1)[0].decode() not in keys
+            )
+        tags = ';'.join(f'{k}={v}' if v is not True else k for k, v in self.fusion_info.items()).encode()
+        return tags if info in (b'', b'.') else info + b';' + tags
+    
+    def to_line(self) -> bytes:
+        """
+        输出行: ID 置为 '.', QUAL 规范成浮点数, INFO 追加融合标签,
+        INFO 及其后各列尽量整段拷贝原始字节
+        """
+        record = self.record
+        tail = record.tail
+        info_end = record.info_end
+        prefix = f'{record.chrom}\t{record.pos}\t.\t{record.ref}\t{self.alt}\t{record.qual}\t{record.filter_status}\t'.encode()
+        if tail.count(b'\t', info_end) < 2 or tail.startswith(b'\t\t', info_end):
+            return prefix + self.info_bytes() + record.format_and_samples()
+        if self.fusion_info or info_end == 0:
+            return prefix + self.info_bytes() + tail[info_end:]
+        return prefix + tail
+    
     @property
     def key(self) -> tuple:
-        return (self.chrom, self.pos, self.ref, self.alt)
+        return (self.record.chrom, self.record.pos, self.record.ref, self.alt)
     
     @property
     def position_key(self) -> tuple:
-        return (self.chrom, self.pos)
+        return (self.record.chrom, self.record.pos)
 
 
 @dataclass
@@ -62,179 +224,3134 @@ class FusionStats:
     mutect2_only: int = 0
     conflicts_resolved: int = 0
     final_variants: int = 0
+    vaf_both_callers: int = 0
+    vaf_discordant: int = 0
+    header_widened: list = field(default_factory=list)
+    
+    def add(self, other: 'FusionStats') -> None:
+        for f in fields(self):
+            value = getattr(other, f.name)
+            if isinstance(value, list):
+                # 表头放宽记录按内容去重, 同一对表头在多个样本/染色体中只记一次
+                getattr(self, f.name).extend(item for item in value if item not in getattr(self, f.name))
+            else:
+                setattr(self, f.name, getattr(self, f.name) + value)
+
+
+# 性能剖析: 与 FusionStats 的生物学计数对应的性能计数, 供 Galaxy 作业指标告警使用
+PROFILE_CHUNK_SIZE = 4096
+PROFILE_METRIC_PREFIX = 'mtdna_fusion_merger'
+
+
+def peak_rss_bytes() -> int:
+    """进程的 RSS 峰值; ru_maxrss 在 Linux 上以 KB 为单位, 在 macOS 上以字节为单位"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+@dataclass
+class PhaseTiming:
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_bytes: int = 0
+    records: int = 0
+    bytes: int = 0
+
+
+class Profiler:
+    """
+    按阶段记录墙钟时间、CPU 时间、RSS 峰值和记录/字节数.
+    流式管道中各阶段交错执行, 阶段以栈的形式嵌套, 每个阶段只记录自身 (不含嵌套阶段) 的时间;
+    iterate() 按块拉取上游记录, 计时开销与记录数无关
+    """
+    
+    def __init__(self):
+        self.phases: dict[str, PhaseTiming] = {}
+        self._stack: list[list[float]] = []
+        self._start = (perf_counter(), process_time())
+    
+    def timing(self, name: str) -> PhaseTiming:
+        timing = self.phases.get(name)
+        if timing is None:
+            timing = self.phases[name] = PhaseTiming()
+        return timing
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseTiming]:
+        timing = self.timing(name)
+        # [开始墙钟, 开始 CPU, 嵌套阶段墙钟, 嵌套阶段 CPU]
+        frame = [perf_counter(), process_time(), 0.0, 0.0]
+        self._stack.append(frame)
+        try:
+            yield timing
+        finally:
+            wall = perf_counter() - frame[0]
+            cpu = process_time() - frame[1]
+            self._stack.pop()
+            timing.wall_seconds += wall - frame[2]
+            timing.cpu_seconds += cpu - frame[3]
+            timing.peak_rss_bytes = max(timing.peak_rss_bytes, peak_rss_bytes())
+            if self._stack:
+                self._stack[-1][2] += wall
+                self._stack[-1][3] += cpu
+    
+    def iterate(self, name: str, iterable: Iterable, chunk_size: int = PROFILE_CHUNK_SIZE) -> Iterator:
+        """把上游迭代器的耗时记到 name 阶段, 并统计产出的记录数"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name) as timing:
+                chunk = list(islice(iterator, chunk_size))
+                timing.records += len(chunk)
+            if not chunk:
+                return
+            yield from chunk
+    
+    def to_dict(self) -> dict:
+        phases = {}
+        for name, timing in self.phases.items():
+            entry = asdict(timing)
+            entry['records_per_s'] = round(timing.records / timing.wall_seconds, 1) if timing.wall_seconds else 0.0
+            entry['bytes_per_s'] = round(timing.bytes / timing.wall_seconds, 1) if timing.wall_seconds else 0.0
+            entry['wall_seconds'] = round(timing.wall_seconds, 6)
+            entry['cpu_seconds'] = round(timing.cpu_seconds, 6)
+            phases[name] = entry
+        return {
+            'version': '1.0.0',
+            'total': {
+                'wall_seconds': round(perf_counter() - self._start[0], 6),
+                'cpu_seconds': round(process_time() - self._start[1], 6),
+                'peak_rss_bytes': peak_rss_bytes()
+            },
+            'phases': phases
+        }
+    
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式 (textfile collector 可直接读取)"""
+        profile = self.to_dict()
+        metrics = [
+            ('phase_wall_seconds', 'gauge', 'Wall-clock time spent in the phase', 'wall_seconds'),
+            ('phase_cpu_seconds', 'gauge', 'CPU time spent in the phase', 'cpu_seconds'),
+            ('phase_peak_rss_bytes', 'gauge', 'Process peak RSS observed during the phase', 'peak_rss_bytes'),
+            ('phase_records_total', 'counter', 'Records processed by the phase', 'records'),
+            ('phase_bytes_total', 'counter', 'Bytes processed by the phase', 'bytes'),
+            ('phase_records_per_second', 'gauge', 'Phase throughput in records per second', 'records_per_s'),
+            ('phase_bytes_per_second', 'gauge', 'Phase throughput in bytes per second', 'bytes_per_s')
+        ]
+        lines = []
+        for name, kind, help_text, key in metrics:
+            metric = f'{PROFILE_METRIC_PREFIX}_{name}'
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+            lines += [f'{metric}{{phase="{phase}"}} {entry[key]}' for phase, entry in profile['phases'].items()]
+        for key, value in profile['total'].items():
+            metric = f'{PROFILE_METRIC_PREFIX}_{key}'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def profile_phase(profiler: Optional[Profiler], name: str):
+    return profiler.phase(name) if profiler is not None else nullcontext(None)
+
+
+def profile_iterate(profiler: Optional[Profiler], name: str, iterable: Iterable) -> Iterable:
+    return profiler.iterate(name, iterable) if profiler is not None else iterable
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+READ_CHUNK_SIZE = 1 << 22
+
+
+@contextmanager
+def open_vcf(vcf_path: Path) -> Iterator[BinaryIO]:
+    """以二进制流打开 VCF, 根据魔数识别 gzip/BGZF, 每个输入只打开一次"""
+    raw = open(vcf_path, 'rb')
+    try:
+        if raw.peek(2)[:2] == GZIP_MAGIC:
+            yield gzip.GzipFile(fileobj=raw, mode='rb')
+        else:
+            yield raw
+    finally:
+        raw.close()
+
+
+def iter_lines(stream: BinaryIO) -> Iterator[bytes]:
+    """按大块读取二进制流再切分成行, 比逐行读取少很多次调用; 行不含换行符"""
+    pending = b''
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def parse_record(line: bytes, source: str) -> list[Variant]:
+    """只切出前 7 列并解码其中的 CHROM/POS/REF/ALT/FILTER, INFO 起的列作为一整段字节保留"""
+    fields = line.split(b'\t', 7)
+    if len(fields) < 8:
+        return []
+    
+    chrom, pos, _, ref, alt, qual, filt, tail = fields
+    record = VcfRecord(chrom.decode(), int(pos), ref.decode(), filt.decode(), qual, tail)
+    
+    if b',' not in alt:
+        return [Variant(record, alt.decode(), source)]
+    return [
+        Variant(record, alt_allele, source, alt_index)
+        for alt_index, alt_allele in enumerate(alt.decode().split(','), start=1)
+    ]
+
+
+class VcfReader:
+    """
+    流式 VCF 读取器: 打开时只读取表头, 迭代时逐条产出 Variant,
+    内存占用与文件大小无关.
+    
+    指定 regions 时只产出与区域重叠的记录; 输入为 BGZF 且存在 .tbi/.csi 索引时
+    直接跳到索引给出的块, 否则顺序扫描并过滤
+    """
+    
+    def __init__(
+        self,
+        vcf_path: Path,
+        source: str,
+        regions: Optional['RegionSet'] = None,
+        index_path: Optional[Path] = None
+    ):
+        self.path = vcf_path
+        self.source = source
+        self.regions = regions
+        self.header_lines: list[str] = []
+        self._pending: Optional[bytes] = None
+        self._bgzf: Optional[BgzfReader] = None
+        self._context = None
+        
+        if regions is not None:
+            index_path = index_path or find_index(vcf_path)
+            if index_path is not None and is_bgzf(vcf_path):
+                self._index = load_index(index_path)
+                self._bgzf = BgzfReader(vcf_path)
+                self._read_indexed_header()
+                return
+        
+        self._context = open_vcf(vcf_path)
+        self._lines = iter_lines(self._context.__enter__())
+        
+        for raw_line in self._lines:
+            line = raw_line.strip()
+            if line.startswith(b'#'):
+                self.header_lines.append(line.decode())
+                continue
+            if line:
+                self._pending = line
+                break
+    
+    def _read_indexed_header(self) -> None:
+        while True:
+            line = self._bgzf.readline()
+            if not line.startswith(b'#'):
+                break
+            self.header_lines.append(line.decode().strip())
+    
+    def __iter__(self) -> Iterator[Variant]:
+        if self._bgzf is not None:
+            yield from self._iter_indexed()
+            return
+        
+        if self._pending is not None:
+            line, self._pending = self._pending, None
+            yield from self._filter(parse_record(line, self.source))
+        
+        source = self.source
+        for raw_line in self._lines:
+            line = raw_line.strip()
+            if not line or line.startswith(b'#'):
+                continue
+            if self.regions is None:
+                yield from parse_record(line, source)
+            else:
+                yield from self._filter(parse_record(line, source))
+    
+    def _filter(self, variants: list[Variant]) -> list[Variant]:
+        if self.regions is None or not variants:
+            return variants
+        record = variants[0].record
+        if self.regions.overlaps(record.chrom, record.pos - 1, record.pos - 1 + max(len(record.ref), 1)):
+            return variants
+        return []
+    
+    def _iter_indexed(self) -> Iterator[Variant]:
+        """按参考序列顺序逐个染色体读取索引命中的块, 合并后的块互不重叠, 记录不会重复产出"""
+        index = self._index
+        names = list(contig_order(self.header_lines))
+        names += [name for name in index.names if name not in names]
+        
+        for chrom in names:
+            if chrom not in self.regions.intervals:
+                continue
+            ref_id = index.ref_id(chrom)
+            if ref_id is None:
+                continue
+            chunks = []
+            for beg, end in self.regions.intervals[chrom]:
+                chunks.extend(index.query(ref_id, beg, end))
+            
+            consumed = 0
+            for chunk_beg, chunk_end in merge_chunks(chunks):
+                self._bgzf.seek(max(chunk_beg, consumed))
+                while self._bgzf.tell() < chunk_end:
+                    line = self._bgzf.readline()
+                    if not line:
+                        break
+                    variants = self._filter(parse_record(line.strip(), self.source))
+                    if variants and variants[0].chrom != chrom:
+                        continue
+                    yield from variants
+                consumed = self._bgzf.tell()
+    
+    def close(self) -> None:
+        if self._bgzf is not None:
+            self._bgzf.close()
+        if self._context is not None:
+            self._context.__exit__(None, None, None)
+    
+    def __enter__(self) -> 'VcfReader':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
 def parse_vcf(vcf_path: Path, source: str) -> tuple[list[str], list[Variant]]:
-    header_lines: list[str] = []
-    variants: list[Variant] = []
+    with VcfReader(vcf_path, source) as reader:
+        return reader.header_lines, list(reader)
+
+
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+TABIX_MIN_SHIFT = 14
+TABIX_DEPTH = 5
+TABIX_META_BIN = ((1 << 3 * (TABIX_DEPTH + 1)) - 1) // 7 + 1
+
+
+class BgzfWriter:
+    """
+    BGZF 写入器: 每满 BGZF_BLOCK_SIZE 字节压缩成一个独立的 gzip 块,
+    tell() 返回 tabix 使用的虚拟偏移 (块起始压缩偏移 << 16 | 块内偏移)
+    """
     
-    with open(vcf_path, 'rt') as f:
-        content = f.read()
+    def __init__(self, path: Path, compresslevel: int = 6):
+        self._handle = open(path, 'wb')
+        self._buffer = bytearray()
+        self._block_address = 0
+        self._compresslevel = compresslevel
     
-    if str(vcf_path).endswith('.gz'):
-        with gzip.open(vcf_path, 'rt') as f:
-            content = f.read()
+    def tell(self) -> int:
+        return (self._block_address << 16) | len(self._buffer)
     
-    for raw_line in content.split('\n'):
-        line = raw_line.strip()
-        if line.startswith('#'):
-            header_lines.append(line)
-            continue
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            room = BGZF_BLOCK_SIZE - len(self._buffer)
+            self._buffer += view[:room]
+            view = view[room:]
+            if len(self._buffer) >= BGZF_BLOCK_SIZE:
+                self._flush_block()
+    
+    def _flush_block(self) -> None:
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        for level in (self._compresslevel, 0):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            deflated = compressor.compress(data) + compressor.flush()
+            block_size = len(deflated) + 26
+            if block_size <= 0x10000:
+                break
+        self._handle.write(struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1))
+        self._handle.write(deflated)
+        self._handle.write(struct.pack('<II', zlib.crc32(data), len(data)))
+        self._block_address += block_size
+        self._buffer.clear()
+    
+    def close(self) -> None:
+        self._flush_block()
+        self._handle.write(BGZF_EOF)
+        self._handle.close()
+
+
+def reg2bins(beg: int, end: int, min_shift: int = TABIX_MIN_SHIFT, depth: int = TABIX_DEPTH) -> Iterator[int]:
+    """返回所有可能与 [beg, end) 重叠的分箱"""
+    end -= 1
+    shift = min_shift + 3 * depth
+    offset = 0
+    for level in range(depth + 1):
+        yield from range(offset + (beg >> shift), offset + (end >> shift) + 1)
+        shift -= 3
+        offset += 1 << 3 * level
+
+
+def reg2bin(beg: int, end: int, min_shift: int = TABIX_MIN_SHIFT, depth: int = TABIX_DEPTH) -> int:
+    """UCSC 分箱方案: 返回完整包含 [beg, end) 的最小分箱"""
+    end -= 1
+    shift = min_shift
+    offset = ((1 << 3 * depth) - 1) // 7
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+        shift += 3
+        offset -= 1 << 3 * (level - 1)
+    return 0
+
+
+class TabixIndexBuilder:
+    """在写 BGZF 输出的同一遍中记录每条记录的虚拟偏移, 结束时写出 .tbi"""
+    
+    def __init__(self):
+        self._refs: dict[str, dict] = {}
+    
+    def add(self, chrom: str, beg: int, end: int, start_offset: int, end_offset: int) -> None:
+        ref = self._refs.get(chrom)
+        if ref is None:
+            ref = self._refs[chrom] = {'bins': {}, 'linear': [], 'first': start_offset, 'last': end_offset, 'n': 0}
+        ref['last'] = end_offset
+        ref['n'] += 1
         
-        if not line:
-            continue
+        # 与上一个分块落在同一个 BGZF 块内时直接合并, 读取时多解压的数据不超过一个块
+        chunks = ref['bins'].setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] >> 16 == start_offset >> 16:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+        
+        linear = ref['linear']
+        last_window = (end - 1) >> TABIX_MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> TABIX_MIN_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start_offset
+    
+    def write(self, index_path: Path) -> None:
+        names = b''.join(name.encode() + b'\0' for name in self._refs)
+        data = bytearray(b'TBI\x01')
+        # format=VCF, col_seq=1, col_beg=2, col_end=0, meta='#', skip=0
+        data += struct.pack('<8i', len(self._refs), 2, 1, 2, 0, ord('#'), 0, len(names))
+        data += names
+        
+        for ref in self._refs.values():
+            data += struct.pack('<i', len(ref['bins']) + 1)
+            for bin_id, chunks in ref['bins'].items():
+                data += struct.pack('<Ii', bin_id, len(chunks))
+                for chunk_beg, chunk_end in chunks:
+                    data += struct.pack('<QQ', chunk_beg, chunk_end)
+            data += struct.pack('<IiQQQQ', TABIX_META_BIN, 2, ref['first'], ref['last'], ref['n'], 0)
             
-        fields = line.split('\t')
-        if len(fields) < 8:
-            continue
+            # 与 htslib 一致: 开头空窗口取第一条记录的偏移, 其余空窗口沿用前一个窗口
+            linear = ref['linear']
+            previous = ref['first']
+            for i, offset in enumerate(linear):
+                if offset is None:
+                    linear[i] = previous
+                previous = linear[i]
+            data += struct.pack(f'<i{len(linear)}Q', len(linear), *linear)
+        
+        data += struct.pack('<Q', 0)
         
-        chrom, pos, vid, ref, alt, qual, filt, info = fields[:8]
-        format_fields = fields[8].split(':') if len(fields) > 8 else []
-        sample_data = [s.split(':') for s in fields[9:]] if len(fields) > 9 else []
+        writer = BgzfWriter(index_path)
+        writer.write(bytes(data))
+        writer.close()
+
+
+class VcfOutput:
+    """
+    写出纯文本 VCF; compress 时直接写 BGZF 块并在同一遍中构建 .tbi 索引.
+    记录行可以是 str 或已经编码好的 bytes (直接拷贝)
+    """
+    
+    def __init__(self, path: Path, compress: bool = False, profiler: Optional[Profiler] = None):
+        self.path = path
+        self.compress = compress
+        self.profiler = profiler
+        if compress:
+            self._bgzf = BgzfWriter(path)
+            self._index = TabixIndexBuilder()
+        else:
+            self._handle = open(path, 'wb', buffering=READ_CHUNK_SIZE)
+    
+    def write_header(self, line: str) -> None:
+        if self.compress:
+            self._bgzf.write((line + '\n').encode())
+        else:
+            self._handle.write((line + '\n').encode())
+    
+    def write_record(self, chrom: str, pos: int, ref: str, line) -> None:
+        if isinstance(line, str):
+            line = line.encode()
+        if not self.compress:
+            self._handle.write(line)
+            self._handle.write(b'\n')
+            return
+        start_offset = self._bgzf.tell()
+        self._bgzf.write(line + b'\n')
+        self._index.add(chrom, pos - 1, pos - 1 + max(len(ref), 1), start_offset, self._bgzf.tell())
+    
+    def close(self) -> None:
+        if self.compress:
+            self._bgzf.close()
+            with profile_phase(self.profiler, 'index_build'):
+                self._index.write(Path(f'{self.path}.tbi'))
+        else:
+            self._handle.close()
+    
+    def __enter__(self) -> 'VcfOutput':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class BgzfReader:
+    """BGZF 随机访问读取器, 按 tabix 虚拟偏移定位并逐行读取"""
+    
+    def __init__(self, path: Path):
+        self._handle = open(path, 'rb')
+        self._block_address = 0
+        self._next_address = 0
+        self._data = b''
+        self._within = 0
+        self._load_block(0)
+    
+    def _load_block(self, address: int) -> bool:
+        self._handle.seek(address)
+        header = self._handle.read(12)
+        self._block_address = address
+        self._within = 0
+        if len(header) < 12:
+            self._data = b''
+            self._next_address = address
+            return False
+        
+        extra = self._handle.read(struct.unpack_from('<H', header, 10)[0])
+        block_size = None
+        pos = 0
+        while pos + 4 <= len(extra):
+            subfield_id, subfield_len = extra[pos:pos + 2], struct.unpack_from('<H', extra, pos + 2)[0]
+            if subfield_id == b'BC':
+                block_size = struct.unpack_from('<H', extra, pos + 4)[0] + 1
+            pos += 4 + subfield_len
+        if block_size is None:
+            raise ValueError(f'Not a BGZF file: {self._handle.name}')
+        
+        body = self._handle.read(block_size - 12 - len(extra))
+        self._data = zlib.decompress(body[:-8], -15)
+        self._next_address = address + block_size
+        return True
+    
+    def seek(self, virtual_offset: int) -> None:
+        address = virtual_offset >> 16
+        if address != self._block_address or address == self._next_address:
+            self._load_block(address)
+        self._within = virtual_offset & 0xffff
+    
+    def tell(self) -> int:
+        if self._data and self._within >= len(self._data):
+            return self._next_address << 16
+        return (self._block_address << 16) | self._within
+    
+    def readline(self) -> bytes:
+        parts = []
+        while True:
+            if self._within >= len(self._data):
+                if not self._load_block(self._next_address):
+                    break
+                continue
+            newline = self._data.find(b'\n', self._within)
+            if newline < 0:
+                parts.append(self._data[self._within:])
+                self._within = len(self._data)
+                continue
+            parts.append(self._data[self._within:newline + 1])
+            self._within = newline + 1
+            break
+        return b''.join(parts)
+    
+    def close(self) -> None:
+        self._handle.close()
+
+
+def is_bgzf(vcf_path: Path) -> bool:
+    with open(vcf_path, 'rb') as f:
+        header = f.read(16)
+    return header[:2] == GZIP_MAGIC and header[3] & 4 != 0 and header[12:14] == b'BC'
+
+
+def find_index(vcf_path: Path) -> Optional[Path]:
+    for suffix in ('.tbi', '.csi'):
+        candidate = Path(f'{vcf_path}{suffix}')
+        if candidate.exists():
+            return candidate
+    return None
+
+
+class VcfIndex:
+    """.tbi / .csi 索引的内存表示, 只用于区域查询"""
+    
+    def __init__(self, names: list[str], refs: list[dict], min_shift: int, depth: int, is_csi: bool):
+        self.names = names
+        self.refs = refs
+        self.min_shift = min_shift
+        self.depth = depth
+        self.is_csi = is_csi
+        self._ref_ids = {name: i for i, name in enumerate(names)}
+    
+    def ref_id(self, chrom: str) -> Optional[int]:
+        return self._ref_ids.get(chrom)
+    
+    def _csi_min_offset(self, ref: dict, beg: int) -> int:
+        # 与 htslib 相同: 从 beg 所在的最细分箱向左、向上找第一个存在的分箱, 取其 loffset
+        bin_id = ((1 << 3 * self.depth) - 1) // 7 + (beg >> self.min_shift)
+        while True:
+            if bin_id in ref['loffsets']:
+                return ref['loffsets'][bin_id]
+            if bin_id == 0:
+                return 0
+            parent = (bin_id - 1) >> 3
+            bin_id = bin_id - 1 if bin_id > (parent << 3) + 1 else parent
+    
+    def query(self, ref_id: int, beg: int, end: int) -> list[tuple[int, int]]:
+        ref = self.refs[ref_id]
+        end = min(end, 1 << (self.min_shift + 3 * self.depth))
+        if beg >= end:
+            return []
+        
+        if self.is_csi:
+            min_offset = self._csi_min_offset(ref, beg)
+        elif ref['linear']:
+            linear = ref['linear']
+            min_offset = linear[min(beg >> self.min_shift, len(linear) - 1)]
+        else:
+            min_offset = 0
         
-        info_dict: dict = {}
-        for item in info.split(';'):
-            if '=' in item:
-                k, v = item.split('=', 1)
-                info_dict[k] = v
+        return [
+            chunk
+            for bin_id in reg2bins(beg, end, self.min_shift, self.depth)
+            for chunk in ref['bins'].get(bin_id, ())
+            if chunk[1] > min_offset
+        ]
+
+
+def load_index(index_path: Path) -> VcfIndex:
+    data = gzip.decompress(Path(index_path).read_bytes())
+    magic = data[:4]
+    
+    if magic == b'TBI\x01':
+        n_ref = struct.unpack_from('<i', data, 4)[0]
+        l_nm = struct.unpack_from('<i', data, 32)[0]
+        names = [n.decode() for n in data[36:36 + l_nm].split(b'\0')[:-1]]
+        offset = 36 + l_nm
+        min_shift, depth, is_csi = TABIX_MIN_SHIFT, TABIX_DEPTH, False
+    elif magic == b'CSI\x01':
+        min_shift, depth, l_aux = struct.unpack_from('<3i', data, 4)
+        aux = data[16:16 + l_aux]
+        names = []
+        if l_aux >= 28:
+            l_nm = struct.unpack_from('<i', aux, 24)[0]
+            names = [n.decode() for n in aux[28:28 + l_nm].split(b'\0')[:-1]]
+        offset = 16 + l_aux
+        n_ref = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        is_csi = True
+    else:
+        raise ValueError(f'Unsupported index format: {index_path}')
+    
+    refs = []
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        bins: dict[int, list[tuple[int, int]]] = {}
+        loffsets: dict[int, int] = {}
+        for _ in range(n_bin):
+            if is_csi:
+                bin_id, loffset, n_chunk = struct.unpack_from('<IQi', data, offset)
+                loffsets[bin_id] = loffset
+                offset += 16
             else:
-                info_dict[item] = True
-        
-        for alt_allele in alt.split(','):
-            variants.append(Variant(
-                chrom=chrom,
-                pos=int(pos),
-                ref=ref,
-                alt=alt_allele,
-                qual=float(qual) if qual != '.' else 0.0,
-                filter_status=filt,
-                info=info_dict.copy(),
-                format_fields=format_fields.copy(),
-                sample_data=[s.copy() for s in sample_data],
-                source=source
-            ))
-    
-    return header_lines, variants
-
-
-def calculate_confidence(variant: Variant, in_both: bool) -> float:
-    if in_both:
-        return 1.0
-    if variant.source == 'mutserve':
-        return 0.85 if not variant.is_indel else 0.70
-    return 0.80 if variant.is_indel else 0.60
+                bin_id, n_chunk = struct.unpack_from('<Ii', data, offset)
+                offset += 8
+            flat = struct.unpack_from(f'<{2 * n_chunk}Q', data, offset)
+            offset += 16 * n_chunk
+            bins[bin_id] = list(zip(flat[0::2], flat[1::2]))
+        
+        linear: tuple = ()
+        if not is_csi:
+            n_intv = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+            linear = struct.unpack_from(f'<{n_intv}Q', data, offset)
+            offset += 8 * n_intv
+        refs.append({'bins': bins, 'loffsets': loffsets, 'linear': linear})
+    
+    return VcfIndex(names, refs, min_shift, depth, is_csi)
 
 
-def fusion_merge(
-    mutserve_variants: list[Variant],
-    mutect2_variants: list[Variant],
-    stats: FusionStats
-) -> list[Variant]:
-    mutserve_by_key = {v.key: v for v in mutserve_variants}
-    mutect2_by_key = {v.key: v for v in mutect2_variants}
+def merge_chunks(chunks: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[list[int]] = []
+    for beg, end in sorted(chunks):
+        if merged and beg <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([beg, end])
+    return [(beg, end) for beg, end in merged]
+
+
+class RegionSet:
+    """按染色体合并后的 0-based 半开区间集合"""
+    
+    def __init__(self, regions: Iterable[tuple[str, int, int]]):
+        by_chrom: dict[str, list[tuple[int, int]]] = {}
+        for chrom, beg, end in regions:
+            by_chrom.setdefault(chrom, []).append((beg, end))
+        
+        self.intervals: dict[str, list[tuple[int, int]]] = {}
+        self._starts: dict[str, list[int]] = {}
+        for chrom, intervals in by_chrom.items():
+            merged = merge_chunks(intervals)
+            self.intervals[chrom] = merged
+            self._starts[chrom] = [beg for beg, _ in merged]
+    
+    def overlaps(self, chrom: str, beg: int, end: int) -> bool:
+        intervals = self.intervals.get(chrom)
+        if not intervals:
+            return False
+        i = bisect_right(self._starts[chrom], end - 1)
+        return i > 0 and intervals[i - 1][1] > beg
+
+
+MAX_REGION_END = 1 << 62
+
+
+def parse_region(text: str) -> tuple[str, int, int]:
+    """解析 samtools 风格区域 chrom[:start[-end]] (1-based, 闭区间) 为 0-based 半开区间"""
+    chrom, _, span = text.rpartition(':')
+    if not chrom:
+        return text, 0, MAX_REGION_END
+    span = span.replace(',', '')
+    start, _, end = span.partition('-')
+    try:
+        beg = int(start) - 1 if start else 0
+        stop = int(end) if end else MAX_REGION_END
+    except ValueError:
+        raise ValueError(f'Invalid region: {text}')
+    if beg < 0 or stop <= beg:
+        raise ValueError(f'Invalid region: {text}')
+    return chrom, beg, stop
+
+
+def read_regions_bed(bed_path: Path) -> list[tuple[str, int, int]]:
+    regions = []
+    with open(bed_path) as f:
+        for line in f:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            regions.append((fields[0], int(fields[1]), int(fields[2])))
+    return regions
+
+
+# 变异标准化: 对照参考序列左对齐、去掉两端共有碱基、把 MNP 拆成 SNV,
+# 使两个工具对同一 INDEL 的不同写法得到相同的键 (等价于 bcftools norm -m-)
+MT_ALIASES = {'chrM', 'MT', 'chrMT', 'M', 'rCRS', 'chrRCRS', 'NC_012920', 'NC_012920.1'}
+NUCLEOTIDES = frozenset('ACGTN')
+
+
+class ReferenceFasta:
+    """
+    按 .fai 索引读取参考序列 (没有索引时扫描一遍建立); 每条染色体第一次访问时
+    整条读入并缓存, rCRS 只有 16.5 kb. chrM/MT 等线粒体别名映射到参考中的线粒体序列
+    """
+    
+    def __init__(self, fasta_path: Path):
+        self.path = Path(fasta_path)
+        self.index = self._load_fai()
+        self._cache: dict[str, str] = {}
+        self._aliases: dict[str, Optional[str]] = {}
+    
+    def _load_fai(self) -> dict[str, tuple[int, int, int, int]]:
+        fai_path = Path(f'{self.path}.fai')
+        index = {}
+        if fai_path.exists():
+            with open(fai_path) as f:
+                for line in f:
+                    fields = line.split('\t')
+                    if len(fields) >= 5:
+                        index[fields[0]] = (int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]))
+            return index
+        
+        name = None
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.startswith(b'>'):
+                    name = line[1:].split()[0].decode()
+                    index[name] = [0, offset + len(line), 0, 0]
+                elif name is not None and line.strip():
+                    entry = index[name]
+                    if entry[2] == 0:
+                        entry[2], entry[3] = len(line.rstrip(b'\r\n')), len(line)
+                    entry[0] += len(line.rstrip(b'\r\n'))
+                offset += len(line)
+        return {name: tuple(entry) for name, entry in index.items()}
+    
+    def resolve(self, chrom: str) -> Optional[str]:
+        if chrom not in self._aliases:
+            if chrom in self.index:
+                self._aliases[chrom] = chrom
+            elif chrom in MT_ALIASES:
+                mito = [name for name in self.index if name in MT_ALIASES]
+                if not mito and len(self.index) == 1:
+                    mito = list(self.index)
+                self._aliases[chrom] = mito[0] if mito else None
+            else:
+                self._aliases[chrom] = None
+        return self._aliases[chrom]
+    
+    def sequence(self, chrom: str) -> Optional[str]:
+        name = self.resolve(chrom)
+        if name is None:
+            return None
+        if name not in self._cache:
+            length, offset, line_bases, line_width = self.index[name]
+            lines = (length + line_bases - 1) // line_bases if line_bases else 0
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length + lines * (line_width - line_bases))
+            self._cache[name] = data.replace(b'\n', b'').replace(b'\r', b'').decode().upper()[:length]
+        return self._cache[name]
+
+
+@dataclass
+class NormalizationStats:
+    realigned: int = 0
+    decomposed: int = 0
+    ref_mismatch: int = 0
+
+
+def normalize_allele(sequence: str, pos: int, ref: str, alt: str) -> tuple[int, str, str]:
+    """
+    左对齐并去掉共有碱基 (Tan et al. 2015 的算法): 反复去掉末尾相同的碱基,
+    某个等位基因为空时向左补一个参考碱基; 最后去掉开头多余的共有碱基
+    """
+    while True:
+        changed = False
+        if ref and alt and ref[-1] == alt[-1]:
+            ref, alt = ref[:-1], alt[:-1]
+            changed = True
+        if (not ref or not alt) and pos > 1:
+            pos -= 1
+            base = sequence[pos - 1]
+            ref, alt = base + ref, base + alt
+            changed = True
+        if not changed:
+            break
+    
+    if not ref or not alt:
+        # 已到序列起点, 改为在右侧补锚定碱基
+        base = sequence[pos - 1 + len(ref)]
+        ref, alt = ref + base, alt + base
     
-    mutserve_by_pos = defaultdict(list)
-    mutect2_by_pos = defaultdict(list)
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt = ref[1:], alt[1:]
+        pos += 1
+    return pos, ref, alt
+
+
+def matches_reference(sequence: str, pos: int, ref: str) -> bool:
+    expected = sequence[pos - 1:pos - 1 + len(ref)]
+    if expected == ref:
+        return True
+    return len(expected) == len(ref) and all(a == b or 'N' in (a, b) for a, b in zip(expected, ref))
+
+
+def _derive(v: Variant, pos: int, ref: str, alt: str) -> Variant:
+    """位置或等位基因改变后的新变异; 其余列仍与原记录共享原始字节"""
+    record = v.record
+    derived = VcfRecord(record.chrom, pos, ref, record.filter_status, record.qual_bytes, record.tail)
+    return Variant(derived, alt, v.source, v.alt_index)
+
+
+def normalize_variant(v: Variant, reference: ReferenceFasta, stats: NormalizationStats) -> list[Variant]:
+    sequence = reference.sequence(v.chrom)
+    ref, alt = v.ref.upper(), v.alt.upper()
+    if sequence is None or not ref or not alt or not NUCLEOTIDES.issuperset(ref + alt):
+        return [v]
+    if not matches_reference(sequence, v.pos, ref):
+        stats.ref_mismatch += 1
+        return [v]
     
-    for v in mutserve_variants:
-        mutserve_by_pos[v.position_key].append(v)
-    for v in mutect2_variants:
-        mutect2_by_pos[v.position_key].append(v)
+    pos, ref, alt = normalize_allele(sequence, v.pos, ref, alt)
+    if len(ref) == len(alt) > 1:
+        stats.decomposed += 1
+        return [_derive(v, pos + i, r, a) for i, (r, a) in enumerate(zip(ref, alt)) if r != a]
+    if (pos, ref, alt) == (v.pos, v.ref, v.alt):
+        return [v]
+    stats.realigned += 1
+    return [_derive(v, pos, ref, alt)]
+
+
+def normalize_variants(
+    variants: Iterable[Variant],
+    reference: ReferenceFasta,
+    stats: NormalizationStats
+) -> Iterator[Variant]:
+    """
+    流式标准化: 左对齐可以让 INDEL 沿重复序列一直前移到染色体起点, 没有固定的上限,
+    所以有参考序列的染色体整条缓冲, 换染色体时按位置稳定排序后输出 (rCRS 只有 16.5 kb);
+    参考中没有的染色体不会移位, 直接流式输出. 同一位置保持输入顺序
+    """
+    buffer: list[Variant] = []
+    chrom = None
+    shifts = False
+    for v in variants:
+        if v.chrom != chrom:
+            buffer.sort(key=attrgetter('pos'))
+            yield from buffer
+            buffer.clear()
+            chrom = v.chrom
+            shifts = reference.sequence(chrom) is not None
+        if shifts:
+            buffer.extend(normalize_variant(v, reference, stats))
+        else:
+            yield v
+    buffer.sort(key=attrgetter('pos'))
+    yield from buffer
+
+
+# 默认融合规则表 (PMID:38709886): SNV 只取 Mutserve, INDEL 优先取 Mutect2,
+# Mutect2 的 INDEL 覆盖同一位置的 SNV; --rules 可以换成任意多个工具的规则表
+DEFAULT_RULES = {
+    'precedence': {
+        'snv': ['mutserve'],
+        'indel': ['mutect2', 'mutserve']
+    },
+    'indel_overrides_snv': ['mutect2'],
+    'confidence': {
+        'consensus': 1.0,
+        'snv': {'mutserve': 0.85, 'mutect2': 0.60},
+        'indel': {'mutserve': 0.70, 'mutect2': 0.80},
+        'default': 0.5
+    }
+}
+
+
+def calculate_confidence(variant: Variant, in_both: bool, rules: dict = DEFAULT_RULES) -> float:
+    confidence = rules['confidence']
+    if in_both:
+        return confidence['consensus']
+    return confidence['indel' if variant.is_indel else 'snv'].get(variant.source, confidence['default'])
+
+
+class UnsortedInputError(ValueError):
+    pass
+
+
+def contig_order(*headers: list[str]) -> dict[str, int]:
+    """按 ##contig 表头行的顺序为染色体编号, 未声明的染色体按首次出现追加"""
+    order: dict[str, int] = {}
+    for header_lines in headers:
+        for line in header_lines:
+            if not line.startswith('##contig=<'):
+                continue
+            for item in line[len('##contig=<'):].rstrip('>').split(','):
+                if item.startswith('ID='):
+                    order.setdefault(item[3:], len(order))
+                    break
+    return order
+
+
+def count_variant(stats: FusionStats, v: Variant, source: str) -> None:
+    if source == 'mutserve':
+        stats.mutserve_total += 1
+        if v.is_indel:
+            stats.mutserve_indels += 1
+        else:
+            stats.mutserve_snvs += 1
+    else:
+        stats.mutect2_total += 1
+        if v.is_indel:
+            stats.mutect2_indels += 1
+        else:
+            stats.mutect2_snvs += 1
+
+
+def count_inputs(variants: Iterable[Variant], stats: FusionStats, source: str) -> Iterator[Variant]:
+    for v in variants:
+        count_variant(stats, v, source)
+        yield v
+
+
+def group_by_position(
+    variants: Iterable[Variant],
+    contig_rank: dict[str, int],
+    source: str
+) -> Iterator[tuple[tuple[int, int], list[Variant]]]:
+    """
+    把相邻的同位置记录聚成一组, 同时校验输入按坐标排序.
+    是否排序只按本输入自己的顺序判断 (同一染色体的记录连续且位置递增), 不受其他输入影响;
+    归并用的键取共享的 contig_rank, 未声明的染色体按所有输入中首次出现的顺序编号,
+    本输入的染色体顺序与之矛盾时单独报错
+    """
+    seen_contigs = set()
+    last_chrom = None
+    last_key = None
+    for (chrom, pos), group in groupby(variants, key=attrgetter('position_key')):
+        sort_key = (contig_rank.setdefault(chrom, len(contig_rank)), pos)
+        if chrom != last_chrom:
+            if chrom in seen_contigs:
+                raise UnsortedInputError(f'{source} VCF is not coordinate-sorted at {chrom}:{pos}')
+            if last_key is not None and sort_key < last_key:
+                raise UnsortedInputError(
+                    f'{source} VCF orders contig {chrom} differently from the ##contig header lines '
+                    f'or the other inputs'
+                )
+            seen_contigs.add(chrom)
+            last_chrom = chrom
+        elif pos <= last_key[1]:
+            raise UnsortedInputError(f'{source} VCF is not coordinate-sorted at {chrom}:{pos}')
+        last_key = sort_key
+        yield sort_key, list(group)
+
+
+def co_group(grouped_streams: list[Iterator[tuple[tuple[int, int], list]]]) -> Iterator[tuple[tuple[int, int], list[list]]]:
+    """
+    多路归并: 同步遍历若干个已按位置分组的输入, 每次产出最小位置及
+    各输入在该位置上的记录组 (没有记录的输入给出空列表)
+    """
+    heads = [next(stream, None) for stream in grouped_streams]
+    while any(head is not None for head in heads):
+        sort_key = min(head[0] for head in heads if head is not None)
+        groups = []
+        for i, head in enumerate(heads):
+            if head is not None and head[0] == sort_key:
+                groups.append(head[1])
+                heads[i] = next(grouped_streams[i], None)
+            else:
+                groups.append([])
+        yield sort_key, groups
+
+
+def co_iterate(
+    mutserve_variants: Iterable[Variant],
+    mutect2_variants: Iterable[Variant],
+    stats: FusionStats,
+    contig_rank: Optional[dict[str, int]] = None
+) -> Iterator[tuple[list[Variant], list[Variant]]]:
+    """
+    双路归并: 同步遍历两个已按坐标排序的输入, 每次产出同一位置上
+    (Mutserve 记录, Mutect2 记录) 两组, 其中一组可以为空
+    """
+    if contig_rank is None:
+        contig_rank = {}
+    mutserve_groups = group_by_position(count_inputs(mutserve_variants, stats, 'mutserve'), contig_rank, 'Mutserve')
+    mutect2_groups = group_by_position(count_inputs(mutect2_variants, stats, 'mutect2'), contig_rank, 'Mutect2')
     
-    stats.mutserve_total = len(mutserve_variants)
-    stats.mutect2_total = len(mutect2_variants)
-    stats.mutserve_snvs = sum(1 for v in mutserve_variants if not v.is_indel)
-    stats.mutserve_indels = sum(1 for v in mutserve_variants if v.is_indel)
-    stats.mutect2_snvs = sum(1 for v in mutect2_variants if not v.is_indel)
-    stats.mutect2_indels = sum(1 for v in mutect2_variants if v.is_indel)
+    for _, (mutserve_group, mutect2_group) in co_group([mutserve_groups, mutect2_groups]):
+        yield mutserve_group, mutect2_group
+
+
+def annotate_fusion(v: Variant, in_both: bool, rules: dict = DEFAULT_RULES) -> None:
+    v.set_info('FUSION_SOURCE', v.source)
+    v.set_info('FUSION_CONFIDENCE', str(calculate_confidence(v, in_both, rules)))
+    if in_both:
+        v.set_info('BOTH_CALLERS', 'true')
+
+
+def _fuse_position(
+    mutserve_group: list[Variant],
+    mutect2_group: list[Variant],
+    stats: FusionStats
+) -> list[tuple[Variant, Optional[bool]]]:
+    """
+    单个位置上的融合规则, 返回 (变异, 是否两个工具都检出) 列表;
+    不修改变异本身, 以便队列模式下多个样本共享同一条记录
+    """
+    mutserve_keys = {v.key for v in mutserve_group}
+    mutect2_keys = {v.key for v in mutect2_group}
     
-    final_variants = []
+    fused = []
     processed_keys = set()
     
-    for v in mutect2_variants:
+    for v in mutect2_group:
         if v.is_indel:
-            v.info['FUSION_SOURCE'] = 'mutect2'
-            v.info['FUSION_CONFIDENCE'] = str(calculate_confidence(v, v.key in mutserve_by_key))
-            if v.key in mutserve_by_key:
-                v.info['BOTH_CALLERS'] = 'true'
+            if v.key in mutserve_keys:
                 stats.both_callers += 1
             else:
                 stats.mutect2_only += 1
-            final_variants.append(v)
+            fused.append((v, v.key in mutserve_keys))
             processed_keys.add(v.key)
             stats.fusion_indels_from_mutect2 += 1
             
-            mutserve_at_pos = mutserve_by_pos.get(v.position_key, [])
-            for mv in mutserve_at_pos:
+            for mv in mutserve_group:
                 if not mv.is_indel and mv.key not in processed_keys:
                     stats.conflicts_resolved += 1
                     processed_keys.add(mv.key)
     
-    for v in mutserve_variants:
+    for v in mutserve_group:
         if v.key in processed_keys:
             continue
         
         if not v.is_indel:
-            v.info['FUSION_SOURCE'] = 'mutserve'
-            v.info['FUSION_CONFIDENCE'] = str(calculate_confidence(v, v.key in mutect2_by_key))
-            if v.key in mutect2_by_key:
-                v.info['BOTH_CALLERS'] = 'true'
+            if v.key in mutect2_keys:
                 stats.both_callers += 1
             else:
                 stats.mutserve_only += 1
-            final_variants.append(v)
+            fused.append((v, v.key in mutect2_keys))
             processed_keys.add(v.key)
             stats.fusion_snvs_from_mutserve += 1
         else:
-            if v.key not in mutect2_by_key:
-                v.info['FUSION_SOURCE'] = 'mutserve'
-                v.info['FUSION_CONFIDENCE'] = str(calculate_confidence(v, False))
-                final_variants.append(v)
+            if v.key not in mutect2_keys:
+                fused.append((v, False))
                 processed_keys.add(v.key)
                 stats.mutserve_only += 1
     
-    final_variants.sort(key=lambda x: (x.chrom, x.pos))
-    stats.final_variants = len(final_variants)
-    
-    return final_variants
+    return fused
 
 
-def write_vcf(
-    output_path: Path,
-    header_lines: list[str],
-    variants: list[Variant],
-    mode: str
-) -> None:
-    fusion_header_lines = [
-        '##INFO=<ID=FUSION_SOURCE,Number=1,Type=String,Description="Source caller in fusion mode (mutserve/mutect2)">',
-        '##INFO=<ID=FUSION_CONFIDENCE,Number=1,Type=Float,Description="Fusion confidence score (0-1)">',
-        '##INFO=<ID=BOTH_CALLERS,Number=0,Type=Flag,Description="Variant called by both callers">',
-        f'##mtdna_fusion_merger_mode={mode}',
-        '##mtdna_fusion_merger_version=1.0.0',
-        '##mtdna_fusion_merger_reference=PMID:38709886'
-    ]
+def _intersect_position(
+    mutserve_group: list[Variant],
+    mutect2_group: list[Variant],
+    stats: FusionStats
+) -> list[tuple[Variant, Optional[bool]]]:
+    mutect2_keys = {v.key for v in mutect2_group}
+    common = [(v, None) for v in mutserve_group if v.key in mutect2_keys]
+    stats.both_callers += len(common)
+    return common
+
+
+def _union_position(
+    mutserve_group: list[Variant],
+    mutect2_group: list[Variant],
+    stats: FusionStats
+) -> list[tuple[Variant, Optional[bool]]]:
+    by_key = {v.key: v for v in mutect2_group}
+    by_key.update({v.key: v for v in mutserve_group})
+    return [(v, None) for v in by_key.values()]
+
+
+POSITION_RULES = {
+    'fusion': _fuse_position,
+    'intersection': _intersect_position,
+    'union': _union_position,
+}
+
+
+PROVENANCE_FORMAT = 'mtdna_fusion_merger_provenance'
+
+
+class ProvenanceWriter:
+    """
+    逐位置写出 JSON Lines 来源记录, 内存与输入大小无关: 第一行是表头, 之后每个变异键一行
+    (参与的工具、触发的规则、是否输出), 最后一行是与 FusionStats 相同的计数.
+    规则由位置组和合并规则的结果推出, 不改变合并本身; 路径以 .gz 结尾时写 gzip
+    """
+    
+    KEPT_RULES = {'intersection': 'called_by_both', 'union': 'union'}
+    
+    def __init__(self, path: Path, mode: str):
+        self.path = path
+        self.mode = mode
+        if path.suffix == '.gz':
+            self._handle = gzip.open(path, 'wt', compresslevel=6)
+        else:
+            self._handle = open(path, 'w', buffering=READ_CHUNK_SIZE)
+        self._encode = json.JSONEncoder(separators=(',', ':')).encode
+        self._write({'type': 'header', 'format': PROVENANCE_FORMAT, 'version': 1, 'mode': mode,
+                     'reference': 'PMID:38709886'})
+    
+    def _write(self, entry: dict) -> None:
+        self._handle.write(self._encode(entry))
+        self._handle.write('\n')
+    
+    def _kept_rule(self, v: Variant) -> str:
+        if self.mode != 'fusion':
+            return self.KEPT_RULES[self.mode]
+        if v.source == 'mutect2':
+            return 'indel_from_mutect2'
+        return 'mutserve_only_indel' if v.is_indel else 'snv_from_mutserve'
+    
+    def _dropped_rule(self, v: Variant, overriding_indel: bool) -> str:
+        if self.mode == 'intersection':
+            return 'not_called_by_both'
+        if not v.is_indel and overriding_indel:
+            return 'indel_overrides_snv'
+        return 'mutect2_snv_not_trusted' if v.source == 'mutect2' and not v.is_indel else 'not_selected'
+    
+    def position(
+        self,
+        mutserve_group: list[Variant],
+        mutect2_group: list[Variant],
+        fused: list[tuple[Variant, Optional[bool]]]
+    ) -> None:
+        records: dict[tuple, Variant] = {}
+        callers: dict[tuple, list[str]] = {}
+        for source, group in (('mutserve', mutserve_group), ('mutect2', mutect2_group)):
+            for v in group:
+                records.setdefault(v.key, v)
+                names = callers.setdefault(v.key, [])
+                if source not in names:
+                    names.append(source)
+        kept = {}
+        for v, in_both in fused:
+            kept.setdefault(v.key, (v, in_both))
+        overriding_indel = any(v.is_indel for v in mutect2_group)
+        
+        for key, names in callers.items():
+            entry = kept.get(key)
+            v = entry[0] if entry else records[key]
+            line = {
+                'type': 'variant', 'chrom': v.chrom, 'pos': v.pos, 'ref': v.ref, 'alt': v.alt,
+                'variant_type': 'indel' if v.is_indel else 'snv', 'callers': names, 'source': v.source,
+                'output': entry is not None
+            }
+            if entry is None:
+                line['rule'] = self._dropped_rule(v, overriding_indel)
+            else:
+                line['rule'] = self._kept_rule(v)
+                if entry[1] is not None:
+                    line['confidence'] = calculate_confidence(v, entry[1])
+            self._write(line)
+    
+    def write_summary(self, stats: FusionStats, **extra) -> None:
+        self._write({'type': 'summary', 'statistics': asdict(stats), **extra})
+    
+    def close(self) -> None:
+        self._handle.close()
+    
+    def __enter__(self) -> 'ProvenanceWriter':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def merge_variants(
+    mutserve_variants: Iterable[Variant],
+    mutect2_variants: Iterable[Variant],
+    stats: FusionStats,
+    mode: str = 'fusion',
+    contig_rank: Optional[dict[str, int]] = None,
+    key_index: Optional[dict] = None,
+    provenance: Optional[ProvenanceWriter] = None
+) -> Iterator[Variant]:
+    """
+    对两个已按坐标排序的输入做流式归并, 逐位置应用合并规则并立即产出,
+    内存只与单个位置上的记录数有关, 输出顺序即输入顺序, 无需最终排序;
+    给出 key_index 时顺带记录每个位置上两个工具各自的变异键, 供增量融合使用;
+    给出 provenance 时逐位置写出每个变异键的来源记录
+    """
+    rule = POSITION_RULES[mode]
+    for mutserve_group, mutect2_group in co_iterate(mutserve_variants, mutect2_variants, stats, contig_rank):
+        if key_index is not None:
+            position = (mutserve_group or mutect2_group)[0].position_key
+            key_index[position] = ([v.key for v in mutserve_group], [v.key for v in mutect2_group])
+        fused = rule(mutserve_group, mutect2_group, stats)
+        if provenance is not None:
+            provenance.position(mutserve_group, mutect2_group, fused)
+        for v, in_both in fused:
+            if in_both is not None:
+                annotate_fusion(v, in_both)
+            stats.final_variants += 1
+            yield v
+
+
+def fusion_merge(
+    mutserve_variants: Iterable[Variant],
+    mutect2_variants: Iterable[Variant],
+    stats: FusionStats,
+    contig_rank: Optional[dict[str, int]] = None
+) -> Iterator[Variant]:
+    return merge_variants(mutserve_variants, mutect2_variants, stats, 'fusion', contig_rank)
+
+
+# 未排序输入的交集/并集: 每个变异键压缩成一个 64 位整数放进 NumPy 数组, 用有序数组集合运算代替
+# 逐位置归并; 高位依次是 contig 序号和位置, 所以排好序的键就是坐标顺序, 结果无需再单独排序
+# 位置 28 位可到 268,435,455, 覆盖最长的人类染色体 (chr1, 248,956,422)
+PACKED_POS_BITS = 28
+PACKED_ALLELE_BITS = 24
+PACKED_MAX_CONTIGS = 1 << (64 - PACKED_POS_BITS - PACKED_ALLELE_BITS)
+PACKED_INLINE_BASES = 8
+PACKED_OVERFLOW = 1 << (PACKED_ALLELE_BITS - 1)
+BASE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+
+
+class KeyPacker:
+    """
+    把 (chrom, pos, ref, alt) 压缩成 64 位整数: contig 序号 12 位 | 位置 28 位 | 等位基因 24 位.
+    等位基因字段最高位为 0 时内联存放 REF/ALT 长度 (各 3 位) 和每个碱基 2 位, 合计最多 8 个碱基;
+    更长或含 ACGT 以外字符的等位基因最高位为 1, 低位是溢出表中的编号, 两个输入共用同一张表
+    """
+    
+    def __init__(self, contig_rank: dict[str, int]):
+        self.contig_rank = contig_rank
+        self.overflow: list[tuple[str, str]] = []
+        self._alleles: dict[tuple[str, str], int] = {}
+    
+    def _encode(self, ref: str, alt: str) -> int:
+        bases = ref + alt
+        if len(bases) <= PACKED_INLINE_BASES and all(base in BASE_CODES for base in bases):
+            code = (len(ref) - 1) << 2 * PACKED_INLINE_BASES + 3 | (len(alt) - 1) << 2 * PACKED_INLINE_BASES
+            for i, base in enumerate(bases):
+                code |= BASE_CODES[base] << 2 * (PACKED_INLINE_BASES - 1 - i)
+            return code
+        if len(self.overflow) >= PACKED_OVERFLOW:
+            raise ValueError('too many distinct long alleles for packed variant keys')
+        self.overflow.append((ref, alt))
+        return PACKED_OVERFLOW | len(self.overflow) - 1
+    
+    def pack(self, v: Variant) -> int:
+        record = v.record
+        alleles = (record.ref, v.alt)
+        code = self._alleles.get(alleles)
+        if code is None:
+            code = self._alleles[alleles] = self._encode(*alleles)
+        rank = self.contig_rank.setdefault(record.chrom, len(self.contig_rank))
+        if rank >= PACKED_MAX_CONTIGS or record.pos >> PACKED_POS_BITS:
+            raise ValueError(f'{record.chrom}:{record.pos} does not fit in a packed variant key')
+        return (rank << PACKED_POS_BITS | record.pos) << PACKED_ALLELE_BITS | code
+    
+    def pack_all(self, np, variants: Iterable[Variant]):
+        return np.fromiter(map(self.pack, variants), dtype=np.uint64)
+
+
+def packed_set_merge(
+    mutserve_variants: Iterable[Variant],
+    mutect2_variants: Iterable[Variant],
+    stats: FusionStats,
+    mode: str,
+    contig_rank: Optional[dict[str, int]] = None
+) -> Iterator[Variant]:
+    """
+    不要求输入排序的交集/并集: 读入全部记录, 键压缩后做集合运算, 按压缩键顺序产出.
+    结果集合与流式归并相同; 同一位置内的记录按等位基因编码排序.
+    交集只需要 Mutect2 的键, 不保留其记录
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ValueError('NumPy is required for --unsorted') from None
+    
+    packer = KeyPacker(contig_order() if contig_rank is None else contig_rank)
+    mutserve = list(count_inputs(mutserve_variants, stats, 'mutserve'))
+    mutserve_keys = packer.pack_all(np, mutserve)
+    if mode == 'intersection':
+        mutect2_keys = packer.pack_all(np, count_inputs(mutect2_variants, stats, 'mutect2'))
+        # 与 _intersect_position 一致: Mutserve 中键也被 Mutect2 检出的记录都保留 (包括重复键)
+        common = np.intersect1d(mutserve_keys, mutect2_keys, assume_unique=False)
+        selected = np.flatnonzero(np.isin(mutserve_keys, common))
+        selected = selected[np.argsort(mutserve_keys[selected], kind='stable')]
+        variants = mutserve
+        stats.both_callers += len(selected)
+    elif mode == 'union':
+        mutect2 = list(count_inputs(mutect2_variants, stats, 'mutect2'))
+        variants = mutect2 + mutserve
+        keys = np.concatenate([packer.pack_all(np, mutect2), mutserve_keys])
+        # 与 _union_position 一致: 同一个键只输出一条, 两个工具都检出时取 Mutserve 的记录 (后出现者)
+        _, last = np.unique(keys[::-1], return_index=True)
+        selected = len(keys) - 1 - last
+    else:
+        raise ValueError(f'--unsorted only supports intersection and union, not {mode}')
+    
+    for i in selected.tolist():
+        stats.final_variants += 1
+        yield variants[i]
+
+
+# 异质性 (VAF) 调和: 融合时保留两个工具各自的 AF/DP, 按批装入 NumPy 数组,
+# 向量化计算按深度加权的合并估计、Wilson 置信区间和两工具间的不一致;
+# 两个工具读的是同一个 BAM, 所以区间和 FUSION_DP 用两者深度的较大值, 不把同一批 reads 算两次
+VAF_BATCH_SIZE = 65536
+VAF_Z = 1.96
+
+VAF_HEADER_LINES = [
+    '##INFO=<ID=FUSION_AF,Number=1,Type=Float,Description="Depth-weighted heteroplasmy level combined across callers">',
+    '##INFO=<ID=FUSION_AF_CI,Number=2,Type=Float,Description="95% Wilson confidence interval of FUSION_AF">',
+    '##INFO=<ID=FUSION_DP,Number=1,Type=Integer,Description="Read depth behind FUSION_AF (maximum over callers)">',
+    '##INFO=<ID=MUTSERVE_AF,Number=1,Type=Float,Description="Allele fraction reported by Mutserve">',
+    '##INFO=<ID=MUTECT2_AF,Number=1,Type=Float,Description="Allele fraction reported by Mutect2">',
+    '##INFO=<ID=VAF_DISCORDANT,Number=0,Type=Flag,Description="Callers disagree on the allele fraction by more than the threshold">',
+]
+
+
+def _typed_items(value) -> list:
+    """VcfHeader 解码后的值统一成列表; 未声明的字段仍是原始文本, 按逗号拆分, '.' 转成 None"""
+    if value is None or value is True:
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [None if item in ('', '.') else item for item in value.split(',')]
+    return [value]
+
+
+def allele_fraction(v: Optional[Variant], header: 'VcfHeader') -> tuple[float, float]:
+    """
+    第一个携带该 ALT 的样本列中的 (AF, DP), 按该工具表头声明的类型解码;
+    DP 依次取 FORMAT/DP、INFO/DP、AD 之和, 缺失为 nan
+    """
+    carrier = None if v is None else next(
+        (i for i in range(len(v.sample_data)) if carries_variant(v, i)), None
+    )
+    if carrier is None:
+        return float('nan'), float('nan')
+    
+    af_values = _typed_items(header.sample_value(v.record, 'AF', carrier))
+    af = af_values[v.alt_index - 1] if v.alt_index <= len(af_values) else None
+    
+    depth_values = (_typed_items(header.sample_value(v.record, 'DP', carrier))
+                    or _typed_items(header.info_value(v.record, 'DP')))
+    depth = depth_values[0] if depth_values else None
+    if depth is None:
+        ad = [x for x in _typed_items(header.sample_value(v.record, 'AD', carrier)) if x is not None]
+        depth = sum(int(x) for x in ad) if ad else None
+    return (float(af) if af is not None else float('nan'),
+            float(depth) if depth is not None else float('nan'))
+
+
+def fusion_merge_with_partners(
+    mutserve_variants: Iterable[Variant],
+    mutect2_variants: Iterable[Variant],
+    stats: FusionStats,
+    contig_rank: Optional[dict[str, int]] = None,
+    provenance: Optional[ProvenanceWriter] = None
+) -> Iterator[tuple[Variant, Optional[Variant], Optional[Variant]]]:
+    """与 fusion_merge 相同, 但同时给出两个工具在该变异上的记录 (没有检出时为 None)"""
+    for mutserve_group, mutect2_group in co_iterate(mutserve_variants, mutect2_variants, stats, contig_rank):
+        mutserve_by_key = {v.key: v for v in mutserve_group}
+        mutect2_by_key = {v.key: v for v in mutect2_group}
+        fused = _fuse_position(mutserve_group, mutect2_group, stats)
+        if provenance is not None:
+            provenance.position(mutserve_group, mutect2_group, fused)
+        for v, in_both in fused:
+            annotate_fusion(v, in_both)
+            stats.final_variants += 1
+            yield v, mutserve_by_key.get(v.key), mutect2_by_key.get(v.key)
+
+
+def _reconcile_batch(
+    np,
+    batch: list,
+    stats: FusionStats,
+    threshold: float,
+    headers: dict[str, 'VcfHeader']
+) -> list[Variant]:
+    mutserve_header, mutect2_header = headers['mutserve'], headers['mutect2']
+    values = np.array([allele_fraction(ms, mutserve_header) + allele_fraction(m2, mutect2_header)
+                       for _, ms, m2 in batch], dtype=float).reshape(-1, 4)
+    mutserve_af, mutserve_dp, mutect2_af, mutect2_dp = values.T
+    
+    has_mutserve = ~np.isnan(mutserve_af)
+    has_mutect2 = ~np.isnan(mutect2_af)
+    mutserve_weight = np.where(has_mutserve, np.nan_to_num(mutserve_dp), 0.0)
+    mutect2_weight = np.where(has_mutect2, np.nan_to_num(mutect2_dp), 0.0)
+    depth = np.maximum(mutserve_weight, mutect2_weight)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted = ((np.nan_to_num(mutserve_af) * mutserve_weight + np.nan_to_num(mutect2_af) * mutect2_weight)
+                    / (mutserve_weight + mutect2_weight))
+        # 没有深度时退化为两个 AF 的算术平均, 不给置信区间
+        unweighted = (np.nan_to_num(mutserve_af) + np.nan_to_num(mutect2_af)) / (has_mutserve + has_mutect2)
+        pooled = np.where(depth > 0, weighted, unweighted)
+        
+        z2 = VAF_Z * VAF_Z
+        denominator = 1 + z2 / depth
+        center = (pooled + z2 / (2 * depth)) / denominator
+        half_width = VAF_Z * np.sqrt(pooled * (1 - pooled) / depth + z2 / (4 * depth * depth)) / denominator
+        lower = np.where(depth > 0, np.clip(center - half_width, 0, 1), np.nan)
+        upper = np.where(depth > 0, np.clip(center + half_width, 0, 1), np.nan)
+    
+    both = has_mutserve & has_mutect2
+    discordant = both & (np.abs(mutserve_af - mutect2_af) > threshold)
+    stats.vaf_both_callers += int(both.sum())
+    stats.vaf_discordant += int(discordant.sum())
     
-    output_lines: list[str] = []
+    text = {name: np.char.mod('%.4f', array) for name, array in
+            (('pooled', pooled), ('lower', lower), ('upper', upper), ('mutserve', mutserve_af), ('mutect2', mutect2_af))}
+    merged = []
+    for i, (v, _, _) in enumerate(batch):
+        if not np.isnan(pooled[i]):
+            v.set_info('FUSION_AF', text['pooled'][i])
+            if depth[i] > 0:
+                v.set_info('FUSION_AF_CI', f"{text['lower'][i]},{text['upper'][i]}")
+                v.set_info('FUSION_DP', int(depth[i]))
+        if has_mutserve[i]:
+            v.set_info('MUTSERVE_AF', text['mutserve'][i])
+        if has_mutect2[i]:
+            v.set_info('MUTECT2_AF', text['mutect2'][i])
+        if discordant[i]:
+            v.set_info('VAF_DISCORDANT', True)
+        merged.append(v)
+    return merged
+
+
+def reconcile_vaf(
+    fused: Iterable[tuple[Variant, Optional[Variant], Optional[Variant]]],
+    stats: FusionStats,
+    headers: dict[str, 'VcfHeader'],
+    threshold: float = 0.1,
+    batch_size: int = VAF_BATCH_SIZE
+) -> Iterator[Variant]:
+    """按批调和 VAF 并产出融合后的变异, 内存只与批大小有关; headers 是两个工具各自的表头, 用于解码 AF/DP"""
+    try:
+        import numpy as np
+    except ImportError:
+        raise ValueError('NumPy is required for --reconcile-vaf') from None
     
-    for line in header_lines:
+    batch = []
+    for item in fused:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield from _reconcile_batch(np, batch, stats, threshold, headers)
+            batch = []
+    if batch:
+        yield from _reconcile_batch(np, batch, stats, threshold, headers)
+
+
+# 表头合并: 把各输入的 ##INFO/##FORMAT/##FILTER/##contig 等定义按 (类别, ID) 去重成一份带类型的表头,
+# 这样 Mutect2 来源的记录所用字段也有声明; 同一 ID 定义不一致时放宽到能同时容纳两者的 Number/Type
+# 只有 Integer 和 Float 之间能放宽成数值类型; Character 只容纳一个字符, 其余不一致都放宽成 String
+HEADER_NUMERIC_TYPES = {'Integer', 'Float'}
+HEADER_QUOTED_KEYS = ('Description', 'Source', 'Version')
+
+
+def parse_header_attributes(text: str) -> dict[str, str]:
+    """解析 <ID=..,Description="..."> 内的键值对; 引号中的逗号不拆分, \\" 是转义的引号"""
+    attrs: dict[str, str] = {}
+    i, n = 0, len(text)
+    while i < n:
+        eq = text.find('=', i)
+        if eq < 0:
+            break
+        key = text[i:eq].strip()
+        if eq + 1 < n and text[eq + 1] == '"':
+            value = []
+            j = eq + 2
+            while j < n and text[j] != '"':
+                if text[j] == '\\' and j + 1 < n:
+                    j += 1
+                value.append(text[j])
+                j += 1
+            attrs[key] = ''.join(value)
+            comma = text.find(',', j)
+        else:
+            comma = text.find(',', eq + 1)
+            attrs[key] = text[eq + 1:comma if comma >= 0 else n]
+        i = comma + 1 if comma >= 0 else n
+    return attrs
+
+
+def format_header_line(kind: str, attrs: dict[str, str]) -> str:
+    items = []
+    for key, value in attrs.items():
+        if key in HEADER_QUOTED_KEYS or any(c in value for c in ',"<> '):
+            value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        items.append(f'{key}={value}')
+    return f'##{kind}=<{",".join(items)}>'
+
+
+@dataclass
+class HeaderField:
+    """一条带 ID 的结构化表头定义; parse() 按 Number/Type 把 INFO/FORMAT 的文本值转成 Python 值"""
+    kind: str
+    id: str
+    attrs: dict
+    line: str
+    source: str = ''
+    
+    @property
+    def number(self) -> str:
+        return self.attrs.get('Number', '.')
+    
+    @property
+    def type(self) -> str:
+        return self.attrs.get('Type', 'String')
+    
+    def parse(self, value):
+        """
+        Flag 返回 True; Number 为 0/1 且只有一个值时返回单个值, 否则返回列表
+        (Mutserve 把多等位的 AF 声明为 Number=1); '.' 转成 None, 与声明类型不符的值保留为原始文本
+        """
+        if value is True or self.type == 'Flag':
+            return True
+        convert = {'Integer': int, 'Float': float}.get(self.type, str)
+        items = []
+        for item in value.split(','):
+            try:
+                items.append(None if item in ('', '.') else convert(item))
+            except ValueError:
+                items.append(item)
+        return items[0] if self.number in ('0', '1') and len(items) == 1 else items
+
+
+class VcfHeader:
+    """
+    去重后的表头: ##fileformat 取第一个输入, 其余元信息行原样去重,
+    结构化定义按 (类别, ID) 去重并保留首次出现的位置和描述; #CHROM 行取第一个输入
+    """
+    
+    def __init__(self):
+        self.fileformat: Optional[str] = None
+        self.column_line: Optional[str] = None
+        self.fields: dict[tuple[str, str], HeaderField] = {}
+        self._entries: dict[tuple[str, str], Optional[str]] = {}
+        self.conflicts: list[str] = []
+        self.widened: list[str] = []
+    
+    def add(self, line: str, source: str = '', replace: bool = False) -> None:
+        """
+        加入一行表头; replace=True 用于本工具自己的定义,
+        直接替换已有的同 ID 定义并移到末尾
+        """
+        if line.startswith('##fileformat='):
+            self.fileformat = self.fileformat or line
+            return
         if line.startswith('#CHROM'):
-            for fh in fusion_header_lines:
-                output_lines.append(fh)
-        output_lines.append(line)
+            self.column_line = self.column_line or line
+            return
+        
+        kind, _, value = line[2:].partition('=')
+        attrs = parse_header_attributes(value[1:-1]) if value.startswith('<') and value.endswith('>') else {}
+        if 'ID' not in attrs:
+            self._entries.setdefault(('', line), None)
+            return
+        
+        key = (kind, attrs['ID'])
+        existing = self.fields.get(key)
+        if existing is None or replace:
+            self._entries.pop(key, None)
+            self._entries[key] = None
+            self.fields[key] = HeaderField(kind, attrs['ID'], attrs, line, source)
+        elif attrs != existing.attrs:
+            self._resolve(existing, attrs, source)
+    
+    def merge(self, lines: Iterable[str], source: str = '') -> 'VcfHeader':
+        for line in lines:
+            self.add(line, source)
+        return self
+    
+    def _resolve(self, existing: HeaderField, attrs: dict, source: str) -> None:
+        """
+        INFO/FORMAT 的 Number/Type 不一致时放宽并记入 widened;
+        contig 长度不一致时保留第一个并记入 conflicts
+        """
+        name = f'{existing.kind}/{existing.id}'
+        if existing.kind == 'contig':
+            if attrs.get('length', existing.attrs.get('length')) != existing.attrs.get('length'):
+                self.conflicts.append(f'{name}: length {existing.attrs.get("length")} ({existing.source}) vs '
+                                      f'{attrs["length"]} ({source}), keeping the first')
+            return
+        if existing.kind not in ('INFO', 'FORMAT'):
+            return
+        
+        merged = dict(existing.attrs)
+        number = attrs.get('Number', '.')
+        if number != existing.number:
+            merged['Number'] = '.'
+        field_type = attrs.get('Type', 'String')
+        if field_type != existing.type:
+            merged['Type'] = 'Float' if {field_type, existing.type} == HEADER_NUMERIC_TYPES else 'String'
+            if merged['Number'] == '0':
+                merged['Number'] = '.'
+        if merged == existing.attrs:
+            return
+        self.widened.append(
+            f'{name}: Number={existing.number},Type={existing.type} ({existing.source}) vs '
+            f'Number={number},Type={field_type} ({source}), '
+            f'merged as Number={merged["Number"]},Type={merged["Type"]}'
+        )
+        existing.attrs = merged
+        existing.line = format_header_line(existing.kind, merged)
+    
+    def get(self, kind: str, field_id: str) -> Optional[HeaderField]:
+        return self.fields.get((kind, field_id))
     
+    def info_value(self, record: VcfRecord, key: str):
+        """按表头类型解码的 INFO 值; 未声明的字段按 String 处理, 缺失返回 None"""
+        value = record.info.get(key)
+        if value is None:
+            return None
+        definition = self.fields.get(('INFO', key))
+        return definition.parse(value) if definition is not None else value
+    
+    def sample_value(self, record: VcfRecord, key: str, sample: int = 0):
+        """按表头类型解码的第 sample 个样本的 FORMAT 值, 缺失返回 None"""
+        try:
+            value = record.sample_data[sample][record.format_fields.index(key)]
+        except (IndexError, ValueError):
+            return None
+        definition = self.fields.get(('FORMAT', key))
+        return definition.parse(value) if definition is not None else value
+    
+    def lines(self) -> list[str]:
+        lines = [self.fileformat] if self.fileformat else []
+        for key in self._entries:
+            lines.append(key[1] if key[0] == '' else self.fields[key].line)
+        if self.column_line:
+            lines.append(self.column_line)
+        return lines
+
+
+def merge_headers(*sources: tuple[str, list[str]]) -> VcfHeader:
+    """
+    按给定顺序合并 (来源, 表头行); 放宽成功的定义 (如两个工具的 FORMAT/AF) 只记入 widened 供报告使用,
+    无法调和的冲突告警写到 stderr
+    """
+    header = VcfHeader()
+    for source, lines in sources:
+        header.merge(lines, source)
+    for conflict in header.conflicts:
+        print(f'Warning: header conflict {conflict}', file=sys.stderr)
+    return header
+
+
+def write_vcf(
+    output_path: Path,
+    header_lines: list[str],
+    variants: Iterable[Variant],
+    mode: str,
+    compress: bool = False,
+    extra_header_lines: Iterable[str] = (),
+    profiler: Optional[Profiler] = None
+) -> None:
+    fusion_header_lines = [
+        '##INFO=<ID=FUSION_SOURCE,Number=1,Type=String,Description="Source caller in fusion mode (mutserve/mutect2)">',
+        '##INFO=<ID=FUSION_CONFIDENCE,Number=1,Type=Float,Description="Fusion confidence score (0-1)">',
+        '##INFO=<ID=BOTH_CALLERS,Number=0,Type=Flag,Description="Variant called by both callers">',
+        *extra_header_lines,
+        f'##mtdna_fusion_merger_mode={mode}',
+        '##mtdna_fusion_merger_version=1.0.0',
+        '##mtdna_fusion_merger_reference=PMID:38709886'
+    ]
+    
+    # 以本工具的输出为模板时 (增量融合), 旧的融合头部行被本次的定义替换, 不会重复
+    header = VcfHeader().merge(line for line in header_lines if not line.startswith('##mtdna_fusion_merger_'))
+    for line in fusion_header_lines:
+        header.add(line, replace=True)
+    
+    with profile_phase(profiler, 'write') as timing, VcfOutput(output_path, compress, profiler) as out:
+        for line in header.lines():
+            out.write_header(line)
+        
+        write_record = out.write_record
+        written = 0
+        for v in variants:
+            record = v.record
+            write_record(record.chrom, record.pos, record.ref, v.to_line())
+            written += 1
+    if timing is not None:
+        timing.records += written
+        timing.bytes += output_path.stat().st_size
+
+
+# 列式输出 (需要 pyarrow): 每个样本一个 Parquet row group 或 Arrow IPC record batch,
+# 下游队列查询可以内存映射并只扫描需要的列, 不必重新解析文本 VCF
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+
+@dataclass
+class SampleColumns:
+    sample: str = ''
+    chrom: list = field(default_factory=list)
+    pos: list = field(default_factory=list)
+    ref: list = field(default_factory=list)
+    alt: list = field(default_factory=list)
+    source: list = field(default_factory=list)
+    fusion_confidence: list = field(default_factory=list)
+    both_callers: list = field(default_factory=list)
+    vaf: list = field(default_factory=list)
+    depth: list = field(default_factory=list)
+    
+    def append(self, chrom: str, pos: int, ref: str, alt: str, source: str, confidence: Optional[float],
+               both: Optional[bool], vaf: Optional[float], depth: Optional[int]) -> None:
+        self.chrom.append(chrom)
+        self.pos.append(pos)
+        self.ref.append(ref)
+        self.alt.append(alt)
+        self.source.append(source)
+        self.fusion_confidence.append(confidence)
+        self.both_callers.append(both)
+        self.vaf.append(vaf)
+        self.depth.append(depth)
+
+
+def _optional_number(value, convert):
+    if value in (None, '', '.', True):
+        return None
+    number = convert(float(value))
+    return None if number != number else number
+
+
+def append_variant(columns: SampleColumns, v: Variant, headers: dict[str, VcfHeader]) -> None:
+    """
+    取融合输出记录的列值: 调和过 VAF 时取 FUSION_AF/FUSION_DP, 否则按来源工具的表头 (headers) 取 AF/DP;
+    BOTH_CALLERS 只在融合模式下有意义, 其他模式为空
+    """
+    info = v.info
+    if 'FUSION_AF' in info:
+        af, depth = info['FUSION_AF'], info.get('FUSION_DP')
+    else:
+        af, depth = allele_fraction(v, headers.get(v.source) or VcfHeader())
+    both = True if 'BOTH_CALLERS' in info else (False if 'FUSION_SOURCE' in info else None)
+    columns.append(v.chrom, v.pos, v.ref, v.alt, v.source,
+                   _optional_number(info.get('FUSION_CONFIDENCE'), float), both,
+                   _optional_number(af, float), _optional_number(depth, int))
+
+
+def collect_columns(
+    variants: Iterable[Variant],
+    columns: SampleColumns,
+    headers: dict[str, VcfHeader]
+) -> Iterator[Variant]:
     for v in variants:
-        info_str = ';'.join(
-            f'{k}={v_val}' if v_val is not True else k 
-            for k, v_val in v.info.items()
+        append_variant(columns, v, headers)
+        yield v
+
+
+class ColumnarWriter:
+    """按样本写出列式文件; 后缀为 .arrow/.feather/.ipc 时写 Arrow IPC, 否则写 Parquet"""
+    
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError('pyarrow is required for --columnar') from None
+        self._pa = pa
+        self.path = path
+        self.schema = pa.schema([
+            ('sample', pa.string()),
+            ('chrom', pa.string()),
+            ('pos', pa.int32()),
+            ('ref', pa.string()),
+            ('alt', pa.string()),
+            ('source', pa.string()),
+            ('fusion_confidence', pa.float32()),
+            ('both_callers', pa.bool_()),
+            ('vaf', pa.float32()),
+            ('depth', pa.int32())
+        ])
+        if path.suffix.lower() in ARROW_SUFFIXES:
+            self.format = 'arrow'
+            self._writer = pa.ipc.new_file(str(path), self.schema)
+        else:
+            import pyarrow.parquet as pq
+            self.format = 'parquet'
+            self._writer = pq.ParquetWriter(str(path), self.schema, compression='zstd')
+    
+    def write_sample(self, columns: SampleColumns) -> None:
+        rows = len(columns.pos)
+        if not rows:
+            return
+        pa = self._pa
+        batch = pa.record_batch([
+            pa.array([columns.sample] * rows, pa.string()),
+            *(pa.array(getattr(columns, name), self.schema.field(name).type) for name in self.schema.names[1:])
+        ], schema=self.schema)
+        if self.format == 'arrow':
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_batch(batch, row_group_size=rows)
+    
+    def close(self) -> None:
+        self._writer.close()
+    
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def default_sample_name(output_path: Path, *header_lines: list[str]) -> str:
+    """单样本输出的样本名: 取输入 VCF 中第一个样本列, 都没有时用输出文件名"""
+    for lines in header_lines:
+        names = sample_names(lines)
+        if names:
+            return names[0]
+    return output_path.name.split('.')[0]
+
+
+def merge_pair(
+    mutserve_vcf: Path,
+    mutect2_vcf: Path,
+    output_path: Path,
+    mode: str,
+    compress: bool = False,
+    regions: Optional[RegionSet] = None,
+    mutserve_index: Optional[Path] = None,
+    mutect2_index: Optional[Path] = None,
+    state_path: Optional[Path] = None,
+    vaf_threshold: Optional[float] = None,
+    reference: Optional[ReferenceFasta] = None,
+    normalization: Optional[NormalizationStats] = None,
+    profiler: Optional[Profiler] = None,
+    columns: Optional[SampleColumns] = None,
+    unsorted: bool = False,
+    provenance_path: Optional[Path] = None
+) -> FusionStats:
+    """
+    单个样本的完整流程: 流式读取两个 VCF, 合并并写出结果; 给出 state_path 时同时保存合并状态,
+    给出 vaf_threshold 时 (仅融合模式) 调和两个工具的 VAF 并标记差异超过阈值的位点,
+    给出 reference 时先对两个输入做标准化再生成键, 给出 profiler 时按阶段记录耗时,
+    给出 columns 时同时收集列式输出的各列; unsorted 时 (仅交集/并集) 不要求输入排序;
+    给出 provenance_path 时同一遍中写出逐变异的来源记录 (JSON Lines)
+    """
+    stats = FusionStats()
+    key_index = {} if state_path else None
+    with ExitStack() as stack:
+        with profile_phase(profiler, 'parse_mutserve'):
+            mutserve_reader = stack.enter_context(VcfReader(mutserve_vcf, 'mutserve', regions, mutserve_index))
+        with profile_phase(profiler, 'parse_mutect2'):
+            mutect2_reader = stack.enter_context(VcfReader(mutect2_vcf, 'mutect2', regions, mutect2_index))
+        provenance = stack.enter_context(ProvenanceWriter(provenance_path, mode)) if provenance_path else None
+        contig_rank = contig_order(mutserve_reader.header_lines, mutect2_reader.header_lines)
+        caller_headers = {'mutserve': VcfHeader().merge(mutserve_reader.header_lines),
+                          'mutect2': VcfHeader().merge(mutect2_reader.header_lines)}
+        mutserve_variants = profile_iterate(profiler, 'parse_mutserve', mutserve_reader)
+        mutect2_variants = profile_iterate(profiler, 'parse_mutect2', mutect2_reader)
+        if reference is not None:
+            normalization = normalization if normalization is not None else NormalizationStats()
+            mutserve_variants = profile_iterate(
+                profiler, 'normalize', normalize_variants(mutserve_variants, reference, normalization))
+            mutect2_variants = profile_iterate(
+                profiler, 'normalize', normalize_variants(mutect2_variants, reference, normalization))
+        if vaf_threshold is not None:
+            fused = profile_iterate(profiler, 'fusion', fusion_merge_with_partners(
+                mutserve_variants, mutect2_variants, stats, contig_rank, provenance))
+            merged = profile_iterate(profiler, 'reconcile_vaf', reconcile_vaf(fused, stats, caller_headers, vaf_threshold))
+            extra_header_lines = VAF_HEADER_LINES
+        elif unsorted:
+            merged = profile_iterate(profiler, 'fusion', packed_set_merge(
+                mutserve_variants, mutect2_variants, stats, mode, contig_rank))
+            extra_header_lines = []
+        else:
+            merged = profile_iterate(profiler, 'fusion', merge_variants(
+                mutserve_variants, mutect2_variants, stats, mode, contig_rank, key_index, provenance))
+            extra_header_lines = []
+        if columns is not None:
+            if not columns.sample:
+                columns.sample = default_sample_name(
+                    output_path, mutect2_reader.header_lines, mutserve_reader.header_lines)
+            merged = profile_iterate(profiler, 'columnar', collect_columns(merged, columns, caller_headers))
+        header = merge_headers(('mutserve', mutserve_reader.header_lines), ('mutect2', mutect2_reader.header_lines))
+        stats.header_widened = header.widened
+        write_vcf(output_path, header.lines(), merged, mode, compress, extra_header_lines, profiler)
+        if provenance is not None:
+            provenance.write_summary(stats)
+    if state_path:
+        with profile_phase(profiler, 'state'):
+            write_state(state_path, mode, mutserve_vcf, stats, key_index)
+    if profiler is not None and not regions:
+        # 只有整个文件都被读取时, 文件大小才是解析阶段处理的字节数
+        profiler.timing('parse_mutserve').bytes += mutserve_vcf.stat().st_size
+        profiler.timing('parse_mutect2').bytes += mutect2_vcf.stat().st_size
+    return stats
+
+
+# 按染色体并行融合: 多染色体输入 (如对 GRCh38 + NUMT 调用的 Mutect2) 按染色体拆成独立任务,
+# 在进程池中分别融合到临时文件, 再按 ##contig 表头的参考顺序拼接
+def split_by_contig(vcf_path: Path, out_dir: Path, label: str) -> tuple[list[bytes], dict[str, Path]]:
+    """
+    没有索引时扫描一遍, 把每条染色体的记录连同完整表头写到各自的临时 VCF;
+    只切分第一列, 不解析记录. 已排序的输入同一染色体的记录相邻, 同时只打开一个文件
+    """
+    header: list[bytes] = []
+    parts: dict[str, Path] = {}
+    current, handle = None, None
+    try:
+        with open_vcf(vcf_path) as stream:
+            for line in iter_lines(stream):
+                if not line.strip():
+                    continue
+                if line.startswith(b'#'):
+                    header.append(line + b'\n')
+                    continue
+                chrom = line[:line.find(b'\t')]
+                if chrom != current:
+                    if handle is not None:
+                        handle.close()
+                    name = chrom.decode()
+                    if name in parts:
+                        handle = open(parts[name], 'ab')
+                    else:
+                        parts[name] = out_dir / f'{label}.{len(parts)}.vcf'
+                        handle = open(parts[name], 'wb')
+                        handle.writelines(header)
+                    current = chrom
+                handle.write(line + b'\n')
+    finally:
+        if handle is not None:
+            handle.close()
+    return header, parts
+
+
+def _contig_job(
+    contig: str,
+    mutserve_vcf: Path,
+    mutect2_vcf: Path,
+    output_path: Path,
+    mode: str,
+    regions: Optional[RegionSet],
+    mutserve_index: Optional[Path],
+    mutect2_index: Optional[Path],
+    vaf_threshold: Optional[float],
+    reference: Optional[ReferenceFasta],
+    sample: Optional[str]
+) -> tuple[FusionStats, NormalizationStats, Optional[SampleColumns]]:
+    normalization = NormalizationStats()
+    columns = SampleColumns(sample) if sample is not None else None
+    stats = merge_pair(
+        mutserve_vcf, mutect2_vcf, output_path, mode, False, regions, mutserve_index, mutect2_index,
+        vaf_threshold=vaf_threshold, reference=reference, normalization=normalization, columns=columns
+    )
+    return stats, normalization, columns
+
+
+def concat_parts(output_path: Path, parts: list[Path], compress: bool = False) -> None:
+    """拼接各染色体的输出: 表头取第一个分片, 其余分片跳过表头; 压缩输出时重新建立 .tbi"""
+    if not compress:
+        with open(output_path, 'wb') as out:
+            for i, part in enumerate(parts):
+                with open(part, 'rb') as f:
+                    line = f.readline()
+                    while line.startswith(b'#'):
+                        if i == 0:
+                            out.write(line)
+                        line = f.readline()
+                    out.write(line)
+                    shutil.copyfileobj(f, out)
+        return
+    
+    with VcfOutput(output_path, compress) as out:
+        for i, part in enumerate(parts):
+            with open(part, 'rb') as f:
+                for line in f:
+                    if line.startswith(b'#'):
+                        if i == 0:
+                            out.write_header(line.rstrip(b'\n').decode())
+                        continue
+                    chrom, pos, _, ref, _ = line.split(b'\t', 4)
+                    out.write_record(chrom.decode(), int(pos), ref.decode(), line.rstrip(b'\n'))
+
+
+def merge_pair_by_contig(
+    mutserve_vcf: Path,
+    mutect2_vcf: Path,
+    output_path: Path,
+    mode: str,
+    workers: int,
+    compress: bool = False,
+    regions: Optional[RegionSet] = None,
+    mutserve_index: Optional[Path] = None,
+    mutect2_index: Optional[Path] = None,
+    vaf_threshold: Optional[float] = None,
+    reference: Optional[ReferenceFasta] = None,
+    normalization: Optional[NormalizationStats] = None,
+    columns: Optional[SampleColumns] = None
+) -> FusionStats:
+    """
+    与 merge_pair 结果相同, 但每条染色体是进程池中的一个任务.
+    两个输入都有 .tbi/.csi 索引时各任务按索引只读取自己的染色体, 否则先按染色体拆分成临时文件;
+    只有一条染色体时直接调用 merge_pair
+    """
+    mutserve_index = mutserve_index or find_index(mutserve_vcf)
+    mutect2_index = mutect2_index or find_index(mutect2_vcf)
+    indexed = all(index is not None and is_bgzf(vcf) for vcf, index in (
+        (mutserve_vcf, mutserve_index), (mutect2_vcf, mutect2_index)))
+    
+    with tempfile.TemporaryDirectory(prefix='.mtdna_fusion_', dir=output_path.parent) as tmpdir:
+        tmp = Path(tmpdir)
+        with VcfReader(mutserve_vcf, 'mutserve') as mutserve_reader, \
+                VcfReader(mutect2_vcf, 'mutect2') as mutect2_reader:
+            contig_rank = contig_order(mutserve_reader.header_lines, mutect2_reader.header_lines)
+        
+        if indexed:
+            names = load_index(mutserve_index).names + load_index(mutect2_index).names
+            inputs = {name: (mutserve_vcf, mutect2_vcf) for name in names}
+        else:
+            mutserve_header, mutserve_parts = split_by_contig(mutserve_vcf, tmp, 'mutserve')
+            mutect2_header, mutect2_parts = split_by_contig(mutect2_vcf, tmp, 'mutect2')
+            inputs = {}
+            for name in [*mutserve_parts, *mutect2_parts]:
+                pair = []
+                for parts, header, label in ((mutserve_parts, mutserve_header, 'mutserve'),
+                                             (mutect2_parts, mutect2_header, 'mutect2')):
+                    if name not in parts:
+                        # 该工具在这条染色体上没有记录: 只写表头
+                        parts[name] = tmp / f'{label}.{len(parts)}.vcf'
+                        parts[name].write_bytes(b''.join(header))
+                    pair.append(parts[name])
+                inputs[name] = tuple(pair)
+        
+        for name in inputs:
+            contig_rank.setdefault(name, len(contig_rank))
+        contigs = sorted(inputs, key=contig_rank.__getitem__)
+        if regions is not None:
+            contigs = [name for name in contigs if name in regions.intervals]
+        
+        if len(contigs) <= 1:
+            return merge_pair(
+                mutserve_vcf, mutect2_vcf, output_path, mode, compress, regions, mutserve_index, mutect2_index,
+                vaf_threshold=vaf_threshold, reference=reference, normalization=normalization, columns=columns
+            )
+        
+        stats = FusionStats()
+        sample = None
+        if columns is not None:
+            sample = columns.sample or default_sample_name(
+                output_path, mutect2_reader.header_lines, mutserve_reader.header_lines)
+            columns.sample = sample
+        parts = [tmp / f'fused.{i}.vcf' for i in range(len(contigs))]
+        with ProcessPoolExecutor(max_workers=min(workers, len(contigs))) as executor:
+            futures = []
+            for name, part in zip(contigs, parts):
+                if regions is not None:
+                    contig_regions = RegionSet((name, beg, end) for beg, end in regions.intervals[name])
+                elif indexed:
+                    contig_regions = RegionSet([(name, 0, MAX_REGION_END)])
+                else:
+                    contig_regions = None
+                futures.append(executor.submit(
+                    _contig_job, name, *inputs[name], part, mode, contig_regions,
+                    mutserve_index if indexed else None, mutect2_index if indexed else None,
+                    vaf_threshold, reference, sample
+                ))
+            # 按参考顺序收集结果, 任何一个任务失败都会在这里抛出
+            for future in futures:
+                part_stats, part_normalization, part_columns = future.result()
+                stats.add(part_stats)
+                if normalization is not None:
+                    for f in fields(part_normalization):
+                        setattr(normalization, f.name, getattr(normalization, f.name) + getattr(part_normalization, f.name))
+                if columns is not None:
+                    for f in fields(columns):
+                        if f.name != 'sample':
+                            getattr(columns, f.name).extend(getattr(part_columns, f.name))
+        
+        concat_parts(output_path, parts, compress)
+    return stats
+
+
+# 增量融合的状态文件: 每个位置上两个工具各自给出的变异键 + FusionStats 计数;
+# 每个键带一个来源标志位, 1 = Mutserve, 2 = Mutect2
+STATE_FORMAT = 'mtdna_fusion_merger_state'
+STATE_VERSION = 3
+STATE_MUTSERVE = 1
+STATE_MUTECT2 = 2
+
+
+class KeyStub:
+    """只有变异键和来源的占位记录, 用于从状态文件重放某个位置上的融合规则"""
+    __slots__ = ('key', 'source', 'is_indel')
+    
+    def __init__(self, key: tuple, source: str):
+        self.key = key
+        self.source = source
+        self.is_indel = len(key[2]) != len(key[3]) or len(key[2]) > 1
+
+
+def write_state(
+    state_path: Path,
+    mode: str,
+    mutserve_vcf: Path,
+    stats: FusionStats,
+    key_index: dict,
+    mutserve_sha256: Optional[str] = None
+) -> None:
+    """
+    写出紧凑的 JSON 状态: 按染色体分组, 每个位置先列出 Mutserve 的键 (保持输入顺序),
+    再列出未与之配对的 Mutect2 键 (重复的键按次数保留); 先写临时文件再替换, 允许与 --state 是同一个路径.
+    已知 Mutserve VCF 的 SHA-256 (增量合并沿用上一次的状态) 时不再重新计算
+    """
+    sites: dict[str, list] = {}
+    for (chrom, pos), (mutserve_keys, mutect2_keys) in key_index.items():
+        entries = sites.setdefault(chrom, [])
+        unpaired = Counter(mutect2_keys)
+        for key in mutserve_keys:
+            flags = STATE_MUTSERVE
+            if unpaired[key]:
+                flags |= STATE_MUTECT2
+                unpaired[key] -= 1
+            entries.append([pos, key[2], key[3], flags])
+        for key in mutect2_keys:
+            if unpaired[key]:
+                entries.append([pos, key[2], key[3], STATE_MUTECT2])
+                unpaired[key] -= 1
+    
+    mutserve_stat = os.stat(mutserve_vcf)
+    state = {
+        'format': STATE_FORMAT,
+        'version': STATE_VERSION,
+        'mode': mode,
+        'mutserve_vcf': {
+            'name': Path(mutserve_vcf).name,
+            'size': mutserve_stat.st_size,
+            'mtime_ns': mutserve_stat.st_mtime_ns,
+            'sha256': mutserve_sha256 or file_sha256(mutserve_vcf)
+        },
+        'stats': {f.name: getattr(stats, f.name) for f in fields(stats)},
+        'sites': sites
+    }
+    tmp_path = Path(f'{state_path}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp_path, state_path)
+
+
+def file_sha256(path: Path) -> str:
+    """按块计算文件的 SHA-256, 用于确认增量合并的 Mutserve VCF 与状态中记录的是同一个文件"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_state(state_path: Path) -> tuple[dict, FusionStats, dict]:
+    """读取状态文件, 返回 (原始状态, FusionStats, {(chrom, pos): (Mutserve 键, Mutect2 键)})"""
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get('format') != STATE_FORMAT or state.get('version') != STATE_VERSION:
+        raise ValueError(f'{state_path} is not a version {STATE_VERSION} merge state file')
+    
+    key_index: dict = {}
+    for chrom, entries in state['sites'].items():
+        for pos, ref, alt, flags in entries:
+            mutserve_keys, mutect2_keys = key_index.setdefault((chrom, pos), ([], []))
+            key = (chrom, pos, ref, alt)
+            if flags & STATE_MUTSERVE:
+                mutserve_keys.append(key)
+            if flags & STATE_MUTECT2:
+                mutect2_keys.append(key)
+    return state, FusionStats(**state['stats']), key_index
+
+
+def _position_delta(mutserve_group: list, mutect2_group: list) -> tuple[list, FusionStats]:
+    """单个位置的融合结果及其对融合计数的贡献"""
+    delta = FusionStats()
+    decisions = _fuse_position(mutserve_group, mutect2_group, delta)
+    delta.final_variants = len(decisions)
+    return decisions, delta
+
+
+FUSION_COUNTERS = (
+    'fusion_snvs_from_mutserve', 'fusion_indels_from_mutect2', 'both_callers',
+    'mutserve_only', 'mutect2_only', 'conflicts_resolved', 'final_variants'
+)
+
+
+def incremental_merge(
+    state_path: Path,
+    mutserve_vcf: Path,
+    mutect2_vcf: Path,
+    previous_output: Path,
+    output_path: Path,
+    compress: bool = False,
+    mutserve_index: Optional[Path] = None,
+    state_out: Optional[Path] = None,
+    verify: bool = False
+) -> tuple[FusionStats, int]:
+    """
+    用重新调用的 Mutect2 VCF 更新已有的融合结果, 返回 (新的统计, 重新融合的位置数):
+    1. 扫描新的 Mutect2 VCF, 与状态中的键比较, 找出变化的位置;
+    2. 同步遍历上一次的输出和新的 Mutect2 VCF, 只在变化的位置读取 Mutserve VCF
+       (有索引时随机访问) 并重新融合; 其余位置的 Mutserve 记录直接沿用上一次的输出
+    """
+    state, stats, key_index = load_state(state_path)
+    if state['mode'] != 'fusion':
+        raise ValueError(f'incremental merge needs a fusion-mode state, got {state["mode"]}')
+    recorded = state['mutserve_vcf']
+    mutserve_stat = os.stat(mutserve_vcf)
+    # 默认只比较大小和修改时间, 不必每次读完整个 Mutserve VCF; verify 时再比较 SHA-256
+    if mutserve_stat.st_size != recorded['size'] or mutserve_stat.st_mtime_ns != recorded['mtime_ns'] \
+            or verify and file_sha256(mutserve_vcf) != recorded['sha256']:
+        raise ValueError(f'{mutserve_vcf} differs from the Mutserve VCF recorded in {state_path}; run a full merge')
+    
+    mutect2_stats = FusionStats()
+    new_mutect2_keys: dict = {}
+    with VcfReader(mutect2_vcf, 'mutect2') as reader:
+        for v in count_inputs(reader, mutect2_stats, 'mutect2'):
+            new_mutect2_keys.setdefault(v.position_key, []).append(v.key)
+    
+    changed = {
+        position for position in key_index.keys() | new_mutect2_keys.keys()
+        if Counter(key_index.get(position, ((), ()))[1]) != Counter(new_mutect2_keys.get(position, ()))
+    }
+    for name in ('mutect2_total', 'mutect2_snvs', 'mutect2_indels'):
+        setattr(stats, name, getattr(mutect2_stats, name))
+    
+    for position in changed:
+        mutserve_keys, mutect2_keys = key_index.get(position, ((), ()))
+        key_index[position] = (mutserve_keys, new_mutect2_keys.get(position, []))
+        _, old_delta = _position_delta(
+            [KeyStub(k, 'mutserve') for k in mutserve_keys], [KeyStub(k, 'mutect2') for k in mutect2_keys]
         )
-        format_str = ':'.join(v.format_fields) if v.format_fields else 'GT'
-        samples_str = '\t'.join(':'.join(s) for s in v.sample_data) if v.sample_data else '0/1'
+        for name in FUSION_COUNTERS:
+            setattr(stats, name, getattr(stats, name) - getattr(old_delta, name))
+    
+    regions = RegionSet([(chrom, pos - 1, pos) for chrom, pos in changed]) if changed else None
+    
+    def fused_records(previous_reader, mutect2_reader, mutserve_reader, contig_rank):
+        streams = [
+            group_by_position(previous_reader, contig_rank, 'Previous output'),
+            group_by_position(mutect2_reader, contig_rank, 'Mutect2'),
+            group_by_position(mutserve_reader if changed else iter(()), contig_rank, 'Mutserve')
+        ]
+        for _, (previous_group, mutect2_group, mutserve_group) in co_group(streams):
+            position = (previous_group or mutect2_group or mutserve_group)[0].position_key
+            if position in changed:
+                mutserve_group = [v for v in mutserve_group if v.position_key == position]
+                decisions, delta = _position_delta(mutserve_group, mutect2_group)
+                stats.add(delta)
+                key_index[position] = ([v.key for v in mutserve_group], [v.key for v in mutect2_group])
+                for v, in_both in decisions:
+                    annotate_fusion(v, in_both)
+                    yield v
+                continue
+            
+            mutserve_keys = key_index.get(position, ((), ()))[0]
+            key_index[position] = (mutserve_keys, [v.key for v in mutect2_group])
+            previous_by_key = {v.key: v for v in previous_group}
+            decisions = _fuse_position([KeyStub(k, 'mutserve') for k in mutserve_keys], mutect2_group, FusionStats())
+            for v, in_both in decisions:
+                if v.source == 'mutect2':
+                    annotate_fusion(v, in_both)
+                    yield v
+                elif v.key in previous_by_key:
+                    yield previous_by_key[v.key]
+                else:
+                    raise ValueError(f'{previous_output} has no record for {v.key} recorded in {state_path}')
+    
+    with VcfReader(previous_output, 'fused') as previous_reader, \
+            VcfReader(mutect2_vcf, 'mutect2') as mutect2_reader, \
+            VcfReader(mutserve_vcf, 'mutserve', regions, mutserve_index) as mutserve_reader:
+        contig_rank = {chrom: rank for rank, chrom in enumerate(state['sites'])}
+        for chrom in contig_order(previous_reader.header_lines, mutect2_reader.header_lines):
+            contig_rank.setdefault(chrom, len(contig_rank))
+        records = fused_records(previous_reader, mutect2_reader, mutserve_reader, contig_rank)
+        # 放宽记录沿用状态文件中完整合并时的结果 (上一次输出的表头已经是放宽后的)
+        header = merge_headers(('fused', previous_reader.header_lines), ('mutect2', mutect2_reader.header_lines))
+        write_vcf(output_path, header.lines(), records, 'fusion', compress)
+    
+    if state_out:
+        ordered = {
+            position: key_index[position]
+            for position in sorted(key_index, key=lambda p: (contig_rank.get(p[0], len(contig_rank)), p[1]))
+            if key_index[position][0] or key_index[position][1]
+        }
+        write_state(state_out, 'fusion', mutserve_vcf, stats, ordered, recorded['sha256'])
+    return stats, len(changed)
+
+
+# N 路融合引擎: 任意多个带工具名的输入一次多路归并, 取舍和置信度来自规则表
+def load_rules(rules_path: Path) -> dict:
+    """读取 JSON 或 YAML 规则表 (YAML 需要 PyYAML), 缺省项取 DEFAULT_RULES 中的值"""
+    with open(rules_path) as f:
+        if rules_path.suffix.lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('PyYAML is required to read YAML rule tables') from None
+            table = yaml.safe_load(f)
+        else:
+            table = json.load(f)
+    return validate_rules(table, str(rules_path))
+
+
+def validate_rules(table: dict, name: str = 'rules') -> dict:
+    if not isinstance(table, dict) or not isinstance(table.get('precedence'), dict):
+        raise ValueError(f'{name}: missing "precedence" table')
+    
+    precedence = {}
+    for kind in ('snv', 'indel'):
+        callers = table['precedence'].get(kind, [])
+        if not isinstance(callers, list) or not all(isinstance(c, str) for c in callers):
+            raise ValueError(f'{name}: precedence.{kind} must be a list of caller names')
+        precedence[kind] = callers
+    
+    overrides = table.get('indel_overrides_snv', [])
+    if not isinstance(overrides, list) or not all(isinstance(c, str) for c in overrides):
+        raise ValueError(f'{name}: indel_overrides_snv must be a list of caller names')
+    
+    confidence_table = table.get('confidence', {})
+    if not isinstance(confidence_table, dict):
+        raise ValueError(f'{name}: confidence must be a table')
+    for kind in ('snv', 'indel'):
+        if not isinstance(confidence_table.get(kind, {}), dict):
+            raise ValueError(f'{name}: confidence.{kind} must be a table of caller scores')
+    confidence = {
+        'consensus': confidence_table.get('consensus', DEFAULT_RULES['confidence']['consensus']),
+        'snv': dict(confidence_table.get('snv', {})),
+        'indel': dict(confidence_table.get('indel', {})),
+        'default': confidence_table.get('default', DEFAULT_RULES['confidence']['default'])
+    }
+    scores = [confidence['consensus'], confidence['default'], *confidence['snv'].values(), *confidence['indel'].values()]
+    # bool 是 int 的子类, true/false 不能当作 1/0 的分数
+    if not all(isinstance(x, (int, float)) and not isinstance(x, bool) and 0 <= x <= 1 for x in scores):
+        raise ValueError(f'{name}: confidence scores must be numbers between 0 and 1')
+    
+    return {'precedence': precedence, 'indel_overrides_snv': overrides, 'confidence': confidence}
+
+
+@dataclass
+class CallerCounts:
+    total: int = 0
+    snvs: int = 0
+    indels: int = 0
+    emitted: int = 0
+
+
+@dataclass
+class EngineStats:
+    callers: dict = field(default_factory=dict)
+    consensus: int = 0
+    single_caller: int = 0
+    conflicts_resolved: int = 0
+    not_trusted: int = 0
+    final_variants: int = 0
+    header_widened: list = field(default_factory=list)
+
+
+def _count_caller(variants: Iterable[Variant], counts: CallerCounts) -> Iterator[Variant]:
+    for v in variants:
+        counts.total += 1
+        if v.is_indel:
+            counts.indels += 1
+        else:
+            counts.snvs += 1
+        yield v
+
+
+def _engine_position(
+    groups: list[list[Variant]],
+    callers: list[str],
+    rules: dict,
+    stats: EngineStats
+) -> list[tuple[Variant, list[str]]]:
+    """
+    单个位置上的 N 路融合, 返回 (输出记录, 检出该变异的工具列表):
+    每个键按 precedence 取第一个检出它的工具的记录, precedence 中没有任何检出工具的键丢弃;
+    indel_overrides_snv 中的工具在该位置有 INDEL 时, 同一位置的 SNV 让位于 INDEL
+    """
+    precedence = rules['precedence']
+    overriding = set(rules['indel_overrides_snv'])
+    
+    by_key: dict[tuple, dict[str, Variant]] = {}
+    for caller, group in zip(callers, groups):
+        for v in group:
+            by_key.setdefault(v.key, {}).setdefault(caller, v)
+    
+    overriding_indels = [v for caller, group in zip(callers, groups) if caller in overriding for v in group if v.is_indel]
+    decisions = []
+    seen = set()
+    for v in overriding_indels + [v for group in groups for v in group]:
+        if v.key in seen:
+            continue
+        seen.add(v.key)
+        reporters = by_key[v.key]
+        chosen = next((c for c in precedence['indel' if v.is_indel else 'snv'] if c in reporters), None)
+        if chosen is None:
+            stats.not_trusted += 1
+        elif not v.is_indel and overriding_indels:
+            stats.conflicts_resolved += 1
+        else:
+            decisions.append((reporters[chosen], list(reporters)))
+    return decisions
+
+
+def engine_merge(
+    readers: list[Iterable[Variant]],
+    callers: list[str],
+    rules: dict,
+    stats: EngineStats,
+    contig_rank: dict[str, int]
+) -> Iterator[Variant]:
+    """对 N 个已按坐标排序的输入做一次多路归并, 逐位置应用规则表并立即产出"""
+    streams = []
+    for caller, reader in zip(callers, readers):
+        counts = stats.callers.setdefault(caller, CallerCounts())
+        streams.append(group_by_position(_count_caller(reader, counts), contig_rank, caller))
+    
+    for _, groups in co_group(streams):
+        for v, reporters in _engine_position(groups, callers, rules, stats):
+            in_both = len(reporters) > 1
+            if in_both:
+                stats.consensus += 1
+            else:
+                stats.single_caller += 1
+            stats.callers[v.source].emitted += 1
+            stats.final_variants += 1
+            annotate_fusion(v, in_both, rules)
+            v.set_info('FUSION_CALLERS', ','.join(reporters))
+            yield v
+
+
+def parse_inputs(specs: list[str]) -> list[tuple[str, Path]]:
+    """解析 --input CALLER=VCF 参数, 工具名不能重复"""
+    inputs = []
+    for spec in specs:
+        caller, sep, path = spec.partition('=')
+        if not sep or not caller or not path:
+            raise ValueError(f'invalid --input {spec!r}, expected CALLER=VCF')
+        if caller in (c for c, _ in inputs):
+            raise ValueError(f'duplicate caller in --input: {caller}')
+        inputs.append((caller, Path(path)))
+    return inputs
+
+
+def build_engine_report(stats: EngineStats, rules: dict) -> dict:
+    return {
+        'mode': 'fusion',
+        'version': '1.0.0',
+        'reference': 'PMID:38709886',
+        'rules': rules,
+        'statistics': {
+            'callers': {name: asdict(counts) for name, counts in stats.callers.items()},
+            'fusion_result': {
+                'consensus': stats.consensus,
+                'single_caller': stats.single_caller,
+                'conflicts_resolved': stats.conflicts_resolved,
+                'not_trusted': stats.not_trusted,
+                'final_total': stats.final_variants
+            },
+            **({'header_widened': stats.header_widened} if stats.header_widened else {})
+        }
+    }
+
+
+def run_engine(args: argparse.Namespace, normalization: Optional[NormalizationStats] = None) -> EngineStats:
+    inputs = parse_inputs(args.input)
+    rules = load_rules(args.rules) if args.rules else DEFAULT_RULES
+    callers = [caller for caller, _ in inputs]
+    for _, vcf_path in inputs:
+        if not vcf_path.exists():
+            raise FileNotFoundError(f'VCF not found: {vcf_path}')
+    
+    stats = EngineStats()
+    profiler = args.profiler
+    with ExitStack() as stack:
+        readers = []
+        for caller, path in inputs:
+            with profile_phase(profiler, f'parse_{caller}'):
+                readers.append(stack.enter_context(VcfReader(path, caller, args.regions)))
+        contig_rank = contig_order(*(reader.header_lines for reader in readers))
+        streams = [profile_iterate(profiler, f'parse_{caller}', reader) for caller, reader in zip(callers, readers)]
+        if args.reference is not None:
+            streams = [profile_iterate(profiler, 'normalize', normalize_variants(stream, args.reference, normalization))
+                       for stream in streams]
+        merged = profile_iterate(profiler, 'fusion', engine_merge(streams, callers, rules, stats, contig_rank))
+        header = merge_headers(*((caller, reader.header_lines) for caller, reader in zip(callers, readers)))
+        stats.header_widened = header.widened
+        write_vcf(args.output, header.lines(), merged, 'fusion', args.compress, [
+            '##INFO=<ID=FUSION_CALLERS,Number=.,Type=String,Description="Callers that reported the variant">',
+            f'##mtdna_fusion_merger_callers={",".join(callers)}'
+        ], profiler)
+    if profiler is not None and not args.regions:
+        for caller, path in inputs:
+            profiler.timing(f'parse_{caller}').bytes += path.stat().st_size
+    
+    if args.report:
+        with profile_phase(profiler, 'report'):
+            report = build_engine_report(stats, rules)
+            if args.reference is not None:
+                report['statistics']['normalization'] = asdict(normalization)
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+    return stats
+
+
+def sample_names(header_lines: list[str]) -> list[str]:
+    for line in reversed(header_lines):
+        if line.startswith('#CHROM'):
+            return line.split('\t')[9:]
+    return []
+
+
+def carries_variant(v: Variant, sample_index: Optional[int]) -> bool:
+    """根据 GT 判断某个样本列是否携带该 ALT 等位基因; 无 GT 时以非缺失为准"""
+    if sample_index is None or sample_index >= len(v.sample_data):
+        return False
+    values = v.sample_data[sample_index]
+    if 'GT' not in v.format_fields:
+        return bool(values) and values[0] not in ('', '.')
+    gt_index = v.format_fields.index('GT')
+    if gt_index >= len(values):
+        return False
+    return str(v.alt_index) in values[gt_index].replace('|', '/').split('/')
+
+
+COHORT_HEADER_LINES = [
+    '##INFO=<ID=FUSION_NS,Number=1,Type=Integer,Description="Number of samples carrying the merged variant">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=AF,Number=1,Type=Float,Description="Allele fraction reported by the source caller">',
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth reported by the source caller">',
+    '##FORMAT=<ID=FS,Number=1,Type=String,Description="Source caller for this sample (mutserve/mutect2)">',
+    '##FORMAT=<ID=FC,Number=1,Type=Float,Description="Fusion confidence score for this sample (0-1)">',
+    '##FORMAT=<ID=BC,Number=1,Type=Integer,Description="1 if called by both callers in this sample">',
+]
+COHORT_FORMAT = 'GT:AF:DP:FS:FC:BC'
+
+
+def cohort_sample_field(v: Variant, sample_index: int, in_both: Optional[bool]) -> str:
+    values = dict(zip(v.format_fields, v.sample_data[sample_index]))
+    
+    gt = values.get('GT', '.')
+    separator = '|' if '|' in gt else '/'
+    gt = separator.join(
+        a if a == '.' else ('1' if a == str(v.alt_index) else '0')
+        for a in gt.replace('|', '/').split('/')
+    )
+    
+    af = values.get('AF', '.')
+    af_values = af.split(',')
+    if len(af_values) > 1 and v.alt_index <= len(af_values):
+        af = af_values[v.alt_index - 1]
+    
+    if in_both is None:
+        confidence, both = '.', '.'
+    else:
+        confidence, both = str(calculate_confidence(v, in_both)), '1' if in_both else '0'
+    
+    return ':'.join([gt, af or '.', values.get('DP') or '.', v.source, confidence, both])
+
+
+@dataclass
+class CohortSite:
+    """队列输出的一个位点: 只保留写出 VCF 和列式文件所需的字段, 不持有各输入记录的全部样本列"""
+    chrom: str
+    pos: int
+    ref: str
+    alt: str
+    qual: float
+    filter_status: str
+    calls: dict = field(default_factory=dict)
+
+
+def fuse_cohort(
+    mutserve_reader: VcfReader,
+    mutect2_reader: VcfReader,
+    samples: list[tuple[str, Optional[int], Optional[int]]],
+    mode: str,
+    sites: dict,
+    sample_stats: dict[str, FusionStats],
+    contig_rank: dict[str, int]
+) -> None:
+    """
+    对一对 VCF 按样本列分别做融合: 两个文件只解析一次, 每个位置组按
+    GT 拆成各样本的子组后套用同一条位置规则, 结果累积到 sites
+    """
+    rule = POSITION_RULES[mode]
+    walk_stats = FusionStats()
+    
+    for mutserve_group, mutect2_group in co_iterate(mutserve_reader, mutect2_reader, walk_stats, contig_rank):
+        for name, mutserve_index, mutect2_index in samples:
+            stats = sample_stats[name]
+            mutserve_sample = [v for v in mutserve_group if carries_variant(v, mutserve_index)]
+            mutect2_sample = [v for v in mutect2_group if carries_variant(v, mutect2_index)]
+            for v in mutserve_sample:
+                count_variant(stats, v, 'mutserve')
+            for v in mutect2_sample:
+                count_variant(stats, v, 'mutect2')
+            
+            for v, in_both in rule(mutserve_sample, mutect2_sample, stats):
+                stats.final_variants += 1
+                site_key = (contig_rank[v.chrom], v.pos, v.ref, v.alt)
+                site = sites.get(site_key)
+                if site is None:
+                    site = sites[site_key] = CohortSite(v.chrom, v.pos, v.ref, v.alt, v.qual, v.filter_status)
+                sample_index = mutserve_index if v.source == 'mutserve' else mutect2_index
+                site.calls[name] = cohort_sample_field(v, sample_index, in_both)
+
+
+def pair_samples(mutserve_samples: list[str], mutect2_samples: list[str]) -> list[tuple[str, Optional[int], Optional[int]]]:
+    """按样本名配对两个文件的样本列; 两个文件都只有一个样本时直接配对"""
+    if len(mutserve_samples) == 1 and len(mutect2_samples) == 1:
+        return [(mutserve_samples[0], 0, 0)]
+    
+    names = list(dict.fromkeys(mutserve_samples + mutect2_samples))
+    return [
+        (
+            name,
+            mutserve_samples.index(name) if name in mutserve_samples else None,
+            mutect2_samples.index(name) if name in mutect2_samples else None
+        )
+        for name in names
+    ]
+
+
+def manifest_column(vcf_samples: list[str], sample: str, vcf_path: Path) -> int:
+    """清单样本在 VCF 中的样本列: 按样本名查找; 只有一个样本列的文件直接使用该列, 其余情况找不到即报错"""
+    if sample in vcf_samples:
+        return vcf_samples.index(sample)
+    if len(vcf_samples) == 1:
+        return 0
+    raise ValueError(f'sample {sample} not found in {vcf_path} (samples: {", ".join(vcf_samples) or "none"})')
+
+
+def read_manifest(manifest_path: Path) -> list[list[str]]:
+    """读取制表符分隔的样本清单, 忽略空行、注释行和 sample 开头的表头"""
+    rows = []
+    with open(manifest_path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if not fields[0] or fields[0].startswith('#') or fields[0].lower() == 'sample':
+                continue
+            rows.append(fields)
+    return rows
+
+
+def write_cohort_vcf(
+    output_path: Path,
+    header_lines: list[str],
+    samples: list[str],
+    sites: dict,
+    mode: str,
+    compress: bool = False
+) -> None:
+    cohort_header_lines = [
+        f'##mtdna_fusion_merger_mode={mode}',
+        '##mtdna_fusion_merger_cohort=true',
+        '##mtdna_fusion_merger_version=1.0.0',
+        '##mtdna_fusion_merger_reference=PMID:38709886'
+    ]
+    declared = {line.split(',', 1)[0] for line in header_lines if line.startswith(('##INFO=', '##FORMAT='))}
+    
+    with VcfOutput(output_path, compress) as out:
+        for line in header_lines:
+            if line.startswith('#CHROM'):
+                break
+            out.write_header(line)
+        for line in COHORT_HEADER_LINES:
+            if line.split(',', 1)[0] not in declared:
+                out.write_header(line)
+        for line in cohort_header_lines:
+            out.write_header(line)
+        out.write_header('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] + samples))
+        
+        for site_key in sorted(sites, key=lambda k: k[:2]):
+            site = sites[site_key]
+            sample_fields = [site.calls.get(name, '.') for name in samples]
+            out.write_record(
+                site.chrom, site.pos, site.ref,
+                f'{site.chrom}\t{site.pos}\t.\t{site.ref}\t{site.alt}\t{site.qual}\t{site.filter_status}\t'
+                f'FUSION_NS={len(site.calls)}\t{COHORT_FORMAT}\t' + '\t'.join(sample_fields)
+            )
+
+
+def cohort_columns(sites: dict, site_keys: list, sample: str) -> SampleColumns:
+    """从队列模式累积的 FORMAT 字段 (COHORT_FORMAT) 取出某个样本的列"""
+    columns = SampleColumns(sample)
+    for site_key in site_keys:
+        site = sites[site_key]
+        call = site.calls.get(sample)
+        if call is None:
+            continue
+        _, af, depth, source, confidence, both = call.split(':')
+        columns.append(site.chrom, site.pos, site.ref, site.alt, source, _optional_number(confidence, float),
+                       None if both == '.' else both == '1', _optional_number(af, float),
+                       _optional_number(depth, int))
+    return columns
+
+
+def build_report(stats: FusionStats, mode: str, heteroplasmy: bool = False) -> dict:
+    report = {
+        'mode': mode,
+        'version': '1.0.0',
+        'reference': 'PMID:38709886',
+        'statistics': {
+            'mutserve': {
+                'total': stats.mutserve_total,
+                'snvs': stats.mutserve_snvs,
+                'indels': stats.mutserve_indels
+            },
+            'mutect2': {
+                'total': stats.mutect2_total,
+                'snvs': stats.mutect2_snvs,
+                'indels': stats.mutect2_indels
+            },
+            'fusion_result': {
+                'snvs_from_mutserve': stats.fusion_snvs_from_mutserve,
+                'indels_from_mutect2': stats.fusion_indels_from_mutect2,
+                'both_callers': stats.both_callers,
+                'mutserve_only': stats.mutserve_only,
+                'mutect2_only': stats.mutect2_only,
+                'conflicts_resolved': stats.conflicts_resolved,
+                'final_total': stats.final_variants
+            }
+        }
+    }
+    if stats.header_widened:
+        report['statistics']['header_widened'] = stats.header_widened
+    if heteroplasmy:
+        report['statistics']['heteroplasmy'] = {
+            'both_callers_vaf': stats.vaf_both_callers,
+            'discordant': stats.vaf_discordant
+        }
+    return report
+
+
+def load_regions(args: argparse.Namespace) -> Optional[RegionSet]:
+    regions = [parse_region(text) for text in args.region or []]
+    if args.regions_bed:
+        regions.extend(read_regions_bed(args.regions_bed))
+    return RegionSet(regions) if regions else None
+
+
+def run_cohort(args: argparse.Namespace) -> None:
+    if args.columnar:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit('Error: pyarrow is required for --columnar')
+    
+    contig_rank: dict[str, int] = {}
+    sites: dict = {}
+    sample_stats: dict[str, FusionStats] = {}
+    output_samples: list[str] = []
+    header_sources: list[tuple[str, list[str]]] = []
+    
+    if args.manifest:
+        pairs = [(Path(row[1]), Path(row[2]), row[0]) for row in read_manifest(args.manifest)]
+    else:
+        pairs = [(args.mutserve_vcf, args.mutect2_vcf, None)]
+    
+    for mutserve_vcf, mutect2_vcf, manifest_sample in pairs:
+        for vcf_path in (mutserve_vcf, mutect2_vcf):
+            if not vcf_path.exists():
+                sys.exit(f'Error: VCF not found: {vcf_path}')
         
-        line = f'{v.chrom}\t{v.pos}\t.\t{v.ref}\t{v.alt}\t{v.qual}\t{v.filter_status}\t{info_str}\t{format_str}\t{samples_str}'
-        output_lines.append(line)
+        with VcfReader(mutserve_vcf, 'mutserve', args.regions) as mutserve_reader, \
+                VcfReader(mutect2_vcf, 'mutect2', args.regions) as mutect2_reader:
+            header_sources += [('mutserve', mutserve_reader.header_lines), ('mutect2', mutect2_reader.header_lines)]
+            for chrom in contig_order(mutserve_reader.header_lines, mutect2_reader.header_lines):
+                contig_rank.setdefault(chrom, len(contig_rank))
+            
+            mutserve_samples = sample_names(mutserve_reader.header_lines)
+            mutect2_samples = sample_names(mutect2_reader.header_lines)
+            if manifest_sample is None:
+                samples = pair_samples(mutserve_samples, mutect2_samples)
+            else:
+                try:
+                    samples = [(
+                        manifest_sample,
+                        manifest_column(mutserve_samples, manifest_sample, mutserve_vcf),
+                        manifest_column(mutect2_samples, manifest_sample, mutect2_vcf)
+                    )]
+                except ValueError as e:
+                    sys.exit(f'Error: {e}')
+            
+            for name, _, _ in samples:
+                if name in sample_stats:
+                    sys.exit(f'Error: duplicate sample in cohort: {name}')
+                sample_stats[name] = FusionStats()
+                output_samples.append(name)
+            
+            try:
+                fuse_cohort(mutserve_reader, mutect2_reader, samples, args.mode, sites, sample_stats, contig_rank)
+            except UnsortedInputError as e:
+                sys.exit(f'Error: {e}. Sort the input first (e.g. bcftools sort).')
+    
+    header = merge_headers(*header_sources)
+    write_cohort_vcf(args.output, header.lines(), output_samples, sites, args.mode, args.compress)
+    if args.columnar:
+        site_keys = sorted(sites, key=lambda k: k[:2])
+        with ColumnarWriter(args.columnar) as writer:
+            for name in output_samples:
+                writer.write_sample(cohort_columns(sites, site_keys, name))
+    
+    if args.report_dir:
+        args.report_dir.mkdir(parents=True, exist_ok=True)
+        for name, stats in sample_stats.items():
+            safe_name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in name)
+            with open(args.report_dir / f'{safe_name}.fusion_report.json', 'w') as f:
+                json.dump({'sample': name, **build_report(stats, args.mode)}, f, indent=2)
     
-    with open(output_path, 'w') as f:
-        f.write('\n'.join(output_lines) + '\n')
+    if args.report:
+        report = {
+            'mode': args.mode,
+            'version': '1.0.0',
+            'reference': 'PMID:38709886',
+            'samples': {name: build_report(stats, args.mode)['statistics'] for name, stats in sample_stats.items()},
+            **({'header_widened': header.widened} if header.widened else {})
+        }
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    print(f'Cohort fusion merge complete: {len(output_samples)} samples, {len(sites)} sites')
+
+
+def _batch_job(
+    row: list[str],
+    mode: str,
+    compress: bool,
+    columnar: bool = False,
+    unsorted: bool = False,
+    regions: Optional[RegionSet] = None,
+    vaf_threshold: Optional[float] = None
+) -> tuple[FusionStats, Optional[SampleColumns]]:
+    sample, mutserve_vcf, mutect2_vcf, output = row[:4]
+    for vcf_path in (mutserve_vcf, mutect2_vcf):
+        if not Path(vcf_path).exists():
+            raise FileNotFoundError(f'VCF not found: {vcf_path}')
+    columns = SampleColumns(sample) if columnar else None
+    stats = merge_pair(Path(mutserve_vcf), Path(mutect2_vcf), Path(output), mode, compress, regions,
+                       vaf_threshold=vaf_threshold, columns=columns, unsorted=unsorted)
+    return stats, columns
+
+
+def run_batch(args: argparse.Namespace) -> None:
+    """
+    批处理: 清单中每行 (sample, mutserve_vcf, mutect2_vcf, output) 是一个独立任务,
+    分发到进程池并行执行, 最后汇总所有样本的 FusionStats;
+    --columnar 时各任务返回收集好的列, 按清单顺序每个样本写成一个 row group
+    """
+    rows = read_manifest(args.batch)
+    for row in rows:
+        if len(row) < 4:
+            sys.exit(f'Error: batch row needs 4 columns (sample, mutserve_vcf, mutect2_vcf, output): {row}')
+    
+    total = FusionStats()
+    per_sample: dict[str, dict] = {}
+    failed: dict[str, str] = {}
+    
+    with ExitStack() as stack:
+        try:
+            writer = stack.enter_context(ColumnarWriter(args.columnar)) if args.columnar else None
+        except ValueError as e:
+            sys.exit(f'Error: {e}')
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.workers))
+        vaf_threshold = args.vaf_discordance if args.reconcile_vaf else None
+        futures = [
+            executor.submit(_batch_job, row, args.mode, args.compress, writer is not None, args.unsorted, args.regions,
+                            vaf_threshold)
+            for row in rows
+        ]
+        for row, future in zip(rows, futures):
+            sample = row[0]
+            try:
+                stats, columns = future.result()
+            except Exception as e:
+                # 单个样本的任何错误 (未排序输入、格式错误的记录等) 只让这一个样本失败, 其余样本继续
+                message = str(e) if isinstance(e, (OSError, ValueError)) else f'{type(e).__name__}: {e}'
+                failed[sample] = message
+                print(f'Error: {sample}: {message}', file=sys.stderr)
+                continue
+            total.add(stats)
+            per_sample[sample] = build_report(stats, args.mode, args.reconcile_vaf)['statistics']
+            if writer is not None:
+                writer.write_sample(columns)
+    
+    if args.report:
+        report = {
+            **build_report(total, args.mode, args.reconcile_vaf),
+            'samples': len(rows),
+            'succeeded': len(per_sample),
+            'failed': failed,
+            'per_sample': per_sample
+        }
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    print(f'Batch fusion merge complete: {len(per_sample)}/{len(rows)} samples, {total.final_variants} variants')
+    if failed:
+        sys.exit(1)
+
+
+def write_profile(args: argparse.Namespace) -> None:
+    if args.profiler is None:
+        return
+    if args.profile_json:
+        with open(args.profile_json, 'w') as f:
+            json.dump(args.profiler.to_dict(), f, indent=2)
+    if args.profile_prometheus:
+        sys.stderr.write(args.profiler.to_prometheus())
+
+
+# 常驻服务模式: 一个进程连续处理多个合并任务, 省去每个样本重新启动解释器、导入模块和读取参考序列的开销;
+# 协议是逐行的 JSON-RPC 2.0 (每行一个请求/响应), 走 stdin/stdout 或本地 Unix socket
+RPC_PARSE_ERROR = -32700
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS = -32602
+RPC_MERGE_FAILED = -32000
+
+SERVE_MERGE_PARAMS = {
+    'mutserve_vcf', 'mutect2_vcf', 'output', 'report', 'mode', 'compress', 'regions',
+    'mutserve_index', 'mutect2_index', 'reconcile_vaf', 'vaf_discordance', 'reference_fasta',
+    'unsorted', 'provenance'
+}
+SERVE_PATH_PARAMS = (
+    'mutserve_vcf', 'mutect2_vcf', 'output', 'report', 'mutserve_index', 'mutect2_index',
+    'reference_fasta', 'provenance'
+)
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class MergeService:
+    """
+    JSON-RPC 方法: merge (参数同命令行选项, 返回 JSON 报告)、ping 和 shutdown;
+    最近使用的参考序列按 (路径, 修改时间) 缓存, 使用同一参考的后续任务不再读取 FASTA
+    """
+    
+    def __init__(self):
+        self.references: dict[tuple[Path, int], ReferenceFasta] = {}
+        self.jobs = 0
+        self.running = True
+        self.methods = {'merge': self.merge, 'ping': self.ping, 'shutdown': self.shutdown}
+    
+    def reference(self, path: Path) -> ReferenceFasta:
+        path = path.resolve()
+        key = (path, path.stat().st_mtime_ns)
+        if key not in self.references:
+            self.references = {key: ReferenceFasta(path)}
+        return self.references[key]
+    
+    def merge(self, params: dict) -> dict:
+        unknown = sorted(set(params) - SERVE_MERGE_PARAMS)
+        if unknown:
+            raise RpcError(RPC_INVALID_PARAMS, f'unknown parameters: {", ".join(unknown)}')
+        not_paths = [key for key in SERVE_PATH_PARAMS if params.get(key) is not None and not isinstance(params[key], str)]
+        if not_paths:
+            raise RpcError(RPC_INVALID_PARAMS, f'parameters must be strings: {", ".join(not_paths)}')
+        regions = params.get('regions')
+        if regions is not None and not (isinstance(regions, list) and all(isinstance(text, str) for text in regions)):
+            raise RpcError(RPC_INVALID_PARAMS, 'regions must be a list of strings')
+        vaf_discordance = params.get('vaf_discordance', 0.1)
+        if isinstance(vaf_discordance, bool) or not isinstance(vaf_discordance, (int, float)):
+            raise RpcError(RPC_INVALID_PARAMS, 'vaf_discordance must be a number')
+        missing = [key for key in ('mutserve_vcf', 'mutect2_vcf', 'output') if not params.get(key)]
+        if missing:
+            raise RpcError(RPC_INVALID_PARAMS, f'missing parameters: {", ".join(missing)}')
+        mode = params.get('mode', 'fusion')
+        if not isinstance(mode, str) or mode not in POSITION_RULES:
+            raise RpcError(RPC_INVALID_PARAMS, f'unknown mode: {mode}')
+        if params.get('reconcile_vaf') and mode != 'fusion':
+            raise RpcError(RPC_INVALID_PARAMS, 'reconcile_vaf needs fusion mode')
+        if params.get('unsorted') and mode == 'fusion':
+            raise RpcError(RPC_INVALID_PARAMS, 'unsorted is supported for intersection/union merges only')
+        if params.get('unsorted') and params.get('provenance'):
+            raise RpcError(RPC_INVALID_PARAMS, 'provenance is supported for sorted input only')
+        try:
+            regions = RegionSet([parse_region(text) for text in regions]) if regions else None
+        except ValueError as e:
+            raise RpcError(RPC_INVALID_PARAMS, str(e)) from None
+        
+        def optional_path(key: str) -> Optional[Path]:
+            return Path(params[key]) if params.get(key) else None
+        
+        normalization = NormalizationStats()
+        try:
+            reference = self.reference(Path(params['reference_fasta'])) if params.get('reference_fasta') else None
+            stats = merge_pair(
+                Path(params['mutserve_vcf']), Path(params['mutect2_vcf']), Path(params['output']), mode,
+                compress=bool(params.get('compress')), regions=regions,
+                mutserve_index=optional_path('mutserve_index'), mutect2_index=optional_path('mutect2_index'),
+                vaf_threshold=float(vaf_discordance) if params.get('reconcile_vaf') else None,
+                reference=reference, normalization=normalization, unsorted=bool(params.get('unsorted')),
+                provenance_path=optional_path('provenance')
+            )
+            report = build_report(stats, mode, bool(params.get('reconcile_vaf')))
+            if reference is not None:
+                report['statistics']['normalization'] = asdict(normalization)
+            if params.get('report'):
+                with open(params['report'], 'w') as f:
+                    json.dump(report, f, indent=2)
+        except (OSError, ValueError) as e:
+            raise RpcError(RPC_MERGE_FAILED, str(e)) from None
+        self.jobs += 1
+        return report
+    
+    def ping(self, params: dict) -> dict:
+        return {'version': '1.0.0', 'jobs': self.jobs}
+    
+    def shutdown(self, params: dict) -> bool:
+        self.running = False
+        return True
+    
+    def handle(self, line: str) -> Optional[dict]:
+        """处理一行请求, 返回响应; 没有 id 的通知不返回响应"""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': RPC_PARSE_ERROR, 'message': f'Parse error: {e}'}}
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or 'method' not in request:
+            request_id = request.get('id') if isinstance(request, dict) else None
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': RPC_INVALID_REQUEST, 'message': 'Invalid request'}}
+        
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        method = self.methods.get(request['method'])
+        params = request.get('params', {})
+        try:
+            if method is None:
+                raise RpcError(RPC_METHOD_NOT_FOUND, f'Method not found: {request["method"]}')
+            if not isinstance(params, dict):
+                raise RpcError(RPC_INVALID_PARAMS, 'params must be an object')
+            response['result'] = method(params)
+        except RpcError as e:
+            response['error'] = {'code': e.code, 'message': str(e)}
+        except Exception as e:
+            # 任务中的意外错误只让这一个请求失败, 服务继续运行
+            response['error'] = {'code': RPC_MERGE_FAILED, 'message': f'{type(e).__name__}: {e}'}
+        return response if 'id' in request else None
+
+
+def serve_stream(service: MergeService, reader, writer) -> None:
+    for line in reader:
+        if not line.strip():
+            continue
+        response = service.handle(line)
+        if response is not None:
+            writer.write(json.dumps(response) + '\n')
+            writer.flush()
+        if not service.running:
+            break
+
+
+def run_serve(args: argparse.Namespace) -> None:
+    """没有 --socket 时读 stdin 写 stdout; 否则在 Unix socket 上依次处理连接, 直到收到 shutdown"""
+    service = MergeService()
+    try:
+        if args.socket is None:
+            serve_stream(service, sys.stdin, sys.stdout)
+            return
+        
+        import socket
+        if args.socket.is_socket():
+            args.socket.unlink()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(str(args.socket))
+            server.listen()
+            print(f'Serving on {args.socket}', file=sys.stderr)
+            try:
+                while service.running:
+                    connection, _ = server.accept()
+                    try:
+                        with connection, connection.makefile('r', encoding='utf-8') as reader, \
+                                connection.makefile('w', encoding='utf-8') as writer:
+                            serve_stream(service, reader, writer)
+                    except (OSError, UnicodeDecodeError) as e:
+                        # 单个客户端出错 (断开连接、非 UTF-8 数据) 不影响服务
+                        print(f'Warning: dropped connection: {e}', file=sys.stderr)
+            finally:
+                args.socket.unlink(missing_ok=True)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
@@ -242,83 +3359,251 @@ def main():
         description='mtDNA Fusion Merger - Merge Mutserve and Mutect2 variant calls using fusion mode',
         epilog='Reference: Weissensteiner et al. NAR 2024 (PMID:38709886)'
     )
-    parser.add_argument('--mutserve-vcf', required=True, type=Path, help='Mutserve VCF file')
-    parser.add_argument('--mutect2-vcf', required=True, type=Path, help='Mutect2 VCF file')
-    parser.add_argument('--output', required=True, type=Path, help='Output VCF file')
+    parser.add_argument('--mutserve-vcf', type=Path, help='Mutserve VCF file')
+    parser.add_argument('--mutect2-vcf', type=Path, help='Mutect2 VCF file')
+    parser.add_argument('--output', type=Path, help='Output VCF file')
     parser.add_argument('--report', type=Path, help='Output JSON report file')
     parser.add_argument('--mode', choices=['fusion', 'intersection', 'union'], default='fusion',
                         help='Merge mode: fusion (default), intersection, or union')
+    parser.add_argument('--compress', action='store_true',
+                        help='Write BGZF-compressed output and a tabix (.tbi) index in the same pass')
+    parser.add_argument('--region', action='append', metavar='CHROM:START-END',
+                        help='Only merge variants overlapping this region (1-based, inclusive; repeatable)')
+    parser.add_argument('--regions-bed', type=Path, help='Only merge variants overlapping the regions in this BED file')
+    parser.add_argument('--mutserve-index', type=Path,
+                        help='Tabix/CSI index of the Mutserve VCF (default: <vcf>.tbi or <vcf>.csi)')
+    parser.add_argument('--mutect2-index', type=Path,
+                        help='Tabix/CSI index of the Mutect2 VCF (default: <vcf>.tbi or <vcf>.csi)')
+    parser.add_argument('--cohort', action='store_true',
+                        help='Cohort mode: fuse each sample column of multi-sample VCFs and write one multi-sample VCF')
+    parser.add_argument('--manifest', type=Path,
+                        help='Cohort mode input: TSV of (sample, mutserve_vcf, mutect2_vcf) rows')
+    parser.add_argument('--report-dir', type=Path, help='Cohort mode: directory for per-sample JSON reports')
+    parser.add_argument('--batch', type=Path,
+                        help='Batch mode: TSV of (sample, mutserve_vcf, mutect2_vcf, output) rows merged in parallel; '
+                             '--report then receives the aggregated statistics')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Batch mode: number of worker processes (default: CPU count)')
+    parser.add_argument('--contig-workers', type=int, default=1,
+                        help='Fuse each contig of multi-contig VCFs in its own process (default: 1, no parallelism); '
+                             'results are concatenated in ##contig order')
+    parser.add_argument('--input', action='append', metavar='CALLER=VCF',
+                        help='N-way fusion: a VCF tagged with its caller name (repeatable); replaces '
+                             '--mutserve-vcf/--mutect2-vcf')
+    parser.add_argument('--rules', type=Path,
+                        help='N-way fusion: JSON or YAML rule table with per-type caller precedence and confidence '
+                             'scores (default: the Mutserve/Mutect2 fusion rules)')
+    parser.add_argument('--reconcile-vaf', action='store_true',
+                        help='Fusion mode: combine both callers\' allele fractions into FUSION_AF with a 95%% '
+                             'confidence interval and flag discordant sites (requires NumPy)')
+    parser.add_argument('--vaf-discordance', type=float, default=0.1,
+                        help='Flag VAF_DISCORDANT when the callers\' allele fractions differ by more than this '
+                             '(default: 0.1)')
+    parser.add_argument('--normalize', action='store_true',
+                        help='Left-align, trim and decompose MNPs against --reference-fasta before matching variants')
+    parser.add_argument('--reference-fasta', type=Path,
+                        help='Reference FASTA for --normalize, e.g. the rCRS (chrM/MT are mapped to its mtDNA contig)')
+    parser.add_argument('--state-out', type=Path,
+                        help='Save the merge state (variant keys per caller and statistics) for later incremental runs')
+    parser.add_argument('--state', type=Path,
+                        help='Incremental mode: merge state from a previous run; only positions whose Mutect2 calls '
+                             'changed are re-fused')
+    parser.add_argument('--previous-output', type=Path, help='Incremental mode: output VCF of the previous run')
+    parser.add_argument('--verify-state', action='store_true',
+                        help='Incremental mode: also compare the SHA-256 of the Mutserve VCF with the state, not only '
+                             'its size and modification time')
+    parser.add_argument('--provenance', type=Path,
+                        help='Write per-variant provenance (contributing callers and the rule that fired) plus the '
+                             'fusion counters as JSON Lines while merging (.gz for gzip)')
+    parser.add_argument('--unsorted', action='store_true',
+                        help='Intersection/union: accept VCFs that are not coordinate-sorted (variant keys are packed '
+                             'into 64-bit integers and joined in memory with NumPy; requires NumPy)')
+    parser.add_argument('--columnar', type=Path,
+                        help='Also write the fused calls as Parquet (or Arrow IPC for .arrow/.feather/.ipc) with one '
+                             'row group per sample (requires pyarrow)')
+    parser.add_argument('--profile-json', type=Path,
+                        help='Write per-phase wall time, CPU time, peak RSS and records/bytes per second to this JSON file')
+    parser.add_argument('--profile-prometheus', action='store_true',
+                        help='Print the per-phase profile to stderr in the Prometheus text format')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a merge service reading JSON-RPC requests, one per line, from stdin')
+    parser.add_argument('--socket', type=Path,
+                        help='With --serve: listen on this Unix socket instead of stdin/stdout')
     
     args = parser.parse_args()
     
+    if args.socket and not args.serve:
+        parser.error('--socket requires --serve')
+    if args.serve:
+        run_serve(args)
+        return
+    
+    try:
+        args.regions = load_regions(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    
+    args.reference = None
+    normalization = NormalizationStats()
+    if args.normalize:
+        if not args.reference_fasta:
+            parser.error('--normalize requires --reference-fasta')
+        if args.batch or args.cohort or args.manifest or args.state or args.state_out:
+            parser.error('--normalize is supported for single-sample and --input merges only')
+        try:
+            args.reference = ReferenceFasta(args.reference_fasta)
+        except OSError as e:
+            parser.error(str(e))
+    
+    args.profiler = None
+    if args.profile_json or args.profile_prometheus:
+        if args.batch or args.cohort or args.manifest or args.state:
+            parser.error('profiling is supported for single-sample and --input merges only')
+        args.profiler = Profiler()
+    
+    if args.contig_workers < 1:
+        parser.error('--contig-workers must be at least 1')
+    if args.contig_workers > 1 and (args.batch or args.cohort or args.manifest or args.input or args.state
+                                    or args.state_out or args.unsorted or args.profiler):
+        parser.error('--contig-workers is supported for single-sample merges without --state/--state-out, '
+                     '--unsorted or profiling')
+    
+    if args.provenance and (args.batch or args.cohort or args.manifest or args.input or args.state
+                            or args.unsorted or args.contig_workers > 1):
+        parser.error('--provenance is supported for sequential single-sample merges of sorted input only')
+    
+    if args.unsorted and (args.mode == 'fusion' or args.input or args.cohort or args.manifest or args.normalize
+                          or args.state or args.state_out):
+        parser.error('--unsorted is supported for single-sample and batch intersection/union merges only')
+    
+    if args.batch:
+        if args.state or args.state_out or args.previous_output or args.rules or args.mutserve_index or args.mutect2_index:
+            parser.error('--state/--state-out/--previous-output, --rules and --mutserve-index/--mutect2-index '
+                         'are not supported in batch mode')
+        if args.reconcile_vaf and args.mode != 'fusion':
+            parser.error('--reconcile-vaf needs fusion mode')
+        run_batch(args)
+        return
+    
+    if not args.output:
+        parser.error('--output is required')
+    
+    if args.input:
+        if args.mode != 'fusion':
+            parser.error('--input only supports fusion mode')
+        if args.columnar:
+            parser.error('--columnar is not supported with --input')
+        try:
+            stats = run_engine(args, normalization)
+        except UnsortedInputError as e:
+            sys.exit(f'Error: {e}. Sort the input first (e.g. bcftools sort).')
+        except (OSError, ValueError) as e:
+            sys.exit(f'Error: {e}')
+        print(f'N-way fusion merge complete: {stats.final_variants} variants from {len(stats.callers)} callers')
+        print(f'  Consensus: {stats.consensus}')
+        print(f'  Conflicts resolved: {stats.conflicts_resolved}')
+        if args.normalize:
+            print(f'  Normalized: {normalization.realigned} realigned, {normalization.decomposed} MNPs decomposed')
+        write_profile(args)
+        return
+    
+    if args.cohort or args.manifest:
+        if not args.manifest and not (args.mutserve_vcf and args.mutect2_vcf):
+            parser.error('cohort mode requires --manifest or both --mutserve-vcf and --mutect2-vcf')
+        if (args.reconcile_vaf or args.state or args.state_out or args.previous_output or args.rules
+                or args.mutserve_index or args.mutect2_index):
+            parser.error('--reconcile-vaf, --state/--state-out/--previous-output, --rules and '
+                         '--mutserve-index/--mutect2-index are not supported in cohort mode')
+        run_cohort(args)
+        return
+    
+    if not (args.mutserve_vcf and args.mutect2_vcf):
+        parser.error('--mutserve-vcf and --mutect2-vcf are required')
+    
     if not args.mutserve_vcf.exists():
         sys.exit(f'Error: Mutserve VCF not found: {args.mutserve_vcf}')
     if not args.mutect2_vcf.exists():
         sys.exit(f'Error: Mutect2 VCF not found: {args.mutect2_vcf}')
     
-    mutserve_header, mutserve_variants = parse_vcf(args.mutserve_vcf, 'mutserve')
-    mutect2_header, mutect2_variants = parse_vcf(args.mutect2_vcf, 'mutect2')
+    if args.reconcile_vaf and (args.mode != 'fusion' or args.state or args.state_out):
+        parser.error('--reconcile-vaf needs a fusion-mode merge without --state/--state-out')
     
-    stats = FusionStats()
-    stats.mutserve_total = len(mutserve_variants)
-    stats.mutect2_total = len(mutect2_variants)
-    stats.mutserve_snvs = sum(1 for v in mutserve_variants if not v.is_indel)
-    stats.mutserve_indels = sum(1 for v in mutserve_variants if v.is_indel)
-    stats.mutect2_snvs = sum(1 for v in mutect2_variants if not v.is_indel)
-    stats.mutect2_indels = sum(1 for v in mutect2_variants if v.is_indel)
-    
-    if args.mode == 'fusion':
-        final_variants = fusion_merge(mutserve_variants, mutect2_variants, stats)
-    elif args.mode == 'intersection':
-        mutserve_keys = {v.key for v in mutserve_variants}
-        mutect2_keys = {v.key for v in mutect2_variants}
-        common_keys = mutserve_keys & mutect2_keys
-        final_variants = [v for v in mutserve_variants if v.key in common_keys]
-        stats.both_callers = len(final_variants)
-        stats.final_variants = len(final_variants)
-    else:
-        all_variants = {v.key: v for v in mutect2_variants}
-        all_variants.update({v.key: v for v in mutserve_variants})
-        final_variants = sorted(all_variants.values(), key=lambda x: (x.chrom, x.pos))
-        stats.final_variants = len(final_variants)
+    if args.state_out and (args.regions or args.mode != 'fusion'):
+        parser.error('--state-out needs a fusion-mode merge over the whole VCF')
+    
+    if args.columnar and args.state:
+        parser.error('--columnar cannot be combined with --state')
     
-    write_vcf(args.output, mutserve_header, final_variants, args.mode)
+    if args.verify_state and not args.state:
+        parser.error('--verify-state requires --state')
+    
+    if args.state:
+        if not args.previous_output:
+            parser.error('--state requires --previous-output')
+        if args.regions:
+            parser.error('--state cannot be combined with --region/--regions-bed')
+        try:
+            stats, refused = incremental_merge(
+                args.state, args.mutserve_vcf, args.mutect2_vcf, args.previous_output, args.output,
+                args.compress, args.mutserve_index, args.state_out, args.verify_state
+            )
+        except UnsortedInputError as e:
+            sys.exit(f'Error: {e}. Sort the input first (e.g. bcftools sort).')
+        except (OSError, ValueError) as e:
+            sys.exit(f'Error: {e}')
+        print(f'Incremental merge: {refused} positions re-fused')
+    else:
+        columns = SampleColumns() if args.columnar else None
+        if args.columnar:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                sys.exit('Error: pyarrow is required for --columnar')
+        try:
+            vaf_threshold = args.vaf_discordance if args.reconcile_vaf else None
+            if args.contig_workers > 1:
+                stats = merge_pair_by_contig(
+                    args.mutserve_vcf, args.mutect2_vcf, args.output, args.mode, args.contig_workers,
+                    args.compress, args.regions, args.mutserve_index, args.mutect2_index, vaf_threshold,
+                    args.reference, normalization, columns
+                )
+            else:
+                stats = merge_pair(
+                    args.mutserve_vcf, args.mutect2_vcf, args.output, args.mode, args.compress,
+                    args.regions, args.mutserve_index, args.mutect2_index, args.state_out, vaf_threshold,
+                    args.reference, normalization, args.profiler, columns, args.unsorted, args.provenance
+                )
+        except UnsortedInputError as e:
+            hint = ' or pass --unsorted' if args.mode != 'fusion' else ''
+            sys.exit(f'Error: {e}. Sort the input first (e.g. bcftools sort){hint}.')
+        except (OSError, ValueError) as e:
+            sys.exit(f'Error: {e}')
+        # 列式文件在合并成功后才创建, 合并失败时不会留下截断的文件
+        if columns is not None:
+            try:
+                with profile_phase(args.profiler, 'columnar'), ColumnarWriter(args.columnar) as writer:
+                    writer.write_sample(columns)
+            except (OSError, ValueError) as e:
+                sys.exit(f'Error: {e}')
     
     if args.report:
-        report = {
-            'mode': args.mode,
-            'version': '1.0.0',
-            'reference': 'PMID:38709886',
-            'statistics': {
-                'mutserve': {
-                    'total': stats.mutserve_total,
-                    'snvs': stats.mutserve_snvs,
-                    'indels': stats.mutserve_indels
-                },
-                'mutect2': {
-                    'total': stats.mutect2_total,
-                    'snvs': stats.mutect2_snvs,
-                    'indels': stats.mutect2_indels
-                },
-                'fusion_result': {
-                    'snvs_from_mutserve': stats.fusion_snvs_from_mutserve,
-                    'indels_from_mutect2': stats.fusion_indels_from_mutect2,
-                    'both_callers': stats.both_callers,
-                    'mutserve_only': stats.mutserve_only,
-                    'mutect2_only': stats.mutect2_only,
-                    'conflicts_resolved': stats.conflicts_resolved,
-                    'final_total': stats.final_variants
-                }
-            }
-        }
-        with open(args.report, 'w') as f:
-            json.dump(report, f, indent=2)
+        with profile_phase(args.profiler, 'report'):
+            report = build_report(stats, args.mode, args.reconcile_vaf)
+            if args.normalize:
+                report['statistics']['normalization'] = asdict(normalization)
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
     
     print(f'Fusion merge complete: {stats.final_variants} variants')
     print(f'  SNVs from Mutserve: {stats.fusion_snvs_from_mutserve}')
     print(f'  INDELs from Mutect2: {stats.fusion_indels_from_mutect2}')
     print(f'  Both callers: {stats.both_callers}')
     print(f'  Conflicts resolved: {stats.conflicts_resolved}')
+    if args.reconcile_vaf:
+        print(f'  VAF discordant: {stats.vaf_discordant}/{stats.vaf_both_callers}')
+    if args.normalize:
+        print(f'  Normalized: {normalization.realigned} realigned, {normalization.decomposed} MNPs decomposed')
+    write_profile(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+mtDNA Fusion Merger 基准测试 (pytest-benchmark)
+
+分别测量 parse_vcf、fusion_merge 和 write_vcf 三个阶段:
+1. 吞吐量 (records/s) 记录在每个基准的 extra_info 中
+2. 峰值 RSS 在独立子进程中测量, 避免各阶段互相污染
+
+数据由 synthetic_vcf.py 按固定种子生成, 规模从 1k 到 10M 个位点;
+默认只运行不超过 MTDNA_BENCH_MAX_SITES (默认 100000) 的规模。
+
+用法:
+    pytest tests/bench_fusion_merger.py --benchmark-only
+    MTDNA_BENCH_MAX_SITES=10000000 pytest tests/bench_fusion_merger.py --benchmark-json bench.json
+
+环境变量:
+    MTDNA_BENCH_MAX_SITES           最大位点数
+    MTDNA_BENCH_MULTIALLELIC        多等位位点比例 (默认 0.05)
+    MTDNA_BENCH_INDEL_FRACTION      INDEL 比例 (默认 0.1)
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import mtdna_fusion_merger as merger  # noqa: E402
+from synthetic_vcf import write_synthetic_pair  # noqa: E402
+
+SIZES = [1_000, 100_000, 1_000_000, 10_000_000]
+MAX_SITES = int(os.environ.get('MTDNA_BENCH_MAX_SITES', 100_000))
+MULTIALLELIC_FRACTION = float(os.environ.get('MTDNA_BENCH_MULTIALLELIC', 0.05))
+INDEL_FRACTION = float(os.environ.get('MTDNA_BENCH_INDEL_FRACTION', 0.1))
+SEED = 20240501
+
+BENCH_SIZES = [
+    pytest.param(size, marks=pytest.mark.skip(reason=f'{size} sites > MTDNA_BENCH_MAX_SITES={MAX_SITES}'))
+    if size > MAX_SITES else size
+    for size in SIZES
+]
+
+
+@pytest.fixture(scope='module')
+def synthetic_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('synthetic_vcf')
+
+
+def synthetic_pair(directory: Path, sites: int, compress: bool) -> tuple[Path, Path]:
+    """同一规模只生成一次"""
+    subdir = directory / ('gzip' if compress else 'plain')
+    suffix = '.vcf.gz' if compress else '.vcf'
+    paths = (subdir / f'mutserve_{sites}_{SEED}{suffix}', subdir / f'mutect2_{sites}_{SEED}{suffix}')
+    if not all(path.exists() for path in paths):
+        paths = write_synthetic_pair(subdir, sites, SEED, MULTIALLELIC_FRACTION, INDEL_FRACTION, compress=compress)
+    return paths
+
+
+def parse_pair(mutserve_vcf: Path, mutect2_vcf: Path):
+    mutserve_header, mutserve_variants = merger.parse_vcf(mutserve_vcf, 'mutserve')
+    mutect2_header, mutect2_variants = merger.parse_vcf(mutect2_vcf, 'mutect2')
+    return mutserve_header, mutect2_header, mutserve_variants, mutect2_variants
+
+
+def fuse(parsed):
+    mutserve_header, mutect2_header, mutserve_variants, mutect2_variants = parsed
+    contig_rank = merger.contig_order(mutserve_header, mutect2_header)
+    return list(merger.fusion_merge(mutserve_variants, mutect2_variants, merger.FusionStats(), contig_rank))
+
+
+def _phase_peak_rss(phase: str, mutserve_vcf: Path, mutect2_vcf: Path, output: Path, queue) -> None:
+    """子进程: 先准备好该阶段的输入, 再记录阶段前后的 ru_maxrss (KB)"""
+    parsed = fused = None
+    if phase != 'parse_vcf':
+        parsed = parse_pair(mutserve_vcf, mutect2_vcf)
+    if phase == 'write_vcf':
+        fused = fuse(parsed)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    if phase == 'parse_vcf':
+        parse_pair(mutserve_vcf, mutect2_vcf)
+    elif phase == 'fusion_merge':
+        fuse(parsed)
+    else:
+        merger.write_vcf(output, parsed[0], fused, 'fusion')
+    
+    queue.put((before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def peak_rss(phase: str, mutserve_vcf: Path, mutect2_vcf: Path, output: Path) -> dict:
+    ctx = multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_phase_peak_rss, args=(phase, mutserve_vcf, mutect2_vcf, output, queue))
+    process.start()
+    before, after = queue.get()
+    process.join()
+    return {'peak_rss_mb': round(after / 1024, 1), 'phase_rss_growth_mb': round((after - before) / 1024, 1)}
+
+
+def record_throughput(benchmark, records: int, rss: dict) -> None:
+    benchmark.extra_info['records'] = records
+    benchmark.extra_info['records_per_s'] = round(records / benchmark.stats.stats.mean)
+    benchmark.extra_info.update(rss)
+
+
+@pytest.mark.parametrize('compress', [False, True], ids=['plain', 'gzip'])
+@pytest.mark.parametrize('sites', BENCH_SIZES)
+def test_bench_parse_vcf(benchmark, synthetic_dir, sites, compress):
+    mutserve_vcf, mutect2_vcf = synthetic_pair(synthetic_dir, sites, compress)
+    
+    parsed = benchmark.pedantic(parse_pair, args=(mutserve_vcf, mutect2_vcf), rounds=3, iterations=1)
+    
+    records = len(parsed[2]) + len(parsed[3])
+    assert records > 0
+    record_throughput(benchmark, records,
+                      peak_rss('parse_vcf', mutserve_vcf, mutect2_vcf, synthetic_dir / 'rss.vcf'))
+
+
+@pytest.mark.parametrize('sites', BENCH_SIZES)
+def test_bench_fusion_merge(benchmark, synthetic_dir, sites):
+    mutserve_vcf, mutect2_vcf = synthetic_pair(synthetic_dir, sites, False)
+    parsed = parse_pair(mutserve_vcf, mutect2_vcf)
+    
+    fused = benchmark.pedantic(fuse, args=(parsed,), rounds=3, iterations=1)
+    
+    assert fused
+    record_throughput(benchmark, len(parsed[2]) + len(parsed[3]),
+                      peak_rss('fusion_merge', mutserve_vcf, mutect2_vcf, synthetic_dir / 'rss.vcf'))
+
+
+@pytest.mark.parametrize('compress', [False, True], ids=['plain', 'bgzf'])
+@pytest.mark.parametrize('sites', BENCH_SIZES)
+def test_bench_write_vcf(benchmark, synthetic_dir, sites, compress):
+    mutserve_vcf, mutect2_vcf = synthetic_pair(synthetic_dir, sites, False)
+    parsed = parse_pair(mutserve_vcf, mutect2_vcf)
+    fused = fuse(parsed)
+    output = synthetic_dir / ('fused.vcf.gz' if compress else 'fused.vcf')
+    
+    benchmark.pedantic(merger.write_vcf, args=(output, parsed[0], fused, 'fusion', compress), rounds=3, iterations=1)
+    
+    assert output.stat().st_size > 0
+    record_throughput(benchmark, len(fused),
+                      peak_rss('write_vcf', mutserve_vcf, mutect2_vcf, synthetic_dir / 'rss.vcf'))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+合成 Mutserve/Mutect2 VCF 生成器 (用于基准测试)
+
+同一个种子总是生成相同的一对文件:
+1. 位点按坐标排序, 超过一条 chrM 的长度时依次追加 chrM_2, chrM_3 ... 等同长度的合成染色体
+2. 可配置两个工具共有位点的比例、多等位位点比例和 INDEL 比例
+3. 可输出纯文本或 gzip 压缩的 VCF
+
+用法:
+    python synthetic_vcf.py --sites 100000 --out-dir /tmp/synthetic --gzip
+"""
+
+import argparse
+import gzip
+import random
+from pathlib import Path
+from typing import Iterator
+
+CONTIG_LENGTH = 16569
+BASES = 'ACGT'
+
+
+def contig_name(index: int) -> str:
+    return 'chrM' if index == 0 else f'chrM_{index + 1}'
+
+
+def header_lines(contigs: int, source: str) -> list[str]:
+    lines = ['##fileformat=VCFv4.2', '##FILTER=<ID=PASS,Description="All filters passed">']
+    if source == 'mutect2':
+        lines += [
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">',
+            '##INFO=<ID=TLOD,Number=A,Type=Float,Description="Log odds ratio score for variant">',
+            '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths for the ref and alt alleles">'
+        ]
+    lines += [
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+        '##FORMAT=<ID=AF,Number=A,Type=Float,Description="Allele fraction">',
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">'
+    ]
+    lines += [f'##contig=<ID={contig_name(i)},length={CONTIG_LENGTH}>' for i in range(contigs)]
+    lines.append(f'##source={source}')
+    lines.append('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE')
+    return lines
+
+
+def random_alt(rnd: random.Random, ref: str, indel_fraction: float) -> tuple[str, str]:
+    """返回 (REF, ALT); INDEL 一半是插入一半是缺失"""
+    if rnd.random() >= indel_fraction:
+        return ref, rnd.choice([b for b in BASES if b != ref])
+    extra = ''.join(rnd.choice(BASES) for _ in range(rnd.randint(1, 3)))
+    if rnd.random() < 0.5:
+        return ref, ref + extra
+    return ref + extra, ref
+
+
+def synthetic_sites(
+    sites: int,
+    seed: int = 0,
+    multiallelic_fraction: float = 0.05,
+    indel_fraction: float = 0.1,
+    shared_fraction: float = 0.7
+) -> Iterator[tuple[str, int, str, list[str], str]]:
+    """
+    按坐标顺序产出 (chrom, pos, ref, alts, callers) 位点, callers 为
+    'both'、'mutserve' 或 'mutect2'; 每条染色体上约一半的位置有变异
+    """
+    rnd = random.Random(seed)
+    contig = 0
+    pos = 0
+    for _ in range(sites):
+        pos += rnd.randint(1, 3)
+        if pos > CONTIG_LENGTH:
+            contig += 1
+            pos = rnd.randint(1, 3)
+        ref_base = rnd.choice(BASES)
+        ref, alt = random_alt(rnd, ref_base, indel_fraction)
+        alts = [alt]
+        if len(ref) == 1 and rnd.random() < multiallelic_fraction:
+            alts.append(rnd.choice([b for b in BASES if b not in (ref, alt)] or [ref + 'A']))
+        
+        roll = rnd.random()
+        if roll < shared_fraction:
+            callers = 'both'
+        elif roll < shared_fraction + (1 - shared_fraction) / 2:
+            callers = 'mutserve'
+        else:
+            callers = 'mutect2'
+        yield contig_name(contig), pos, ref, alts, callers
+
+
+def write_synthetic_pair(
+    out_dir: Path,
+    sites: int,
+    seed: int = 0,
+    multiallelic_fraction: float = 0.05,
+    indel_fraction: float = 0.1,
+    shared_fraction: float = 0.7,
+    compress: bool = False
+) -> tuple[Path, Path]:
+    """写出一对合成 VCF, 返回 (Mutserve VCF, Mutect2 VCF)"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    suffix = '.vcf.gz' if compress else '.vcf'
+    mutserve_path = out_dir / f'mutserve_{sites}_{seed}{suffix}'
+    mutect2_path = out_dir / f'mutect2_{sites}_{seed}{suffix}'
+    contigs = sites * 2 // CONTIG_LENGTH + 1
+    opener = gzip.open if compress else open
+    rnd = random.Random(seed + 1)
+    
+    with opener(mutserve_path, 'wt') as ms, opener(mutect2_path, 'wt') as m2:
+        ms.write('\n'.join(header_lines(contigs, 'mutserve')) + '\n')
+        m2.write('\n'.join(header_lines(contigs, 'mutect2')) + '\n')
+        for chrom, pos, ref, alts, callers in synthetic_sites(
+                sites, seed, multiallelic_fraction, indel_fraction, shared_fraction):
+            alt = ','.join(alts)
+            depth = rnd.randint(100, 5000)
+            af = ','.join(f'{rnd.random():.3f}' for _ in alts)
+            gt = '1/2' if len(alts) > 1 else '0/1'
+            if callers != 'mutect2':
+                ms.write(f'{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\t.\tGT:AF:DP\t{gt}:{af}:{depth}\n')
+            if callers != 'mutserve':
+                ad = ','.join(str(rnd.randint(1, depth)) for _ in range(len(alts) + 1))
+                tlod = ','.join(f'{rnd.uniform(5, 5000):.1f}' for _ in alts)
+                m2.write(f'{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\tDP={depth};TLOD={tlod}\t'
+                         f'GT:AD:AF:DP\t{gt}:{ad}:{af}:{depth}\n')
+    return mutserve_path, mutect2_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Mutserve/Mutect2 VCF pair')
+    parser.add_argument('--sites', type=int, default=10000, help='Number of variant sites')
+    parser.add_argument('--out-dir', type=Path, required=True, help='Output directory')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--multiallelic-fraction', type=float, default=0.05, help='Fraction of multi-allelic SNV sites')
+    parser.add_argument('--indel-fraction', type=float, default=0.1, help='Fraction of INDEL sites')
+    parser.add_argument('--shared-fraction', type=float, default=0.7, help='Fraction of sites called by both callers')
+    parser.add_argument('--gzip', action='store_true', help='Write gzip-compressed VCFs')
+    args = parser.parse_args()
+    
+    paths = write_synthetic_pair(
+        args.out_dir, args.sites, args.seed, args.multiallelic_fraction,
+        args.indel_fraction, args.shared_fraction, args.gzip
+    )
+    for path in paths:
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,11 +11,15 @@ mtDNA Fusion Merger 测试脚本
 基于 PMID:38709886 (mtDNA-Server 2) 的融合策略
 """
 
+import gzip
 import json
 import os
+import shutil
+import socket
 import subprocess
 import sys
 import tempfile
+import time
 from pathlib import Path
 
 
@@ -127,6 +131,14 @@ def test_fusion_mode_basic():
         print(f"  From Mutserve: {mutserve_count}")
         print(f"  From Mutect2: {mutect2_count}")
         
+        # 再次融合上一次的输出时, 原有的融合标签被替换而不是重复
+        refused_vcf = Path(tmpdir) / 'refused.vcf'
+        assert run_fusion_merger(output_vcf, mutect2_vcf, refused_vcf, Path(tmpdir) / 'refused.json') == 0
+        for line in refused_vcf.read_text().splitlines():
+            if not line.startswith('#'):
+                tags = [item.split('=', 1)[0] for item in line.split('\t')[7].split(';')]
+                assert tags.count('FUSION_SOURCE') == 1 and tags.count('FUSION_CONFIDENCE') == 1, line
+        
         print("\n[PASS] Basic fusion mode test passed")
         return True
 
@@ -331,6 +343,1171 @@ def test_union_mode():
         return True
 
 
+def test_gzip_input():
+    """测试 gzip 压缩输入 (按魔数识别, 与扩展名无关)"""
+    print("\n" + "=" * 60)
+    print("Test 7: Gzip Input")
+    print("=" * 60)
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # 压缩后的 Mutect2 VCF 故意不使用 .gz 扩展名
+        mutect2_gz = Path(tmpdir) / 'mutect2_test.vcf'
+        with open(mutect2_vcf, 'rb') as src, gzip.open(mutect2_gz, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        
+        plain_vcf = Path(tmpdir) / 'plain.vcf'
+        gz_vcf = Path(tmpdir) / 'gz.vcf'
+        report_json = Path(tmpdir) / 'report.json'
+        
+        assert run_fusion_merger(mutserve_vcf, mutect2_vcf, plain_vcf, report_json) == 0
+        assert run_fusion_merger(mutserve_vcf, mutect2_gz, gz_vcf, report_json) == 0
+        
+        plain_variants = parse_vcf_variants(plain_vcf)
+        gz_variants = parse_vcf_variants(gz_vcf)
+        print(f"\n  Plain input: {len(plain_variants)} variants, gzip input: {len(gz_variants)} variants")
+        
+        assert plain_variants == gz_variants, "Gzip input produced different output"
+        
+        print("\n[PASS] Gzip input test passed")
+        return True
+
+
+def test_unsorted_input_rejected():
+    """测试流式归并拒绝未按坐标排序的输入"""
+    print("\n" + "=" * 60)
+    print("Test 8: Unsorted Input Rejected")
+    print("=" * 60)
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(mutect2_vcf) as f:
+            lines = f.readlines()
+        header = [l for l in lines if l.startswith('#')]
+        records = [l for l in lines if not l.startswith('#')]
+        
+        unsorted_vcf = Path(tmpdir) / 'unsorted.vcf'
+        with open(unsorted_vcf, 'w') as f:
+            f.writelines(header + records[::-1])
+        
+        output_vcf = Path(tmpdir) / 'output.vcf'
+        report_json = Path(tmpdir) / 'report.json'
+        
+        ret = run_fusion_merger(mutserve_vcf, unsorted_vcf, output_vcf, report_json)
+        assert ret != 0, "Unsorted input should be rejected"
+        
+        # 未声明的染色体: 每个输入只按自己的顺序判断是否排序, 两个输入的顺序矛盾时单独报错
+        script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+        columns = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n'
+        
+        def contig_vcf(name: str, contigs: list) -> Path:
+            path = Path(tmpdir) / name
+            path.write_text('##fileformat=VCFv4.2\n' + columns + ''.join(
+                f'{chrom}\t{pos}\t.\tA\tG\t50\tPASS\t.\tGT\t1\n' for chrom, pos in contigs
+            ))
+            return path
+        
+        def merge_error(mutserve: Path, mutect2: Path) -> str:
+            result = subprocess.run([sys.executable, str(script_path), '--mutserve-vcf', str(mutserve),
+                                     '--mutect2-vcf', str(mutect2), '--output', str(output_vcf)],
+                                    capture_output=True, text=True)
+            assert result.returncode != 0, "Merge should fail"
+            return result.stderr
+        
+        chr1_first = contig_vcf('chr1_first.vcf', [('chr1', 10), ('chrM', 10)])
+        chrM_first = contig_vcf('chrM_first.vcf', [('chrM', 10), ('chr1', 10)])
+        revisited = contig_vcf('revisited.vcf', [('chrM', 10), ('chr1', 10), ('chrM', 20)])
+        assert 'differently' in merge_error(chr1_first, chrM_first)
+        assert 'not coordinate-sorted at chrM:20' in merge_error(chrM_first, revisited)
+        
+        print("\n[PASS] Unsorted input test passed")
+        return True
+
+
+def test_cohort_manifest():
+    """测试队列模式: 清单中每对 VCF 按样本名取列融合, 输出一个多样本 VCF、逐样本报告和类型合并后的表头"""
+    print("\n" + "=" * 60)
+    print("Test 9: Cohort Mode (manifest)")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest = Path(tmpdir) / 'manifest.tsv'
+        with open(manifest, 'w') as f:
+            # Mutserve 文件有 test.cram/test1.cram 两列, 按名字取列; Mutect2 文件只有一列, 直接使用
+            f.write('sample\tmutserve_vcf\tmutect2_vcf\n')
+            f.write(f'test.cram\t{mutserve_vcf}\t{mutect2_vcf}\n')
+            f.write(f'test1.cram\t{mutserve_vcf}\t{mutect2_vcf}\n')
+        
+        output_vcf = Path(tmpdir) / 'cohort.vcf'
+        report_dir = Path(tmpdir) / 'reports'
+        cohort_report = Path(tmpdir) / 'cohort.json'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--manifest', str(manifest),
+            '--output', str(output_vcf),
+            '--report-dir', str(report_dir),
+            '--report', str(cohort_report)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        with open(output_vcf) as f:
+            header = [l.rstrip('\n') for l in f if l.startswith('##FORMAT=<ID=AF,')]
+            f.seek(0)
+            lines = [l.rstrip('\n').split('\t') for l in f if not l.startswith('##')]
+        assert lines[0][9:] == ['test.cram', 'test1.cram'], f"Unexpected sample columns: {lines[0][9:]}"
+        # 两个工具的 FORMAT/AF 定义经类型合并放宽为一行
+        assert len(header) == 1 and 'Number=.' in header[0] and 'Type=String' in header[0], header
+        with open(cohort_report) as f:
+            assert any('AF' in widened for widened in json.load(f)['header_widened'])
+        
+        for column, name in ((9, 'test.cram'), (10, 'test1.cram')):
+            with open(report_dir / f'{name}.fusion_report.json') as f:
+                report = json.load(f)
+            called = sum(1 for fields in lines[1:] if fields[column] != '.')
+            print(f"  {name}: {called} called sites")
+            assert report['statistics']['fusion_result']['final_total'] == called
+        
+        # 多样本 VCF 中找不到清单样本名时报错, 不再退回第一列
+        with open(manifest, 'a') as f:
+            f.write(f'S3\t{mutserve_vcf}\t{mutect2_vcf}\n')
+        result = subprocess.run([
+            sys.executable, str(script_path), '--manifest', str(manifest), '--output', str(output_vcf)
+        ], capture_output=True, text=True)
+        assert result.returncode != 0 and 'sample S3 not found' in result.stderr, result.stderr
+        
+        # 队列模式不支持的参数直接拒绝, 不再静默忽略
+        for extra in (['--reconcile-vaf'], ['--state-out', str(Path(tmpdir) / 'state.json')]):
+            result = subprocess.run([
+                sys.executable, str(script_path), '--cohort', '--mutserve-vcf', str(mutserve_vcf),
+                '--mutect2-vcf', str(mutect2_vcf), '--output', str(output_vcf), *extra
+            ], capture_output=True, text=True)
+            assert result.returncode == 2 and 'not supported in cohort mode' in result.stderr, result.stderr
+        
+        print("\n[PASS] Cohort manifest test passed")
+        return True
+
+
+def test_batch_mode():
+    """测试批处理模式: 进程池并行处理多个样本并汇总统计"""
+    print("\n" + "=" * 60)
+    print("Test 10: Batch Mode")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        single_vcf = Path(tmpdir) / 'single.vcf'
+        single_json = Path(tmpdir) / 'single.json'
+        assert run_fusion_merger(mutserve_vcf, mutect2_vcf, single_vcf, single_json) == 0
+        with open(single_json) as f:
+            single = json.load(f)['statistics']['fusion_result']
+        
+        batch_tsv = Path(tmpdir) / 'batch.tsv'
+        outputs = [Path(tmpdir) / f'S{i}.vcf' for i in range(3)]
+        with open(batch_tsv, 'w') as f:
+            for i, output in enumerate(outputs):
+                f.write(f'S{i}\t{mutserve_vcf}\t{mutect2_vcf}\t{output}\n')
+        
+        batch_json = Path(tmpdir) / 'batch.json'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--batch', str(batch_tsv),
+            '--workers', '2',
+            '--report', str(batch_json)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        with open(batch_json) as f:
+            batch = json.load(f)
+        
+        print(f"\n  Samples: {batch['succeeded']}/{batch['samples']}")
+        assert batch['succeeded'] == 3
+        for key, value in single.items():
+            assert batch['statistics']['fusion_result'][key] == 3 * value, f"Aggregated {key} mismatch"
+        for output in outputs:
+            assert output.read_text() == single_vcf.read_text(), f"{output.name} differs from single-sample run"
+        
+        region_vcf = Path(tmpdir) / 'region.vcf'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(mutserve_vcf),
+            '--mutect2-vcf', str(mutect2_vcf),
+            '--output', str(region_vcf),
+            '--region', 'chrM:1-576'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--batch', str(batch_tsv),
+            '--region', 'chrM:1-576'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        for output in outputs:
+            assert output.read_text() == region_vcf.read_text(), f"{output.name} ignores --region in batch mode"
+        
+        # --reconcile-vaf 传给每个样本的合并, 与单样本运行相同
+        vaf_vcf = Path(tmpdir) / 'vaf.vcf'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(mutserve_vcf), '--mutect2-vcf', str(mutect2_vcf),
+            '--output', str(vaf_vcf), '--reconcile-vaf'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        result = subprocess.run([
+            sys.executable, str(script_path), '--batch', str(batch_tsv), '--reconcile-vaf', '--report', str(batch_json)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        for output in outputs:
+            assert output.read_text() == vaf_vcf.read_text(), f"{output.name} ignores --reconcile-vaf in batch mode"
+        with open(batch_json) as f:
+            assert 'heteroplasmy' in json.load(f)['statistics']
+        
+        # 批处理不支持的参数直接拒绝
+        result = subprocess.run([
+            sys.executable, str(script_path), '--batch', str(batch_tsv), '--state-out', str(Path(tmpdir) / 'state.json')
+        ], capture_output=True, text=True)
+        assert result.returncode == 2 and 'not supported in batch mode' in result.stderr, result.stderr
+        
+        # 单个样本失败 (未排序输入、文件不存在) 只记入 failed, 其余样本照常输出
+        unsorted_vcf = Path(tmpdir) / 'unsorted.vcf'
+        lines = mutect2_vcf.read_text().splitlines(True)
+        body = [l for l in lines if not l.startswith('#')]
+        unsorted_vcf.write_text(''.join([l for l in lines if l.startswith('#')] + body[::-1]))
+        with open(batch_tsv, 'w') as f:
+            f.write(f'S0\t{mutserve_vcf}\t{mutect2_vcf}\t{outputs[0]}\n')
+            f.write(f'S1\t{mutserve_vcf}\t{unsorted_vcf}\t{outputs[1]}\n')
+            f.write(f'S2\t{mutserve_vcf}\t{Path(tmpdir) / "missing.vcf"}\t{outputs[2]}\n')
+        result = subprocess.run([
+            sys.executable, str(script_path), '--batch', str(batch_tsv), '--report', str(batch_json)
+        ], capture_output=True, text=True)
+        assert result.returncode == 1, result.stderr
+        with open(batch_json) as f:
+            batch = json.load(f)
+        print(f"  Failed samples: {sorted(batch['failed'])}")
+        assert batch['succeeded'] == 1 and sorted(batch['failed']) == ['S1', 'S2']
+        assert 'not coordinate-sorted' in batch['failed']['S1']
+        assert outputs[0].read_text() == single_vcf.read_text()
+        
+        print("\n[PASS] Batch mode test passed")
+        return True
+
+
+def test_compressed_output():
+    """测试 BGZF 压缩输出和同一遍生成的 tabix 索引"""
+    print("\n" + "=" * 60)
+    print("Test 11: BGZF Output + Tabix Index")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        plain_vcf = Path(tmpdir) / 'output.vcf'
+        report_json = Path(tmpdir) / 'report.json'
+        assert run_fusion_merger(mutserve_vcf, mutect2_vcf, plain_vcf, report_json) == 0
+        
+        gz_vcf = Path(tmpdir) / 'output.vcf.gz'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(mutserve_vcf),
+            '--mutect2-vcf', str(mutect2_vcf),
+            '--output', str(gz_vcf),
+            '--compress'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        raw = gz_vcf.read_bytes()
+        assert raw[12:16] == b'BC\x02\x00', "Output is not BGZF"
+        with gzip.open(gz_vcf, 'rt') as f:
+            assert f.read() == plain_vcf.read_text(), "Decompressed output differs from plain output"
+        
+        index_path = Path(f'{gz_vcf}.tbi')
+        assert index_path.exists(), "Tabix index not created"
+        with gzip.open(index_path, 'rb') as f:
+            assert f.read(4) == b'TBI\x01', "Invalid tabix index magic"
+        
+        print("\n[PASS] Compressed output test passed")
+        return True
+
+
+def test_region_restriction():
+    """测试区域限定: 有索引的 BGZF 输入按索引定位, 结果与顺序扫描过滤一致"""
+    print("\n" + "=" * 60)
+    print("Test 12: Region Restriction")
+    print("=" * 60)
+    
+    script_dir = Path(__file__).parent.parent
+    sys.path.insert(0, str(script_dir))
+    from mtdna_fusion_merger import VcfOutput
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        indexed = {}
+        for vcf in (mutserve_vcf, mutect2_vcf):
+            indexed[vcf] = Path(tmpdir) / f'{vcf.name}.gz'
+            with open(vcf) as src, VcfOutput(indexed[vcf], compress=True) as out:
+                for line in src:
+                    line = line.rstrip('\n')
+                    if line.startswith('#'):
+                        out.write_header(line)
+                    else:
+                        fields = line.split('\t')
+                        out.write_record(fields[0], int(fields[1]), fields[3], line)
+        
+        regions = ['--region', 'chrM:1-576', '--region', 'chrM:16024-16569']
+        outputs = {}
+        for label, ms, m2 in (('plain', mutserve_vcf, mutect2_vcf),
+                              ('indexed', indexed[mutserve_vcf], indexed[mutect2_vcf])):
+            outputs[label] = Path(tmpdir) / f'{label}.vcf'
+            result = subprocess.run([
+                sys.executable, str(script_dir / 'mtdna_fusion_merger.py'),
+                '--mutserve-vcf', str(ms),
+                '--mutect2-vcf', str(m2),
+                '--output', str(outputs[label])
+            ] + regions, capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+        
+        variants = parse_vcf_variants(outputs['indexed'])
+        print(f"\n  Variants in regions: {len(variants)}")
+        assert variants, "No variants in D-loop regions"
+        assert all(v['pos'] <= 576 or v['pos'] >= 16024 for v in variants), "Variant outside requested regions"
+        assert variants == parse_vcf_variants(outputs['plain']), "Indexed and scanned results differ"
+        
+        print("\n[PASS] Region restriction test passed")
+        return True
+
+
+def test_incremental_merge():
+    """测试增量融合: 用状态文件更新重新调用的 Mutect2 结果, 与完整重算一致"""
+    print("\n" + "=" * 60)
+    print("Test 13: Incremental Merge")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        # 模拟换过滤条件后重新调用: 去掉每隔三条中的一条
+        recalled_vcf = tmpdir / 'mutect2_recalled.vcf'
+        with open(mutect2_vcf) as src, open(recalled_vcf, 'w') as dst:
+            records = 0
+            for line in src:
+                if not line.startswith('#'):
+                    records += 1
+                    if records % 3 == 0:
+                        continue
+                dst.write(line)
+        
+        def run(*extra):
+            result = subprocess.run([
+                sys.executable, str(script_path), '--mutserve-vcf', str(mutserve_vcf)
+            ] + [str(arg) for arg in extra], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+            return result.stdout
+        
+        run('--mutect2-vcf', mutect2_vcf, '--output', tmpdir / 'first.vcf', '--state-out', tmpdir / 'state.json')
+        run('--mutect2-vcf', recalled_vcf, '--output', tmpdir / 'full.vcf', '--report', tmpdir / 'full.json')
+        stdout = run('--mutect2-vcf', recalled_vcf, '--output', tmpdir / 'incremental.vcf',
+                     '--report', tmpdir / 'incremental.json',
+                     '--state', tmpdir / 'state.json', '--previous-output', tmpdir / 'first.vcf')
+        
+        print(f"\n  {stdout.splitlines()[0]}")
+        assert (tmpdir / 'incremental.vcf').read_text() == (tmpdir / 'full.vcf').read_text(), \
+            "Incremental output differs from full merge"
+        assert json.loads((tmpdir / 'incremental.json').read_text()) == json.loads((tmpdir / 'full.json').read_text()), \
+            "Incremental statistics differ from full merge"
+        
+        # 大小不变但内容改动过的 Mutserve VCF 必须被拒绝
+        edited_vcf = tmpdir / 'mutserve_edited.vcf'
+        text = mutserve_vcf.read_text()
+        edited_vcf.write_text(text.replace('PASS', 'FAIL', 1))
+        assert edited_vcf.stat().st_size == mutserve_vcf.stat().st_size
+        result = subprocess.run([
+            sys.executable, str(script_path), '--mutserve-vcf', str(edited_vcf),
+            '--mutect2-vcf', str(recalled_vcf), '--output', str(tmpdir / 'edited.vcf'),
+            '--state', str(tmpdir / 'state.json'), '--previous-output', str(tmpdir / 'first.vcf')
+        ], capture_output=True, text=True)
+        assert result.returncode != 0 and 'run a full merge' in result.stderr, result.stderr
+        
+        # 大小和修改时间都与状态一致时默认不再读文件计算 SHA-256; --verify-state 才比较内容
+        state_mutserve = tmpdir / 'mutserve_state.vcf'
+        shutil.copy2(mutserve_vcf, state_mutserve)
+        result = subprocess.run([
+            sys.executable, str(script_path), '--mutserve-vcf', str(state_mutserve), '--mutect2-vcf', str(mutect2_vcf),
+            '--output', str(tmpdir / 'copy_first.vcf'), '--state-out', str(tmpdir / 'copy_state.json')
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        recorded = json.loads((tmpdir / 'copy_state.json').read_text())['mutserve_vcf']
+        assert recorded['mtime_ns'] == state_mutserve.stat().st_mtime_ns and len(recorded['sha256']) == 64
+        state_mutserve.write_text(text.replace('PASS', 'FAIL', 1))
+        os.utime(state_mutserve, ns=(recorded['mtime_ns'], recorded['mtime_ns']))
+        for extra, accepted in (([], True), (['--verify-state'], False)):
+            result = subprocess.run([
+                sys.executable, str(script_path), '--mutserve-vcf', str(state_mutserve),
+                '--mutect2-vcf', str(recalled_vcf), '--output', str(tmpdir / 'copy_incremental.vcf'),
+                '--state', str(tmpdir / 'copy_state.json'), '--previous-output', str(tmpdir / 'copy_first.vcf'),
+                *extra
+            ], capture_output=True, text=True)
+            assert (result.returncode == 0) == accepted, result.stderr
+        assert 'run a full merge' in result.stderr, result.stderr
+        
+        print("\n[PASS] Incremental merge test passed")
+        return True
+
+
+def test_nway_engine():
+    """测试 N 路融合: 默认规则与两工具融合一致, 自定义规则表可以加入第三个工具"""
+    print("\n" + "=" * 60)
+    print("Test 14: N-way Fusion Engine")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        pairwise_vcf = tmpdir / 'pairwise.vcf'
+        assert run_fusion_merger(mutserve_vcf, mutect2_vcf, pairwise_vcf, tmpdir / 'pairwise.json') == 0
+        
+        def run_engine(output_vcf: Path, *extra) -> None:
+            result = subprocess.run([sys.executable, str(script_path), '--output', str(output_vcf)] +
+                                    [str(arg) for arg in extra], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+        
+        default_vcf = tmpdir / 'default.vcf'
+        run_engine(default_vcf, '--input', f'mutserve={mutserve_vcf}', '--input', f'mutect2={mutect2_vcf}')
+        pairwise = parse_vcf_variants(pairwise_vcf)
+        default = parse_vcf_variants(default_vcf)
+        for v in default:
+            assert v['info'].pop('FUSION_CALLERS'), "FUSION_CALLERS missing"
+        assert default == pairwise, "Default rules differ from the pairwise fusion"
+        
+        # 第三个工具报告一个三者共有的 SNV 和一个其他工具都没有的 SNV
+        mity_vcf = tmpdir / 'mity.vcf'
+        mity_vcf.write_text(
+            '##fileformat=VCFv4.2\n##contig=<ID=chrM,length=16569>\n'
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA12878\n'
+            'chrM\t73\t.\tA\tG\t50\tPASS\t.\tGT\t1/1\n'
+            'chrM\t100\t.\tG\tA\t50\tPASS\t.\tGT\t0/1\n'
+        )
+        rules_json = tmpdir / 'rules.json'
+        rules_json.write_text(json.dumps({
+            'precedence': {'snv': ['mutserve', 'mity'], 'indel': ['mutect2', 'mutserve']},
+            'indel_overrides_snv': ['mutect2'],
+            'confidence': {'consensus': 1.0, 'snv': {'mutserve': 0.85, 'mity': 0.75},
+                           'indel': {'mutserve': 0.70, 'mutect2': 0.80}}
+        }))
+        three_vcf = tmpdir / 'three.vcf'
+        run_engine(three_vcf, '--input', f'mutserve={mutserve_vcf}', '--input', f'mutect2={mutect2_vcf}',
+                   '--input', f'mity={mity_vcf}', '--rules', rules_json, '--report', tmpdir / 'three.json')
+        
+        by_pos = {(v['pos'], v['alt']): v for v in parse_vcf_variants(three_vcf)}
+        print(f"\n  Three-caller variants: {len(by_pos)}")
+        assert by_pos[(100, 'A')]['info']['FUSION_SOURCE'] == 'mity'
+        assert by_pos[(100, 'A')]['info']['FUSION_CONFIDENCE'] == '0.75'
+        assert by_pos[(73, 'G')]['info']['FUSION_CALLERS'] == 'mutserve,mutect2,mity'
+        assert by_pos[(73, 'G')]['info']['FUSION_SOURCE'] == 'mutserve'
+        assert len(by_pos) == len(pairwise) + 1, "Unexpected three-caller variant count"
+        
+        report = json.loads((tmpdir / 'three.json').read_text())
+        assert set(report['statistics']['callers']) == {'mutserve', 'mutect2', 'mity'}
+        
+        # 格式错误的规则表给出明确的错误, 而不是 TypeError/AttributeError
+        for confidence in ({'snv': 0.5}, 0.9, {'consensus': True}, {'snv': {'mutserve': False}}):
+            rules_json.write_text(json.dumps({'precedence': {'snv': ['mutserve']}, 'confidence': confidence}))
+            result = subprocess.run([sys.executable, str(script_path), '--output', str(tmpdir / 'bad.vcf'),
+                                     '--input', f'mutserve={mutserve_vcf}', '--rules', str(rules_json)],
+                                    capture_output=True, text=True)
+            assert result.returncode != 0 and 'Traceback' not in result.stderr, result.stderr
+            assert 'confidence' in result.stderr, result.stderr
+        
+        print("\n[PASS] N-way engine test passed")
+        return True
+
+
+def test_vaf_reconciliation():
+    """测试 VAF 调和: 合并估计落在置信区间内, 差异超过阈值的位点被标记"""
+    print("\n" + "=" * 60)
+    print("Test 15: VAF Reconciliation")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_vcf = Path(tmpdir) / 'vaf.vcf'
+        report_json = Path(tmpdir) / 'vaf.json'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(test_data_dir / 'mutserve_test.vcf'),
+            '--mutect2-vcf', str(test_data_dir / 'mutect2_test.vcf'),
+            '--output', str(output_vcf), '--report', str(report_json),
+            '--reconcile-vaf', '--vaf-discordance', '0.002'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        variants = parse_vcf_variants(output_vcf)
+        for v in variants:
+            info = v['info']
+            if 'FUSION_AF_CI' in info:
+                lower, upper = (float(x) for x in info['FUSION_AF_CI'].split(','))
+                assert lower <= float(info['FUSION_AF']) <= upper, f"FUSION_AF outside CI at {v['pos']}"
+            if 'MUTSERVE_AF' in info and 'MUTECT2_AF' in info:
+                discordant = abs(float(info['MUTSERVE_AF']) - float(info['MUTECT2_AF'])) > 0.002
+                assert discordant == ('VAF_DISCORDANT' in info), f"Wrong discordance flag at {v['pos']}"
+        
+        site_73 = next(v for v in variants if v['pos'] == 73)
+        assert site_73['info']['MUTSERVE_AF'] == '0.9990' and site_73['info']['MUTECT2_AF'] == '0.9960'
+        assert 'VAF_DISCORDANT' in site_73['info']
+        
+        heteroplasmy = json.loads(report_json.read_text())['statistics']['heteroplasmy']
+        print(f"\n  Discordant sites: {heteroplasmy['discordant']}/{heteroplasmy['both_callers_vaf']}")
+        assert heteroplasmy['discordant'] == sum('VAF_DISCORDANT' in v['info'] for v in variants)
+        
+        # 两个工具读同一个 BAM: AF=0.1、DP 都是 1000 时区间按 n=1000 计算, 不是 2000
+        header = '##fileformat=VCFv4.2\n##contig=<ID=chrM,length=16569>\n' \
+                 '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS\n'
+        known = {}
+        for caller in ('mutserve', 'mutect2'):
+            known[caller] = Path(tmpdir) / f'{caller}_known.vcf'
+            known[caller].write_text(header + 'chrM\t3243\t.\tA\tG\t.\tPASS\t.\tGT:AF:DP\t0/1:0.1:1000\n')
+        known_vcf = Path(tmpdir) / 'known.vcf'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(known['mutserve']), '--mutect2-vcf', str(known['mutect2']),
+            '--output', str(known_vcf), '--reconcile-vaf'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        info = parse_vcf_variants(known_vcf)[0]['info']
+        z, p, n = 1.96, 0.1, 1000
+        half_width = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / (1 + z * z / n)
+        lower, upper = (float(x) for x in info['FUSION_AF_CI'].split(','))
+        print(f"\n  AF=0.1, DP=1000: CI width {upper - lower:.4f} (expected {2 * half_width:.4f})")
+        assert info['FUSION_DP'] == '1000'
+        assert abs((upper - lower) - 2 * half_width) < 2e-4, "Wilson interval not computed on the shared depth"
+        
+        print("\n[PASS] VAF reconciliation test passed")
+        return True
+
+
+def test_normalization():
+    """测试标准化: 同聚物中右移的 INDEL 左对齐后与 Mutect2 匹配, MNP 拆成 SNV"""
+    print("\n" + "=" * 60)
+    print("Test 16: Normalization against rCRS")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    reference = Path(__file__).parents[3] / 'mtoolbox' / 'docker' / 'MToolBox' / 'data' / 'chrRCRS.fa'
+    if not reference.exists():
+        print(f"\n  [SKIP] rCRS reference not found: {reference}")
+        return True
+    
+    # Mutserve 把 302 A>AC 写成同聚物中右移的 306 C>CC, 另加一个 MNP 和右移写法的 9-bp 缺失
+    extra = {
+        306: 'chrM\t306\t.\tC\tCC\t.\tPASS\t.\tGT:AF:DP\t0/1:0.1:3000\t0\n',
+        751: 'chrM\t751\t.\tAC\tGT\t.\tPASS\t.\tGT:AF:DP\t0/1:0.2:900\t0\n',
+        8280: 'chrM\t8280\t.\tACCCCCTCTA\tA\t.\tPASS\t.\tGT:AF:DP\t0/1:0.3:800\t0\n',
+    }
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        mutserve_vcf = Path(tmpdir) / 'mutserve_shifted.vcf'
+        with open(test_data_dir / 'mutserve_test.vcf') as src, open(mutserve_vcf, 'w') as dst:
+            for line in src:
+                if not line.startswith('#'):
+                    pos = int(line.split('\t')[1])
+                    for extra_pos in [p for p in extra if p <= pos]:
+                        dst.write(extra.pop(extra_pos))
+                dst.write(line)
+            dst.writelines(extra.values())
+        
+        output_vcf = Path(tmpdir) / 'normalized.vcf'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(mutserve_vcf),
+            '--mutect2-vcf', str(test_data_dir / 'mutect2_test.vcf'),
+            '--output', str(output_vcf),
+            '--normalize', '--reference-fasta', str(reference)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        variants = {(v['pos'], v['ref'], v['alt']): v for v in parse_vcf_variants(output_vcf)}
+        assert 'BOTH_CALLERS' in variants[(302, 'A', 'AC')]['info'], "Shifted insertion not matched"
+        assert (306, 'C', 'CC') not in variants
+        assert (751, 'A', 'G') in variants and (752, 'C', 'T') in variants, "MNP not decomposed"
+        assert (8270, 'CACCCCCTCT', 'C') in variants, "9-bp deletion not left-aligned"
+        
+        positions = [v['pos'] for v in parse_vcf_variants(output_vcf)]
+        assert positions == sorted(positions), "Normalized output is not sorted"
+        
+        # 1500 bp 同聚物末端的插入左移到序列起点, 越过已经读过的 100 和 1200 位点
+        long_reference = Path(tmpdir) / 'homopolymer.fa'
+        sequence = 'G' + 'A' * 1500 + 'CGTCGTCGTC'
+        long_reference.write_text('>chrM\n' + '\n'.join(sequence[i:i + 60] for i in range(0, len(sequence), 60)) + '\n')
+        with open(test_data_dir / 'mutserve_test.vcf') as f:
+            header = ''.join(line for line in f if line.startswith('#'))
+        long_mutserve = Path(tmpdir) / 'mutserve_long_shift.vcf'
+        long_mutserve.write_text(header + ''.join(
+            f'chrM\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\t.\tGT:AF:DP\t0/1:0.2:900\t0\n'
+            for pos, ref, alt in [(100, 'A', 'G'), (1200, 'A', 'T'), (1501, 'A', 'AA')]))
+        long_mutect2 = Path(tmpdir) / 'mutect2_empty.vcf'
+        with open(test_data_dir / 'mutect2_test.vcf') as f:
+            long_mutect2.write_text(''.join(line for line in f if line.startswith('#')))
+        
+        output_vcf = Path(tmpdir) / 'long_shift.vcf'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(long_mutserve),
+            '--mutect2-vcf', str(long_mutect2),
+            '--output', str(output_vcf),
+            '--normalize', '--reference-fasta', str(long_reference)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        records = [(v['pos'], v['ref'], v['alt']) for v in parse_vcf_variants(output_vcf)]
+        print(f"\n  1500-bp left shift: {records}")
+        assert records == [(1, 'G', 'GA'), (100, 'A', 'G'), (1200, 'A', 'T')], "Long left shift not re-sorted"
+        
+        print("\n[PASS] Normalization test passed")
+        return True
+
+
+def test_profile_output():
+    """测试性能剖析: JSON 中各阶段的记录数与 FusionStats 一致, Prometheus 文本输出到 stderr"""
+    print("\n" + "=" * 60)
+    print("Test 17: Profile Output")
+    print("=" * 60)
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_vcf = Path(tmpdir) / 'profiled.vcf.gz'
+        report_json = Path(tmpdir) / 'profiled.json'
+        profile_json = Path(tmpdir) / 'profile.json'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(test_data_dir / 'mutserve_test.vcf'),
+            '--mutect2-vcf', str(test_data_dir / 'mutect2_test.vcf'),
+            '--output', str(output_vcf), '--report', str(report_json), '--compress',
+            '--profile-json', str(profile_json), '--profile-prometheus'
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        profile = json.loads(profile_json.read_text())
+        phases = profile['phases']
+        for phase in ('parse_mutserve', 'parse_mutect2', 'fusion', 'write', 'index_build', 'report'):
+            assert phase in phases, f"Missing phase {phase}"
+            assert phases[phase]['wall_seconds'] >= 0 and phases[phase]['cpu_seconds'] >= 0
+        
+        stats = json.loads(report_json.read_text())['statistics']
+        assert phases['parse_mutserve']['records'] == stats['mutserve']['total']
+        assert phases['parse_mutect2']['records'] == stats['mutect2']['total']
+        assert phases['write']['records'] == stats['fusion_result']['final_total']
+        assert phases['write']['bytes'] == output_vcf.stat().st_size
+        
+        # 各阶段只记录自身时间, 总和不超过整个运行的时间
+        exclusive = sum(p['wall_seconds'] for p in phases.values())
+        print(f"\n  Phases: {exclusive:.4f}s of {profile['total']['wall_seconds']:.4f}s wall")
+        assert exclusive <= profile['total']['wall_seconds'] + 1e-3
+        
+        assert 'mtdna_fusion_merger_phase_wall_seconds{phase="fusion"}' in result.stderr
+        assert '# TYPE mtdna_fusion_merger_phase_records_total counter' in result.stderr
+        
+        print("\n[PASS] Profile output test passed")
+        return True
+
+
+def test_columnar_output():
+    """测试列式输出: 单样本与 VCF 一致, 批处理和队列模式每个样本一个 row group"""
+    print("\n" + "=" * 60)
+    print("Test 18: Columnar Output")
+    print("=" * 60)
+    
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("\n  [SKIP] pyarrow not installed")
+        return True
+    
+    script_path = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    mutserve_vcf = test_data_dir / 'mutserve_test.vcf'
+    mutect2_vcf = test_data_dir / 'mutect2_test.vcf'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_vcf = Path(tmpdir) / 'single.vcf'
+        parquet = Path(tmpdir) / 'single.parquet'
+        arrow = Path(tmpdir) / 'single.arrow'
+        for columnar in (parquet, arrow):
+            result = subprocess.run([
+                sys.executable, str(script_path),
+                '--mutserve-vcf', str(mutserve_vcf), '--mutect2-vcf', str(mutect2_vcf),
+                '--output', str(output_vcf), '--columnar', str(columnar)
+            ], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+        
+        table = pq.read_table(parquet)
+        variants = parse_vcf_variants(output_vcf)
+        assert table.num_rows == len(variants)
+        assert table.column('pos').to_pylist() == [v['pos'] for v in variants]
+        assert table.column('alt').to_pylist() == [v['alt'] for v in variants]
+        assert table.column('both_callers').to_pylist() == ['BOTH_CALLERS' in v['info'] for v in variants]
+        assert set(table.column('sample').to_pylist()) == {'NA12878'}
+        assert pa.ipc.open_file(pa.memory_map(str(arrow))).read_all().equals(table)
+        
+        # 合并失败时不留下列式文件
+        failed_parquet = Path(tmpdir) / 'failed.parquet'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--mutserve-vcf', str(mutserve_vcf), '--mutect2-vcf', str(Path(tmpdir) / 'missing.vcf'),
+            '--output', str(output_vcf), '--columnar', str(failed_parquet)
+        ], capture_output=True, text=True)
+        assert result.returncode != 0 and not failed_parquet.exists(), "Failed merge left a columnar file"
+        
+        batch_tsv = Path(tmpdir) / 'batch.tsv'
+        with open(batch_tsv, 'w') as f:
+            for i in range(3):
+                f.write(f'S{i}\t{mutserve_vcf}\t{mutect2_vcf}\t{Path(tmpdir) / f"S{i}.vcf"}\n')
+        batch_parquet = Path(tmpdir) / 'batch.parquet'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--batch', str(batch_tsv), '--workers', '2', '--columnar', str(batch_parquet)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        batch = pq.ParquetFile(batch_parquet)
+        print(f"\n  Batch row groups: {batch.num_row_groups}")
+        assert batch.num_row_groups == 3
+        for i in range(3):
+            group = batch.read_row_group(i)
+            assert set(group.column('sample').to_pylist()) == {f'S{i}'}
+            assert group.drop_columns(['sample']).equals(table.drop_columns(['sample']))
+        
+        manifest = Path(tmpdir) / 'manifest.tsv'
+        with open(manifest, 'w') as f:
+            f.write(f'test.cram\t{mutserve_vcf}\t{mutect2_vcf}\ntest1.cram\t{mutserve_vcf}\t{mutect2_vcf}\n')
+        cohort_parquet = Path(tmpdir) / 'cohort.parquet'
+        result = subprocess.run([
+            sys.executable, str(script_path),
+            '--manifest', str(manifest), '--output', str(Path(tmpdir) / 'cohort.vcf'),
+            '--columnar', str(cohort_parquet)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        cohort = pq.ParquetFile(cohort_parquet)
+        assert cohort.num_row_groups == 2
+        with open(Path(tmpdir) / 'cohort.vcf') as f:
+            rows = [l.rstrip('\n').split('\t') for l in f if not l.startswith('#')]
+        called = [(int(fields[1]), fields[9].split(':')[3]) for fields in rows if fields[9] != '.']
+        first = cohort.read_row_group(0)
+        assert set(first.column('sample').to_pylist()) == {'test.cram'}
+        assert list(zip(first.column('pos').to_pylist(), first.column('source').to_pylist())) == called
+        
+        print("\n[PASS] Columnar output test passed")
+        return True
+
+
+def test_unsorted_set_modes():
+    """测试 --unsorted: 打乱顺序的输入做交集/并集, 结果与排序输入的流式归并相同且按坐标排序"""
+    print("\n" + "=" * 60)
+    print("Test 19: Unsorted Intersection/Union")
+    print("=" * 60)
+    
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("\n  [SKIP] NumPy not installed")
+        return True
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    # 两个工具都检出的长插入, 超出内联编码的 8 个碱基, 走溢出表
+    long_insertion = 'chrM\t8270\t.\tC\tCACCCCCTCTA\t.\tPASS\t.\tGT:AF:DP\t0/1:0.2:900\t0\n'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputs = {}
+        for name in ('mutserve_test.vcf', 'mutect2_test.vcf'):
+            with open(test_data_dir / name) as f:
+                lines = f.readlines()
+            header = [l for l in lines if l.startswith('#')]
+            body = [l for l in lines if not l.startswith('#')] + [long_insertion]
+            sorted_vcf = Path(tmpdir) / f'sorted_{name}'
+            sorted_vcf.write_text(''.join(header + sorted(body, key=lambda l: int(l.split('\t')[1]))))
+            shuffled_vcf = Path(tmpdir) / f'shuffled_{name}'
+            shuffled_vcf.write_text(''.join(header + body[::2] + body[1::2][::-1]))
+            inputs[name] = (sorted_vcf, shuffled_vcf)
+        
+        for mode in ('intersection', 'union'):
+            expected_vcf = Path(tmpdir) / f'{mode}_sorted.vcf'
+            expected_json = Path(tmpdir) / f'{mode}_sorted.json'
+            assert run_fusion_merger(inputs['mutserve_test.vcf'][0], inputs['mutect2_test.vcf'][0],
+                                     expected_vcf, expected_json, mode) == 0
+            
+            shuffled = [inputs['mutserve_test.vcf'][1], inputs['mutect2_test.vcf'][1]]
+            output_vcf = Path(tmpdir) / f'{mode}_unsorted.vcf'
+            output_json = Path(tmpdir) / f'{mode}_unsorted.json'
+            result = subprocess.run([
+                sys.executable, str(Path(__file__).parent.parent / 'mtdna_fusion_merger.py'),
+                '--mutserve-vcf', str(shuffled[0]), '--mutect2-vcf', str(shuffled[1]),
+                '--output', str(output_vcf), '--report', str(output_json), '--mode', mode
+            ], capture_output=True, text=True)
+            assert result.returncode != 0 and '--unsorted' in result.stderr, "Unsorted input was not rejected"
+            
+            result = subprocess.run([
+                sys.executable, str(Path(__file__).parent.parent / 'mtdna_fusion_merger.py'),
+                '--mutserve-vcf', str(shuffled[0]), '--mutect2-vcf', str(shuffled[1]),
+                '--output', str(output_vcf), '--report', str(output_json), '--mode', mode, '--unsorted'
+            ], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+            
+            expected = parse_vcf_variants(expected_vcf)
+            variants = parse_vcf_variants(output_vcf)
+            key = lambda v: (v['pos'], v['ref'], v['alt'])
+            print(f"\n  {mode}: {len(variants)} variants")
+            assert sorted(map(key, variants)) == sorted(map(key, expected)), f"{mode} result differs"
+            assert [v['pos'] for v in variants] == sorted(v['pos'] for v in variants), f"{mode} output not sorted"
+            assert (8270, 'C', 'CACCCCCTCTA') in set(map(key, variants))
+            assert json.loads(output_json.read_text()) == json.loads(expected_json.read_text())
+        
+        # 核基因组坐标超过 2^24 (16,777,216) 仍能压缩, 与排序输入的合并相同
+        header = ('##fileformat=VCFv4.2\n##contig=<ID=chr1,length=248956422>\n'
+                  '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS\n')
+        positions = {'mutserve': [150, 16777217, 248956422], 'mutect2': [16777217, 200000000, 248956422]}
+        large = {}
+        for caller, caller_positions in positions.items():
+            body = [f'chr1\t{pos}\t.\tA\tG\t50\tPASS\t.\tGT\t1\n' for pos in caller_positions]
+            large[caller] = (Path(tmpdir) / f'large_sorted_{caller}.vcf', Path(tmpdir) / f'large_shuffled_{caller}.vcf')
+            large[caller][0].write_text(header + ''.join(body))
+            large[caller][1].write_text(header + ''.join(body[::-1]))
+        for mode in ('intersection', 'union'):
+            expected_vcf = Path(tmpdir) / f'large_{mode}_sorted.vcf'
+            output_vcf = Path(tmpdir) / f'large_{mode}_unsorted.vcf'
+            assert run_fusion_merger(large['mutserve'][0], large['mutect2'][0], expected_vcf,
+                                     Path(tmpdir) / 'large.json', mode) == 0
+            result = subprocess.run([
+                sys.executable, str(Path(__file__).parent.parent / 'mtdna_fusion_merger.py'),
+                '--mutserve-vcf', str(large['mutserve'][1]), '--mutect2-vcf', str(large['mutect2'][1]),
+                '--output', str(output_vcf), '--mode', mode, '--unsorted'
+            ], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+            variants = [v['pos'] for v in parse_vcf_variants(output_vcf)]
+            print(f"  {mode} above 2^24: {variants}")
+            assert variants == [v['pos'] for v in parse_vcf_variants(expected_vcf)]
+        assert variants == [150, 16777217, 200000000, 248956422]
+        
+        print("\n[PASS] Unsorted intersection/union test passed")
+        return True
+
+
+def test_parallel_contigs():
+    """测试按染色体并行融合: 输出按 ##contig 参考顺序拼接, 与顺序融合逐字节一致"""
+    print("\n" + "=" * 60)
+    print("Test 20: Parallel Per-Contig Fusion")
+    print("=" * 60)
+    
+    script_dir = Path(__file__).parent.parent
+    sys.path.insert(0, str(script_dir))
+    from mtdna_fusion_merger import VcfOutput
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    # GRCh38 的顺序: chrM 在核染色体之后, 与字典序不同
+    contigs = ['chr1', 'chrX', 'chrM']
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputs = {}
+        for name in ('mutserve_test.vcf', 'mutect2_test.vcf'):
+            with open(test_data_dir / name) as f:
+                lines = [l.rstrip('\n') for l in f]
+            header = [l for l in lines if l.startswith('##') and not l.startswith('##contig')]
+            header += [f'##contig=<ID={c},length=16569>' for c in contigs]
+            header += [l for l in lines if l.startswith('#CHROM')]
+            body = [l for l in lines if not l.startswith('#')]
+            # 把 chrM 的记录复制到两条 "NUMT" 染色体上
+            records = [c + l[l.index('\t'):] for c in contigs for l in body]
+            
+            plain = Path(tmpdir) / name
+            plain.write_text('\n'.join(header + records) + '\n')
+            indexed = Path(tmpdir) / f'{name}.gz'
+            with VcfOutput(indexed, compress=True) as out:
+                for line in header:
+                    out.write_header(line)
+                for line in records:
+                    fields = line.split('\t')
+                    out.write_record(fields[0], int(fields[1]), fields[3], line)
+            inputs[name] = (plain, indexed)
+        
+        for i, label in enumerate(('plain', 'indexed')):
+            outputs = {}
+            for workers in ('1', '3'):
+                outputs[workers] = Path(tmpdir) / f'{label}_{workers}.vcf'
+                result = subprocess.run([
+                    sys.executable, str(script_dir / 'mtdna_fusion_merger.py'),
+                    '--mutserve-vcf', str(inputs['mutserve_test.vcf'][i]),
+                    '--mutect2-vcf', str(inputs['mutect2_test.vcf'][i]),
+                    '--output', str(outputs[workers]),
+                    '--report', str(outputs[workers].with_suffix('.json')),
+                    '--contig-workers', workers
+                ], capture_output=True, text=True)
+                assert result.returncode == 0, result.stderr
+            
+            assert outputs['3'].read_bytes() == outputs['1'].read_bytes(), f"{label}: parallel output differs"
+            assert outputs['3'].with_suffix('.json').read_text() == outputs['1'].with_suffix('.json').read_text()
+            
+            with open(outputs['3']) as f:
+                chroms = [l.split('\t', 1)[0] for l in f if not l.startswith('#')]
+            order = list(dict.fromkeys(chroms))
+            print(f"\n  {label}: {len(chroms)} variants, contig order {order}")
+            assert order == contigs, f"Contigs not in reference order: {order}"
+        
+        print("\n[PASS] Parallel per-contig fusion test passed")
+        return True
+
+
+def test_provenance():
+    """测试来源记录: 每个变异键一行并标明触发的规则, 最后一行的计数与报告一致"""
+    print("\n" + "=" * 60)
+    print("Test 21: Per-Variant Provenance")
+    print("=" * 60)
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    # 与 Mutect2 的 955 C>CC 同位置的 Mutserve SNV, 以及只有 Mutect2 检出的 SNV
+    extra = {
+        'mutserve_test.vcf': 'chrM\t955\t.\tC\tT\t.\tPASS\t.\tGT:AF:DP\t0/1:0.1:2000\t0\n',
+        'mutect2_test.vcf': 'chrM\t1000\t.\tG\tA\t.\tPASS\tDP=900\tGT:AD:AF:DP\t0/1:800,100:0.11:900\n',
+    }
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputs = []
+        for name, line in extra.items():
+            with open(test_data_dir / name) as f:
+                lines = f.readlines()
+            header = [l for l in lines if l.startswith('#')]
+            body = sorted([l for l in lines if not l.startswith('#')] + [line], key=lambda l: int(l.split('\t')[1]))
+            path = Path(tmpdir) / name
+            path.write_text(''.join(header + body))
+            inputs.append(path)
+        
+        output_vcf = Path(tmpdir) / 'fused.vcf'
+        report_json = Path(tmpdir) / 'report.json'
+        provenance = Path(tmpdir) / 'provenance.jsonl.gz'
+        result = subprocess.run([
+            sys.executable, str(Path(__file__).parent.parent / 'mtdna_fusion_merger.py'),
+            '--mutserve-vcf', str(inputs[0]), '--mutect2-vcf', str(inputs[1]),
+            '--output', str(output_vcf), '--report', str(report_json), '--provenance', str(provenance)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        with gzip.open(provenance, 'rt') as f:
+            entries = [json.loads(line) for line in f]
+        assert entries[0]['type'] == 'header' and entries[0]['mode'] == 'fusion'
+        assert entries[-1]['type'] == 'summary'
+        records = {(e['pos'], e['ref'], e['alt']): e for e in entries[1:-1]}
+        
+        assert records[(955, 'C', 'T')]['rule'] == 'indel_overrides_snv'
+        assert not records[(955, 'C', 'T')]['output']
+        assert records[(955, 'C', 'CC')]['rule'] == 'indel_from_mutect2'
+        assert records[(1000, 'G', 'A')]['rule'] == 'mutect2_snv_not_trusted'
+        assert records[(73, 'A', 'G')]['callers'] == ['mutserve', 'mutect2']
+        
+        variants = parse_vcf_variants(output_vcf)
+        kept = [e for e in entries[1:-1] if e['output']]
+        print(f"\n  Provenance: {len(entries) - 2} keys, {len(kept)} output")
+        assert sorted((e['pos'], e['ref'], e['alt']) for e in kept) == sorted((v['pos'], v['ref'], v['alt']) for v in variants)
+        
+        counters = entries[-1]['statistics']
+        fusion_result = json.loads(report_json.read_text())['statistics']['fusion_result']
+        assert counters['final_variants'] == fusion_result['final_total'] == len(variants)
+        assert counters['conflicts_resolved'] == fusion_result['conflicts_resolved'] == 1
+        
+        print("\n[PASS] Provenance test passed")
+        return True
+
+
+def test_header_merge():
+    """测试表头合并: Mutect2 的定义进入输出表头, 冲突的 FORMAT/AF 放宽类型, 类型访问按定义解码"""
+    print("\n" + "=" * 60)
+    print("Test 22: Header Merging")
+    print("=" * 60)
+    
+    script_dir = Path(__file__).parent.parent
+    sys.path.insert(0, str(script_dir))
+    from mtdna_fusion_merger import VcfHeader, VcfReader, parse_header_attributes
+    
+    test_data_dir = Path(__file__).parent / 'data'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_vcf = Path(tmpdir) / 'fused.vcf'
+        report_json = Path(tmpdir) / 'fused.json'
+        result = subprocess.run([
+            sys.executable, str(script_dir / 'mtdna_fusion_merger.py'),
+            '--mutserve-vcf', str(test_data_dir / 'mutserve_test.vcf'),
+            '--mutect2-vcf', str(test_data_dir / 'mutect2_test.vcf'),
+            '--output', str(output_vcf), '--report', str(report_json)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        # 两个工具 FORMAT/AF 的差异是已知的, 放宽后只记入报告, 不告警
+        assert 'header conflict' not in result.stderr
+        widened = json.loads(report_json.read_text())['statistics']['header_widened']
+        assert len(widened) == 1 and widened[0].startswith('FORMAT/AF:'), widened
+        
+        header_lines = [l.rstrip('\n') for l in output_vcf.read_text().splitlines() if l.startswith('#')]
+        ids = [l.split(',', 1)[0] for l in header_lines if l.startswith(('##INFO=', '##FORMAT=', '##FILTER='))]
+        assert len(ids) == len(set(ids)), 'duplicate header definitions'
+        for declared in ('##INFO=<ID=TLOD', '##INFO=<ID=DP', '##FORMAT=<ID=AD', '##FILTER=<ID=t_lod'):
+            assert declared in ids, f'{declared} missing'
+        assert header_lines[0].startswith('##fileformat=')
+        assert header_lines[-1].startswith('#CHROM')
+        # 第一个输入的描述优先
+        assert '##FILTER=<ID=PASS,Description="Variants passed mtDNA-Server">' in header_lines
+        
+        with VcfReader(output_vcf, 'fused') as reader:
+            header = VcfHeader().merge(reader.header_lines)
+            records = [v.record for v in reader]
+        af = header.get('FORMAT', 'AF')
+        assert (af.number, af.type) == ('.', 'String')
+        record = next(r for r in records if r.pos == 955)
+        assert header.info_value(record, 'TLOD') == [float(record.info['TLOD'])]
+        assert header.info_value(record, 'DP') == int(record.info['DP'])
+        assert header.info_value(record, 'BOTH_CALLERS') is None
+        assert header.sample_value(record, 'AD') == [int(x) for x in record.sample_data[0][
+            record.format_fields.index('AD')].split(',')]
+        # Mutserve 把多等位的 AF 声明为 Number=1, 多个值仍按列表返回
+        with VcfReader(test_data_dir / 'mutserve_test.vcf', 'mutserve') as reader:
+            mutserve_header = VcfHeader().merge(reader.header_lines)
+            multiallelic = next(v.record for v in reader if v.pos == 3107)
+        assert mutserve_header.sample_value(multiallelic, 'AF') == ['0.706', '0.265']
+        
+        # 宽化规则, 以及带引号逗号的描述
+        header = VcfHeader()
+        header.add('##INFO=<ID=X,Number=1,Type=Integer,Description="a, b">', 'first')
+        header.add('##INFO=<ID=X,Number=1,Type=Float,Description="c">', 'second')
+        header.add('##INFO=<ID=Y,Number=0,Type=Flag,Description="flag">', 'first')
+        header.add('##INFO=<ID=Y,Number=1,Type=Integer,Description="int">', 'second')
+        header.add('##INFO=<ID=Z,Number=1,Type=Character,Description="char">', 'first')
+        header.add('##INFO=<ID=Z,Number=1,Type=Integer,Description="int">', 'second')
+        assert parse_header_attributes('ID=X,Description="a, \\"b\\""')['Description'] == 'a, "b"'
+        assert header.get('INFO', 'X').attrs == {'ID': 'X', 'Number': '1', 'Type': 'Float', 'Description': 'a, b'}
+        assert (header.get('INFO', 'Y').number, header.get('INFO', 'Y').type) == ('.', 'String')
+        assert header.get('INFO', 'Z').type == 'String', 'Character cannot hold an Integer'
+        assert header.lines()[0] == '##INFO=<ID=X,Number=1,Type=Float,Description="a, b">'
+        assert len(header.widened) == 3 and not header.conflicts
+        
+        print(f"\n  Merged header: {len(ids)} definitions, widened: {widened[0]}")
+        print("\n[PASS] Header merge test passed")
+        return True
+
+
+def test_serve_mode():
+    """测试服务模式: stdin 和 Unix socket 上的 JSON-RPC 任务返回与命令行相同的报告"""
+    print("\n" + "=" * 60)
+    print("Test 23: Merge Service")
+    print("=" * 60)
+    
+    script = Path(__file__).parent.parent / 'mtdna_fusion_merger.py'
+    test_data_dir = Path(__file__).parent / 'data'
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cli_vcf = Path(tmpdir) / 'cli.vcf'
+        cli_report = Path(tmpdir) / 'cli.json'
+        result = subprocess.run([
+            sys.executable, str(script),
+            '--mutserve-vcf', str(test_data_dir / 'mutserve_test.vcf'),
+            '--mutect2-vcf', str(test_data_dir / 'mutect2_test.vcf'),
+            '--output', str(cli_vcf), '--report', str(cli_report)
+        ], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        
+        def merge_request(request_id, output):
+            return {'jsonrpc': '2.0', 'id': request_id, 'method': 'merge', 'params': {
+                'mutserve_vcf': str(test_data_dir / 'mutserve_test.vcf'),
+                'mutect2_vcf': str(test_data_dir / 'mutect2_test.vcf'),
+                'output': str(output)
+            }}
+        
+        requests = [
+            merge_request(1, Path(tmpdir) / 'job1.vcf'),
+            merge_request(2, Path(tmpdir) / 'job2.vcf'),
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'merge', 'params': {'mutserve_vcf': 'missing.vcf'}},
+            {'jsonrpc': '2.0', 'id': 4, 'method': 'ping'},
+            {'jsonrpc': '2.0', 'id': 6, 'method': 'merge', 'params': {**merge_request(6, 'bad.vcf')['params'], 'regions': 5}},
+            {'jsonrpc': '2.0', 'id': 7, 'method': 'merge', 'params': {**merge_request(7, 'bad.vcf')['params'], 'mutserve_vcf': 123}},
+            {'jsonrpc': '2.0', 'id': 5, 'method': 'shutdown'},
+        ]
+        result = subprocess.run(
+            [sys.executable, str(script), '--serve'],
+            input=''.join(json.dumps(r) + '\n' for r in requests), capture_output=True, text=True, timeout=60
+        )
+        assert result.returncode == 0, result.stderr
+        responses = {r['id']: r for r in map(json.loads, result.stdout.splitlines())}
+        
+        expected = json.loads(cli_report.read_text())
+        assert responses[1]['result'] == expected
+        assert responses[2]['result'] == expected
+        assert (Path(tmpdir) / 'job1.vcf').read_bytes() == cli_vcf.read_bytes()
+        assert responses[3]['error']['code'] == -32602
+        assert responses[4]['result']['jobs'] == 2
+        assert responses[6]['error']['code'] == -32602
+        assert responses[7]['error']['code'] == -32602
+        assert responses[5]['result'] is True
+        
+        socket_path = Path(tmpdir) / 'merger.sock'
+        server = subprocess.Popen([sys.executable, str(script), '--serve', '--socket', str(socket_path)],
+                                  stderr=subprocess.PIPE, text=True)
+        try:
+            deadline = time.time() + 30
+            while not socket_path.exists():
+                assert server.poll() is None and time.time() < deadline, 'server did not start'
+                time.sleep(0.05)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(str(socket_path))
+                client.sendall(b'\xff\xfe not utf-8\n')
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(str(socket_path))
+                stream = client.makefile('rw', encoding='utf-8')
+                for request in (merge_request(1, Path(tmpdir) / 'socket.vcf'),
+                                {'jsonrpc': '2.0', 'id': 2, 'method': 'shutdown'}):
+                    stream.write(json.dumps(request) + '\n')
+                    stream.flush()
+                    response = json.loads(stream.readline())
+                    assert 'error' not in response, response
+                assert response['result'] is True
+            assert server.wait(timeout=30) == 0
+        finally:
+            if server.poll() is None:
+                server.kill()
+            server.stderr.close()
+        assert (Path(tmpdir) / 'socket.vcf').read_bytes() == cli_vcf.read_bytes()
+        assert not socket_path.exists()
+        
+        print(f"\n  Served {len(requests)} stdin requests and 2 socket requests")
+        print("\n[PASS] Serve mode test passed")
+        return True
+
+
 def main():
     """运行所有测试"""
     print("\n" + "=" * 60)
@@ -345,6 +1522,23 @@ def main():
         test_confidence_scores,
         test_intersection_mode,
         test_union_mode,
+        test_gzip_input,
+        test_unsorted_input_rejected,
+        test_cohort_manifest,
+        test_batch_mode,
+        test_compressed_output,
+        test_region_restriction,
+        test_incremental_merge,
+        test_nway_engine,
+        test_vaf_reconciliation,
+        test_normalization,
+        test_profile_output,
+        test_columnar_output,
+        test_unsorted_set_modes,
+        test_parallel_contigs,
+        test_provenance,
+        test_header_merge,
+        test_serve_mode,
     ]
     
     passed = 0
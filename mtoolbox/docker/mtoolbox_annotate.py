@@ -5,12 +5,20 @@ Based on MToolBox v1.2.1 (PMID:25028726)
 """
 
 import argparse
+import hashlib
 import json
+import re
+import sqlite3
 import sys
 import os
+import tempfile
+from collections import OrderedDict
+from contextlib import ExitStack
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Set, Tuple, Callable
+
+import numpy as np
 
 # Add MToolBox to sys.path to import datatypes
 MTOOLBOX_PATH_ENV = os.environ.get("MTOOLBOX_PATH", "/opt/mtoolbox/MToolBox")
@@ -34,10 +42,35 @@ except ImportError as e:
 MTOOLBOX_VERSION = "1.2.1"
 PMID = "25028726"
 MTOOLBOX_DATA_DIR = os.environ.get("MTOOLBOX_DATA_DIR", "/opt/mtoolbox/MToolBox/data")
+MTOOLBOX_ANNOTATION_CACHE = os.environ.get("MTOOLBOX_ANNOTATION_CACHE")
 
 # Global variable to store column indices derived from patho_table header
 PATHO_COLUMN_MAP = {}
 
+# Precompiled annotation database written by `mtoolbox_annotate.py build-db`
+ANNOTATION_DB_NAME = "mtoolbox_annotation.db"
+ANNOTATION_DB_SCHEMA = 2
+ANNOTATION_SOURCE_FILES = ("patho_table.txt", "sitevar_modified.txt")
+
+# Source checksums recorded in the loaded annotation database (None when the text tables were parsed)
+ANNOTATION_SOURCES = None
+
+# Annotation cache: bump ANNOTATION_CACHE_SCHEMA whenever get_annotation or the ACMG rules change
+ANNOTATION_CACHE_SCHEMA = 1
+ANNOTATION_CACHE_SIZE = 65536
+
+# Variants listed in the HTML report; only these are kept in memory while streaming
+HTML_REPORT_ROWS = 100
+
+# Lines buffered across all samples before they are appended to the cohort spool files
+SPOOL_BUFFER_LINES = 65536
+
+# sitevar_modified.txt columns stored as float64 arrays; all other columns are interned strings
+SITEVAR_NUMERIC_COLUMNS = (
+    "Nt var", "Aa var", "MutPred Prob", "PolyPhen-2 HumDiv Prob", "PolyPhen-2 HumVar Prob",
+    "PANTHER Prob", "PhD-SNP Prob", "SNPs&GO Prob", "PhastCons20Way", "PhyloP20Way"
+)
+
 # --- Copied from MToolBox/variants_functional_annotation.py ---
 # mt coding loci. Used to discriminate coding/non-coding regions for novel variants
 MT_CODING_LOCI = [
@@ -121,9 +154,173 @@ def fillSiteVarDict(inhandle, d, separator, listindex):
 
 # --- End Copied Code ---
 
-def load_mtoolbox_data(data_dir: str) -> Tuple[Dict, Dict]:
+class SiteVarTable:
     """
-    Load MToolBox data. Dynamically parses header to map columns.
+    Position-indexed columnar store for sitevar_modified.txt.
+    
+    mtDNA positions are a dense 1..16569 range, so every column is an array
+    indexed directly by position: numeric columns are float64 (NaN for NA) and
+    text columns are int32 codes into one list of interned strings. `g[pos]`
+    returns the row list the text loader used to hold; `take()` looks up a
+    whole batch of positions at once, and `prefetch()` uses it to build the
+    rows of the positions about to be annotated.
+    """
+    
+    def __init__(self, names: List[str], lengths: np.ndarray, numeric: Dict[str, np.ndarray],
+                 codes: Dict[str, np.ndarray], strings: List[str]):
+        self.names = names
+        # Number of fields in each row (rows can be short); -1 for positions not in the table
+        self.lengths = lengths
+        self.numeric = numeric
+        self.codes = codes
+        self.strings = strings
+        self._string_array = np.array(strings, dtype=object)
+        self.size = int(np.count_nonzero(lengths >= 0))
+        # Rows built by prefetch(), as tuples; g[pos] copies them
+        self.prefetched = {}
+    
+    @classmethod
+    def from_rows(cls, names: List[str], rows: Dict[int, List[str]]) -> "SiteVarTable":
+        """
+        Build from the {position: fields} dict of fillSiteVarDict. Nt var and
+        Aa var (fields 1 and 4) are always numeric, as in the text loader; a
+        numeric column with a value that is neither a number nor NA is kept as
+        text.
+        """
+        size = max(rows) + 1 if rows else 1
+        positions = np.fromiter(rows.keys(), dtype=np.int64, count=len(rows))
+        fields = list(rows.values())
+        row_lengths = np.fromiter(map(len, fields), dtype=np.int16, count=len(fields))
+        lengths = np.full(size, -1, dtype=np.int16)
+        lengths[positions] = row_lengths
+        
+        # Transpose the rows into columns; short rows are padded with None, which marks a missing field
+        width = max(len(names), int(row_lengths.max()) if len(fields) else 0)
+        columns = list(zip(*(row if len(row) == width else row + [None] * (width - len(row)) for row in fields)))
+        
+        strings = ["NA"]
+        interned = {"NA": 0}
+        numeric = {}
+        codes = {}
+        for i, name in enumerate(names):
+            has_field = row_lengths > i
+            where = positions if has_field.all() else positions[has_field]
+            values = columns[i] if len(where) == len(positions) else [v for v in columns[i] if v is not None]
+            if i in (1, 4) or name in SITEVAR_NUMERIC_COLUMNS:
+                numeric[name] = np.full(size, np.nan)
+                if values.count("NA") == len(values):
+                    continue
+                try:
+                    parsed = np.array(["nan" if v == "NA" else v for v in values], dtype=np.float64)
+                except ValueError:
+                    del numeric[name]
+                else:
+                    numeric[name][where] = parsed
+                    continue
+            codes[name] = np.zeros(size, dtype=np.int32)
+            if values.count("NA") == len(values):
+                # Most annotation columns are NA at every site
+                continue
+            for value in dict.fromkeys(values):
+                if value not in interned:
+                    interned[value] = len(strings)
+                    strings.append(value)
+            codes[name][where] = np.fromiter(map(interned.__getitem__, values), dtype=np.int32, count=len(values))
+        return cls(names, lengths, numeric, codes, strings)
+    
+    def __contains__(self, pos) -> bool:
+        return 0 <= pos < len(self.lengths) and self.lengths[pos] >= 0
+    
+    def __getitem__(self, pos) -> List[Any]:
+        """A new row list: numbers as float, NA as 'NA', text as str."""
+        row = self.prefetched.get(pos)
+        if row is not None:
+            return list(row)
+        if pos not in self:
+            raise KeyError(pos)
+        row = []
+        for name in self.names[:self.lengths[pos]]:
+            if name in self.numeric:
+                value = float(self.numeric[name][pos])
+                row.append("NA" if value != value else value)
+            else:
+                row.append(self.strings[self.codes[name][pos]])
+        return row
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def __iter__(self):
+        for pos in np.flatnonzero(self.lengths >= 0):
+            yield int(pos)
+    
+    def take(self, positions, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Vectorized lookup of many positions. Returns a `present` mask plus one
+        array per column: float64 for numeric columns, object arrays of str for
+        text columns; positions not in the table read as NaN / 'NA'.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        inside = (positions >= 0) & (positions < len(self.lengths))
+        index = np.where(inside, positions, 0)
+        present = inside & (self.lengths[index] >= 0)
+        index = np.where(present, index, 0)
+        result = {"present": present}
+        for name in columns or self.names:
+            if name in self.numeric:
+                result[name] = np.where(present, self.numeric[name][index], np.nan)
+            else:
+                result[name] = self._string_array[np.where(present, self.codes[name][index], 0)]
+        return result
+    
+    def prefetch(self, positions):
+        """
+        Build the rows of many positions at once with take(), so that g[pos]
+        only copies a prebuilt row for them.
+        """
+        wanted = np.array(sorted(set(positions) - self.prefetched.keys()), dtype=np.int64)
+        taken = self.take(wanted)
+        present = taken.pop("present")
+        found = wanted[present]
+        columns = []
+        for name in self.names:
+            values = taken[name][present].tolist()
+            columns.append(["NA" if value != value else value for value in values] if name in self.numeric else values)
+        for pos, length, row in zip(found.tolist(), self.lengths[found].tolist(), zip(*columns)):
+            self.prefetched[pos] = row[:length]
+    
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"__lengths__": self.lengths, **self.numeric, **self.codes}
+    
+    @classmethod
+    def from_arrays(cls, names: List[str], strings: List[str], arrays: Dict[str, np.ndarray]) -> "SiteVarTable":
+        numeric = {name: a for name, a in arrays.items() if name != "__lengths__" and a.dtype == np.float64}
+        codes = {name: a for name, a in arrays.items() if name != "__lengths__" and a.dtype == np.int32}
+        return cls(names, arrays["__lengths__"], numeric, codes, strings)
+
+def load_mtoolbox_data(data_dir: str, db_path: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """
+    Load MToolBox data, from the precompiled annotation database when one is
+    present and up to date, otherwise by parsing the text tables.
+    """
+    db_path = Path(db_path) if db_path else Path(data_dir) / ANNOTATION_DB_NAME
+    if db_path.exists():
+        try:
+            stores = open_annotation_db(db_path, data_dir)
+        except sqlite3.DatabaseError as e:
+            print(f"Warning: Could not read annotation database {db_path}: {e}", file=sys.stderr)
+        else:
+            if stores is not None:
+                return stores
+            print(f"Warning: Annotation database {db_path} is out of date; "
+                  f"rebuild it with 'mtoolbox_annotate.py build-db'", file=sys.stderr)
+    global ANNOTATION_SOURCES
+    ANNOTATION_SOURCES = None
+    return parse_mtoolbox_tables(data_dir)
+
+def parse_mtoolbox_tables(data_dir: str) -> Tuple[Dict, Dict]:
+    """
+    Parse the MToolBox text tables. Dynamically parses header to map columns.
     """
     patho_file = Path(data_dir) / "patho_table.txt"
     site_file = Path(data_dir) / "sitevar_modified.txt"
@@ -179,23 +376,137 @@ def load_mtoolbox_data(data_dir: str) -> Tuple[Dict, Dict]:
     if site_file.exists():
         print("Parsing variability data...", file=sys.stderr)
         with open(site_file, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()[1:]
-        g = fillSiteVarDict(lines, g, '\t', 1)
-        for pos in g.keys():
-            try:
-                g[pos][1] = float(g[pos][1])
-            except (ValueError, TypeError, IndexError):
-                pass
-            try:
-                g[pos][4] = float(g[pos][4])
-            except (ValueError, TypeError, IndexError):
-                pass
+            names = next(f, "").rstrip("\r\n").split("\t")[1:]
+            g = SiteVarTable.from_rows(names, fillSiteVarDict(f, g, '\t', 1))
         print(f"Loaded {len(g)} site annotations from sitevar_modified.txt", file=sys.stderr)
     else:
         print(f"Warning: Site var table not found at {site_file}", file=sys.stderr)
     
     return d, g
 
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_fingerprints(data_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Checksum, size and mtime of each source table present in data_dir."""
+    fingerprints = {}
+    for name in ANNOTATION_SOURCE_FILES:
+        path = Path(data_dir) / name
+        if path.exists():
+            st = path.stat()
+            fingerprints[name] = {"sha256": file_sha256(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return fingerprints
+
+def build_annotation_db(data_dir: str, db_path: str) -> Dict[str, Any]:
+    """
+    Compile patho_table.txt and sitevar_modified.txt into a SQLite database.
+    Patho rows are stored already parsed (floats and ints as typed by the text
+    loader) and the sitevar columns as the raw arrays of a SiteVarTable,
+    together with the source checksums, so annotation opens the database
+    instead of re-parsing the tables on every run.
+    """
+    d, g = parse_mtoolbox_tables(data_dir)
+    meta = {
+        "schema": ANNOTATION_DB_SCHEMA,
+        "mtoolbox_version": MTOOLBOX_VERSION,
+        "built": datetime.now().isoformat(),
+        "patho_table_variants": len(d),
+        "sitevar_positions": len(g),
+        "patho_columns": PATHO_COLUMN_MAP,
+        "sitevar_names": g.names if g else [],
+        "sitevar_strings": g.strings if g else [],
+        "sources": source_fingerprints(data_dir),
+    }
+    
+    db_path = Path(db_path)
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    with sqlite3.connect(tmp_path) as conn:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE patho (variant TEXT NOT NULL, row INTEGER NOT NULL, data TEXT NOT NULL, "
+                     "PRIMARY KEY (variant, row)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE sitevar_arrays (name TEXT PRIMARY KEY, dtype TEXT NOT NULL, data BLOB NOT NULL)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", ((k, json.dumps(v)) for k, v in meta.items()))
+        conn.executemany("INSERT INTO patho VALUES (?, ?, ?)", (
+            (event.pprint(), i, json.dumps(row)) for event, rows in d.items() for i, row in enumerate(rows)
+        ))
+        if g:
+            conn.executemany("INSERT INTO sitevar_arrays VALUES (?, ?, ?)", (
+                (name, array.dtype.str, array.tobytes()) for name, array in g.arrays().items()
+            ))
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return meta
+
+class PathoStore:
+    """Read-only view of the patho table in the annotation database, keyed by MToolBox datatype."""
+    
+    def __init__(self, conn: sqlite3.Connection, size: int):
+        self.conn = conn
+        self.size = size
+    
+    def __contains__(self, event) -> bool:
+        return self.conn.execute("SELECT 1 FROM patho WHERE variant = ? LIMIT 1", (event.pprint(),)).fetchone() is not None
+    
+    def __getitem__(self, event) -> List[List[Any]]:
+        rows = self.conn.execute("SELECT data FROM patho WHERE variant = ? ORDER BY row", (event.pprint(),)).fetchall()
+        if not rows:
+            raise KeyError(event)
+        return [json.loads(data) for data, in rows]
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def __iter__(self):
+        for variant, in self.conn.execute("SELECT DISTINCT variant FROM patho ORDER BY variant"):
+            yield pprint2datatype(variant)
+
+def annotation_db_is_current(meta: Dict[str, Any], data_dir: str) -> bool:
+    """
+    The database is current when its schema matches and every source table in
+    data_dir matches the recorded checksum. Files with the recorded size and
+    mtime are trusted without re-hashing; tables missing from data_dir are
+    served from the database.
+    """
+    if meta.get("schema") != ANNOTATION_DB_SCHEMA:
+        return False
+    recorded = meta.get("sources", {})
+    for name in ANNOTATION_SOURCE_FILES:
+        path = Path(data_dir) / name
+        if not path.exists():
+            continue
+        if name not in recorded:
+            return False
+        st = path.stat()
+        if (st.st_size, st.st_mtime_ns) == (recorded[name]["size"], recorded[name]["mtime_ns"]):
+            continue
+        if st.st_size != recorded[name]["size"] or file_sha256(path) != recorded[name]["sha256"]:
+            return False
+    return True
+
+def open_annotation_db(db_path: Path, data_dir: str) -> Optional[Tuple[PathoStore, SiteVarTable]]:
+    """Open the annotation database read-only; returns None when it is out of date."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.execute("PRAGMA mmap_size = 268435456")
+    meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+    if not annotation_db_is_current(meta, data_dir):
+        conn.close()
+        return None
+    
+    global PATHO_COLUMN_MAP, ANNOTATION_SOURCES
+    PATHO_COLUMN_MAP = meta["patho_columns"]
+    ANNOTATION_SOURCES = meta["sources"]
+    print(f"Loaded annotation database {db_path} ({meta['patho_table_variants']} variants, "
+          f"{meta['sitevar_positions']} positions)", file=sys.stderr)
+    arrays = {name: np.frombuffer(data, dtype=dtype)
+              for name, dtype, data in conn.execute("SELECT name, dtype, data FROM sitevar_arrays")}
+    g = SiteVarTable.from_arrays(meta["sitevar_names"], meta["sitevar_strings"], arrays) if arrays else {}
+    return PathoStore(conn, meta["patho_table_variants"]), g
+
 def vcf_to_mtoolbox_string(pos: int, ref: str, alt: str) -> str:
     """
     Convert VCF variant to MToolBox string format.
@@ -259,8 +570,8 @@ def get_annotation(pos: int, ref: str, alt: str, d: Dict, g: Dict) -> Dict[str,
     # Fallback: Check sitevar (positional data) if not fully annotated
     # This logic mimics MToolBox's behavior for novel variants
     elif pos in g:
-        # Create a copy of site data to avoid modifying the global dict
-        site_data = list(g[pos]) # [Locus, NtVar, CodonPos, AaChange, AaVar, ...]
+        # SiteVarTable returns a new row list on every lookup (a copy for prefetched rows), so it can be modified freely
+        site_data = g[pos] # [Locus, NtVar, CodonPos, AaChange, AaVar, ...]
         
         # Apply MToolBox logic for novel variants in coding regions
         if mt_obj:
@@ -316,14 +627,24 @@ def determine_acmg_class(annotation: Dict) -> str:
         
     return "VUS"
 
-def process_vcf(input_vcf: str, output_vcf: str, output_json: str, output_html: str,
-                data_dir: str, include_mitomap: bool, include_clinvar: bool,
-                max_frequency: float, apply_acmg: bool):
-    
-    d, g = load_mtoolbox_data(data_dir)
-    
-    annotations_list = []
-    stats = {
+def annotation_header_lines(include_mitomap: bool, include_clinvar: bool, apply_acmg: bool) -> List[str]:
+    """INFO definitions inserted before the #CHROM line."""
+    lines = [
+        '##INFO=<ID=MTOOLBOX_LOCUS,Number=1,Type=String,Description="Gene locus from MToolBox">',
+        '##INFO=<ID=MTOOLBOX_VARIABILITY,Number=1,Type=Float,Description="Nucleotide variability from HmtDB">',
+    ]
+    if include_mitomap:
+        lines.append('##INFO=<ID=MITOMAP_DISEASE,Number=1,Type=String,Description="Disease association from MITOMAP">')
+    if include_clinvar:
+        lines.append('##INFO=<ID=CLINVAR,Number=1,Type=String,Description="ClinVar classification">')
+    if apply_acmg:
+        lines.append('##INFO=<ID=ACMG_CLASS,Number=1,Type=String,Description="ACMG classification (PMID:32906214)">')
+    lines.append('##INFO=<ID=POLYPHEN2,Number=1,Type=String,Description="PolyPhen-2 prediction">')
+    lines.append('##INFO=<ID=PHYLOP,Number=1,Type=Float,Description="PhyloP conservation score">')
+    return lines
+
+def new_stats() -> Dict[str, int]:
+    return {
         "total_variants": 0,
         "snvs": 0,
         "indels": 0,
@@ -334,26 +655,229 @@ def process_vcf(input_vcf: str, output_vcf: str, output_json: str, output_html:
         "with_mitomap_disease": 0,
         "filtered_by_frequency": 0,
     }
+
+def annotation_data_version(data_dir: str) -> str:
+    """
+    Version of the loaded annotation data: a digest of the source table
+    checksums (as recorded in the annotation database, or hashed from data_dir
+    when the text tables were parsed), the MToolBox version and the cache schema.
+    """
+    sources = ANNOTATION_SOURCES if ANNOTATION_SOURCES is not None else source_fingerprints(data_dir)
+    checksums = {name: source["sha256"] for name, source in sorted(sources.items())}
+    payload = json.dumps([ANNOTATION_CACHE_SCHEMA, MTOOLBOX_VERSION, checksums])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+class AnnotationCache:
+    """
+    LRU cache of allele annotations keyed by (pos, ref, alt), for one data
+    version and set of annotation flags. With a path, annotations are also
+    persisted to a SQLite file shared between runs. Rows are keyed by data
+    version, so jobs with different source tables can share the file; with
+    purge, entries written for other data versions are deleted when the file
+    is opened.
+    """
     
-    header_lines = []
-    variant_lines = []
+    def __init__(self, version: str, flags: str, path: Optional[str] = None,
+                 max_size: int = ANNOTATION_CACHE_SIZE, purge: bool = False):
+        self.version = version
+        self.flags = flags
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, timeout=60)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS annotations (pos INTEGER NOT NULL, ref TEXT NOT NULL, "
+                              "alt TEXT NOT NULL, version TEXT NOT NULL, flags TEXT NOT NULL, data TEXT NOT NULL, "
+                              "PRIMARY KEY (pos, ref, alt, version, flags)) WITHOUT ROWID")
+            if purge:
+                with self.conn:
+                    purged = self.conn.execute("DELETE FROM annotations WHERE version != ?", (version,)).rowcount
+                print(f"Annotation cache {path}: dropped {purged} entries from other data versions", file=sys.stderr)
     
-    with open(input_vcf, "r") as f:
-        for line in f:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def _remember(self, key: Tuple[int, str, str], annotation: Dict[str, Any]):
+        self.entries[key] = annotation
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def get(self, key: Tuple[int, str, str]) -> Optional[Dict[str, Any]]:
+        annotation = self.entries.get(key)
+        if annotation is not None:
+            self.entries.move_to_end(key)
+        elif self.conn is not None:
+            row = self.conn.execute(
+                "SELECT data FROM annotations WHERE pos = ? AND ref = ? AND alt = ? AND version = ? AND flags = ?",
+                key + (self.version, self.flags)
+            ).fetchone()
+            if row is not None:
+                annotation = json.loads(row[0])
+                self._remember(key, annotation)
+        if annotation is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return annotation
+    
+    def put(self, key: Tuple[int, str, str], annotation: Dict[str, Any]):
+        self._remember(key, annotation)
+        if self.conn is not None:
+            self.pending.append(key + (self.version, self.flags, json.dumps(annotation, default=str)))
+    
+    def flush(self):
+        if self.conn is not None and self.pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+    
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+def open_annotation_cache(data_dir: str, apply_acmg: bool, path: Optional[str] = None,
+                          purge: bool = False) -> AnnotationCache:
+    """
+    Annotation cache for the loaded tables. Only the ACMG flag changes the
+    annotation itself; MITOMAP/ClinVar only select which fields go into INFO.
+    The data version is only needed, and the tables only hashed, for a
+    persistent cache.
+    """
+    version = annotation_data_version(data_dir) if path else ""
+    return AnnotationCache(version, "acmg" if apply_acmg else "", path, purge=purge)
+
+def annotate_allele(pos: int, ref: str, alt: str, d: Dict, g: Dict, apply_acmg: bool,
+                    cache: Optional[AnnotationCache] = None) -> Dict[str, Any]:
+    """
+    Annotation (with ACMG class) of one allele. With a cache, each distinct
+    (pos, ref, alt) is annotated once and the cached dict is returned afterwards.
+    """
+    key = (pos, ref, alt)
+    if cache is not None:
+        annotation = cache.get(key)
+        if annotation is not None:
+            return annotation
+    annotation = get_annotation(pos, ref, alt, d, g)
+    if apply_acmg:
+        annotation["acmg_class"] = determine_acmg_class(annotation)
+    if cache is not None:
+        cache.put(key, annotation)
+    return annotation
+
+def count_allele(stats: Dict[str, int], ref: str, alt: str, annotation: Dict, apply_acmg: bool):
+    stats["total_variants"] += 1
+    if len(ref) == 1 and len(alt) == 1:
+        stats["snvs"] += 1
+    else:
+        stats["indels"] += 1
+    
+    if apply_acmg:
+        acmg = annotation["acmg_class"]
+        if acmg == "Pathogenic":
+            stats["pathogenic"] += 1
+        elif acmg == "Likely_pathogenic":
+            stats["likely_pathogenic"] += 1
+        elif acmg == "VUS":
+            stats["vus"] += 1
+        else:
+            stats["benign"] += 1
+    
+    mitomap_disease = annotation.get("mitomap_associated_disease")
+    if mitomap_disease and mitomap_disease != 'NA':
+        stats["with_mitomap_disease"] += 1
+
+def annotated_info(info: str, annotation: Dict, include_mitomap: bool, include_clinvar: bool,
+                   apply_acmg: bool) -> str:
+    """The INFO column with the MToolBox annotation appended."""
+    new_info_parts = [info] if info != "." else []
+    
+    if annotation.get("locus"):
+        new_info_parts.append(f"MTOOLBOX_LOCUS={annotation['locus']}")
+    
+    if annotation.get("nt_variability") is not None:
+        new_info_parts.append(f"MTOOLBOX_VARIABILITY={annotation['nt_variability']}")
+    
+    mitomap_disease = annotation.get("mitomap_associated_disease")
+    if include_mitomap and mitomap_disease and mitomap_disease != 'NA':
+        safe_disease = str(mitomap_disease).replace(";", ",").replace(" ", "_").replace("=", ":")
+        new_info_parts.append(f"MITOMAP_DISEASE={safe_disease}")
+    
+    if include_clinvar and annotation.get("clinvar") and annotation.get("clinvar") != 'NA':
+        safe_clinvar = str(annotation['clinvar']).replace(";", ",").replace(" ", "_").replace("=", ":")
+        new_info_parts.append(f"CLINVAR={safe_clinvar}")
+    
+    polyphen = annotation.get("polyphen_2_humvar_prob")
+    if polyphen and polyphen != 'NA':
+        new_info_parts.append(f"POLYPHEN2={polyphen}")
+    
+    phylop = annotation.get("phylop100way")
+    if phylop and phylop != 'NA':
+        new_info_parts.append(f"PHYLOP={phylop}")
+    
+    if apply_acmg:
+        new_info_parts.append(f"ACMG_CLASS={annotation['acmg_class']}")
+    
+    return ";".join(new_info_parts) if new_info_parts else "."
+
+def write_json_report(output_json: str, report: Dict[str, Any], jsonl):
+    """
+    Write the JSON report: the report fields, then an "annotations" array
+    copied line by line from the open JSON Lines file jsonl, whose lines are
+    already json.dumps() of one annotation each.
+    """
+    with open(output_json, "w") as f:
+        f.write("{\n")
+        for key, value in report.items():
+            # Nested values are indented one more level to sit inside the report object
+            encoded = json.dumps(value, indent=2, default=str).replace("\n", "\n  ")
+            f.write(f"  {json.dumps(key)}: {encoded},\n")
+        f.write('  "annotations": [')
+        jsonl.seek(0)
+        first = True
+        for line in jsonl:
+            f.write(("\n    " if first else ",\n    ") + line.rstrip("\n"))
+            first = False
+        f.write("]\n}\n" if first else "\n  ]\n}\n")
+
+def annotate_lines(lines, output_vcf: str, output_json: str, output_html: str, data_dir: str,
+                   d: Dict, g: Dict, include_mitomap: bool, include_clinvar: bool,
+                   max_frequency: float, apply_acmg: bool,
+                   cache: Optional[AnnotationCache] = None, output_jsonl: Optional[str] = None,
+                   observe: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
+    """
+    Annotate the lines of one VCF with already loaded tables and write the
+    VCF, JSON, HTML and optional JSON Lines outputs. Records and JSON Lines
+    are written as they are annotated (to a temporary file without
+    output_jsonl); the JSON report is produced from the JSON Lines at the end,
+    so memory does not grow with the VCF. observe is called with every
+    annotation. Returns the statistics.
+    """
+    stats = new_stats()
+    html_rows = []
+    
+    with ExitStack() as stack:
+        vcf_out = stack.enter_context(open(output_vcf, "w"))
+        if output_jsonl:
+            jsonl_out = stack.enter_context(open(output_jsonl, "w+"))
+        else:
+            jsonl_out = stack.enter_context(tempfile.TemporaryFile("w+", dir=Path(output_json).parent))
+        
+        for line in lines:
             if line.startswith("##"):
-                header_lines.append(line.rstrip())
+                vcf_out.write(line.rstrip() + "\n")
             elif line.startswith("#CHROM"):
-                header_lines.append('##INFO=<ID=MTOOLBOX_LOCUS,Number=1,Type=String,Description="Gene locus from MToolBox">')
-                header_lines.append('##INFO=<ID=MTOOLBOX_VARIABILITY,Number=1,Type=Float,Description="Nucleotide variability from HmtDB">')
-                if include_mitomap:
-                    header_lines.append('##INFO=<ID=MITOMAP_DISEASE,Number=1,Type=String,Description="Disease association from MITOMAP">')
-                if include_clinvar:
-                    header_lines.append('##INFO=<ID=CLINVAR,Number=1,Type=String,Description="ClinVar classification">')
-                if apply_acmg:
-                    header_lines.append('##INFO=<ID=ACMG_CLASS,Number=1,Type=String,Description="ACMG classification (PMID:32906214)">')
-                header_lines.append('##INFO=<ID=POLYPHEN2,Number=1,Type=String,Description="PolyPhen-2 prediction">')
-                header_lines.append('##INFO=<ID=PHYLOP,Number=1,Type=Float,Description="PhyloP conservation score">')
-                header_lines.append(line.rstrip())
+                for header_line in annotation_header_lines(include_mitomap, include_clinvar, apply_acmg):
+                    vcf_out.write(header_line + "\n")
+                vcf_out.write(line.rstrip() + "\n")
             else:
                 fields = line.rstrip().split("\t")
                 if len(fields) < 8:
@@ -384,96 +908,272 @@ def process_vcf(input_vcf: str, output_vcf: str, output_json: str, output_html:
                     continue
                 
                 for alt_allele in alt.split(","):
-                    stats["total_variants"] += 1
-                    
-                    if len(ref) == 1 and len(alt_allele) == 1:
-                        stats["snvs"] += 1
-                    else:
-                        stats["indels"] += 1
-                    
-                    annotation = get_annotation(pos, ref, alt_allele, d, g)
+                    annotation = annotate_allele(pos, ref, alt_allele, d, g, apply_acmg, cache)
+                    count_allele(stats, ref, alt_allele, annotation, apply_acmg)
+                    if observe is not None:
+                        observe(annotation)
+                    if len(html_rows) < HTML_REPORT_ROWS:
+                        html_rows.append(annotation)
+                    jsonl_out.write(json.dumps(annotation, default=str) + "\n")
                     
-                    if apply_acmg:
-                        annotation["acmg_class"] = determine_acmg_class(annotation)
-                        acmg = annotation["acmg_class"]
-                        if acmg == "Pathogenic":
-                            stats["pathogenic"] += 1
-                        elif acmg == "Likely_pathogenic":
-                            stats["likely_pathogenic"] += 1
-                        elif acmg == "VUS":
-                            stats["vus"] += 1
-                        else:
-                            stats["benign"] += 1
-                    
-                    mitomap_disease = annotation.get("mitomap_associated_disease")
-                    if mitomap_disease and mitomap_disease != 'NA':
-                        stats["with_mitomap_disease"] += 1
-                    
-                    annotations_list.append(annotation)
-                    
-                    new_info_parts = [info] if info != "." else []
-                    
-                    if annotation.get("locus"):
-                        new_info_parts.append(f"MTOOLBOX_LOCUS={annotation['locus']}")
-                    
-                    if annotation.get("nt_variability") is not None:
-                        new_info_parts.append(f"MTOOLBOX_VARIABILITY={annotation['nt_variability']}")
-                    
-                    if include_mitomap and mitomap_disease and mitomap_disease != 'NA':
-                        safe_disease = str(mitomap_disease).replace(";", ",").replace(" ", "_").replace("=", ":")
-                        new_info_parts.append(f"MITOMAP_DISEASE={safe_disease}")
-                    
-                    if include_clinvar and annotation.get("clinvar") and annotation.get("clinvar") != 'NA':
-                         safe_clinvar = str(annotation['clinvar']).replace(";", ",").replace(" ", "_").replace("=", ":")
-                         new_info_parts.append(f"CLINVAR={safe_clinvar}")
-                    
-                    polyphen = annotation.get("polyphen_2_humvar_prob")
-                    if polyphen and polyphen != 'NA':
-                        new_info_parts.append(f"POLYPHEN2={polyphen}")
-                    
-                    phylop = annotation.get("phylop100way")
-                    if phylop and phylop != 'NA':
-                        new_info_parts.append(f"PHYLOP={phylop}")
-                    
-                    if apply_acmg:
-                        new_info_parts.append(f"ACMG_CLASS={annotation['acmg_class']}")
-                    
-                    fields[7] = ";".join(new_info_parts) if new_info_parts else "."
-                    variant_lines.append("\t".join(fields))
-    
-    with open(output_vcf, "w") as f:
-        for line in header_lines:
-            f.write(line + "\n")
-        for line in variant_lines:
-            f.write(line + "\n")
-    
-    report = {
-        "tool": "MToolBox",
-        "version": MTOOLBOX_VERSION,
-        "pmid": PMID,
-        "data_source": data_dir,
-        "timestamp": datetime.now().isoformat(),
-        "statistics": stats,
-        "databases": {
-            "patho_table_variants": len(d),
-            "sitevar_positions": len(g),
-            "mitomap": include_mitomap,
-            "clinvar": include_clinvar,
-        },
-        "parameters": {
-            "max_frequency": max_frequency,
-            "apply_acmg": apply_acmg,
-        },
-        "annotations": annotations_list,
-    }
+                    fields[7] = annotated_info(info, annotation, include_mitomap, include_clinvar, apply_acmg)
+                    vcf_out.write("\t".join(fields) + "\n")
+        
+        report = {
+            "tool": "MToolBox",
+            "version": MTOOLBOX_VERSION,
+            "pmid": PMID,
+            "data_source": data_dir,
+            "timestamp": datetime.now().isoformat(),
+            "statistics": stats,
+            "databases": {
+                "patho_table_variants": len(d),
+                "sitevar_positions": len(g),
+                "mitomap": include_mitomap,
+                "clinvar": include_clinvar,
+            },
+            "parameters": {
+                "max_frequency": max_frequency,
+                "apply_acmg": apply_acmg,
+            },
+        }
+        write_json_report(output_json, report, jsonl_out)
     
-    with open(output_json, "w") as f:
-        json.dump(report, f, indent=2, default=str)
+    generate_html_report(dict(report, annotations=html_rows), output_html)
     
-    generate_html_report(report, output_html)
+    return stats
+
+def process_vcf(input_vcf: str, output_vcf: str, output_json: str, output_html: str,
+                data_dir: str, include_mitomap: bool, include_clinvar: bool,
+                max_frequency: float, apply_acmg: bool, annotation_db: Optional[str] = None,
+                annotation_cache: Optional[str] = None, output_jsonl: Optional[str] = None,
+                purge_annotation_cache: bool = False):
+    
+    d, g = load_mtoolbox_data(data_dir, annotation_db)
+    
+    with open_annotation_cache(data_dir, apply_acmg, annotation_cache, purge_annotation_cache) as cache, \
+            open(input_vcf, "r") as f:
+        stats = annotate_lines(f, output_vcf, output_json, output_html, data_dir, d, g,
+                               include_mitomap, include_clinvar, max_frequency, apply_acmg, cache, output_jsonl)
+    stats["cache_hits"] = cache.hits
     
     return stats
 
+def declared_numbers(header_line: str, numbers: Dict[Tuple[str, str], str]):
+    """Record the Number of an ##INFO/##FORMAT header line in numbers, keyed by (section, ID)."""
+    section, _, definition = header_line[2:].rstrip().rstrip(">").partition("=<")
+    if section in ("INFO", "FORMAT"):
+        items = dict(item.split("=", 1) for item in definition.split(",") if "=" in item)
+        if "ID" in items:
+            numbers[(section, items["ID"])] = items.get("Number", ".")
+
+def trim_alleles(value: str, number: str, keep: List[int], alleles: int) -> str:
+    """
+    Subset one INFO/FORMAT value to the kept alleles (0 is REF): Number=R per
+    allele, Number=A per ALT, and an undeclared or non-A/R value with one item
+    per ALT (e.g. a multi-allelic HF) like Number=A. Number=G values cannot be
+    subset without the genotype order, so they become missing.
+    """
+    items = value.split(",")
+    if number == "G":
+        return "."
+    if number == "R" and len(items) == alleles:
+        return ",".join(items[index] for index in keep)
+    if len(items) == alleles - 1 and (number == "A" or alleles > 2):
+        return ",".join(items[index - 1] for index in keep[1:])
+    return value
+
+def sample_record(fields: List[str], sample: str, numbers: Dict[Tuple[str, str], str]) -> Optional[str]:
+    """
+    The record as a single-sample VCF line for sample, or None when the sample's
+    GT has no ALT allele. ALT is trimmed to the alleles in the GT, which is
+    renumbered, and per-allele INFO/FORMAT values are subset to match. Records
+    without a GT to check are kept as they are.
+    """
+    keys = fields[8].split(":")
+    if "GT" not in keys:
+        return "\t".join(fields[:9] + [sample]) + "\n"
+    values = sample.split(":")
+    gt_index = keys.index("GT")
+    calls = re.split(r"([/|])", values[gt_index] if gt_index < len(values) else ".")
+    alts = fields[4].split(",")
+    carried = sorted({int(allele) for allele in calls[::2] if allele.isdigit() and 0 < int(allele) <= len(alts)})
+    if not carried:
+        return None
+    if len(carried) == len(alts):
+        return "\t".join(fields[:9] + [sample]) + "\n"
+    
+    keep = [0] + carried
+    renumber = {str(old): str(new) for new, old in enumerate(keep)}
+    calls[::2] = [renumber.get(allele, allele) for allele in calls[::2]]
+    values[gt_index] = "".join(calls)
+    values = [value if key == "GT" else trim_alleles(value, numbers.get(("FORMAT", key), "."), keep, len(alts) + 1)
+              for key, value in zip(keys, values)]
+    info = fields[7]
+    if info != ".":
+        info = ";".join(
+            f"{key}={trim_alleles(value, numbers.get(('INFO', key), '.'), keep, len(alts) + 1)}" if value else key
+            for key, _, value in (item.partition("=") for item in info.split(";"))
+        )
+    trimmed = fields[:4] + [",".join(alts[index - 1] for index in carried)] + fields[5:7] + [info, fields[8]]
+    return "\t".join(trimmed + [":".join(values)]) + "\n"
+
+def vcf_samples(input_vcf: str) -> List[str]:
+    """Sample names from the #CHROM line of input_vcf; only the header is read."""
+    with open(input_vcf, "r") as f:
+        for line in f:
+            if line.startswith("#CHROM"):
+                return line.rstrip().split("\t")[9:]
+            if not line.startswith("#"):
+                break
+    return []
+
+def split_samples(input_vcf: str, samples: int, spool_dir: Path, positions: Set[int]) -> List[Path]:
+    """
+    Split a VCF into one single-sample VCF per sample column in a single pass,
+    keeping the records where the sample carries an ALT allele, trimmed to the
+    sample's alleles (see sample_record). Lines are buffered and appended to
+    the spool files in blocks, so memory stays bounded and only one spool file
+    is open at a time. The positions of the kept records are added to
+    positions.
+    """
+    paths = [spool_dir / f"sample{index}.vcf" for index in range(samples)]
+    buffers = [[] for _ in range(samples)]
+    numbers = {}
+    buffered = 0
+    
+    def flush():
+        for path, buffer in zip(paths, buffers):
+            with open(path, "a") as spool:
+                spool.writelines(buffer)
+            buffer.clear()
+    
+    with open(input_vcf, "r") as f:
+        for line in f:
+            if line.startswith("##"):
+                declared_numbers(line, numbers)
+                for buffer in buffers:
+                    buffer.append(line)
+            elif line.startswith("#CHROM"):
+                columns = line.rstrip().split("\t")
+                for index, buffer in enumerate(buffers):
+                    buffer.append("\t".join(columns[:9] + [columns[9 + index]]) + "\n")
+            elif not line.startswith("#") and line.strip():
+                fields = line.rstrip().split("\t")
+                for index, sample in enumerate(fields[9:9 + samples]):
+                    record = sample_record(fields, sample, numbers)
+                    if record is not None:
+                        buffers[index].append(record)
+                        buffered += 1
+                        if fields[1].isdigit():
+                            positions.add(int(fields[1]))
+                if buffered >= SPOOL_BUFFER_LINES:
+                    flush()
+                    buffered = 0
+    flush()
+    return paths
+
+def collect_levels(lines, levels: Dict[Tuple[int, str, str], str]):
+    """
+    Pass the lines of a single-sample VCF through, recording the heteroplasmy
+    level of each (pos, ref, alt) in levels as its record goes by: FORMAT HF or
+    AF of the sample, else INFO HF or AF, else "1".
+    """
+    for line in lines:
+        fields = line.rstrip().split("\t") if not line.startswith("#") else ()
+        if len(fields) >= 8 and fields[1].isdigit():
+            values = {}
+            if len(fields) > 9:
+                values = dict(zip(fields[8].split(":"), fields[9].split(":")))
+            info = dict(item.split("=", 1) for item in fields[7].split(";") if "=" in item)
+            level = next((source[key] for source in (values, info) for key in ("HF", "AF")
+                          if source.get(key, ".") != "."), None)
+            per_allele = level.split(",") if level else []
+            for index, alt in enumerate(fields[4].split(",")):
+                levels[(int(fields[1]), fields[3], alt)] = per_allele[index] if index < len(per_allele) else "1"
+        yield line
+
+def write_matrix(output_matrix: str, samples: List[str], matrix: Dict[Tuple[int, str, str], Dict[str, str]],
+                 annotations: Dict[Tuple[int, str, str], Dict], apply_acmg: bool):
+    """Variant x sample TSV: annotation columns, then the heteroplasmy level per sample ('.' when absent)."""
+    annotation_columns = ["locus", "mitomap_associated_disease", "clinvar"] + (["acmg_class"] if apply_acmg else [])
+    with open(output_matrix, "w") as f:
+        f.write("\t".join(["variant_id", "position", "ref", "alt"] + annotation_columns + samples) + "\n")
+        for key in sorted(matrix):
+            annotation = annotations[key]
+            row = [annotation["variant_id"], str(key[0]), key[1], key[2]]
+            row += ["." if annotation.get(column) in (None, "") else str(annotation[column])
+                    for column in annotation_columns]
+            row += [matrix[key].get(sample, ".") for sample in samples]
+            f.write("\t".join(row) + "\n")
+
+def process_cohort(input_vcfs: List[str], output_dir: str, output_matrix: Optional[str], data_dir: str,
+                   include_mitomap: bool, include_clinvar: bool, max_frequency: float, apply_acmg: bool,
+                   annotation_db: Optional[str] = None, annotation_cache: Optional[str] = None,
+                   purge_annotation_cache: bool = False) -> Dict[str, int]:
+    """
+    Annotate many VCFs and/or multi-sample VCFs with one table load. Each
+    distinct (pos, ref, alt) is annotated once; every sample gets its own
+    <sample>.annotated.vcf, .annotation.json, .annotation.jsonl and
+    .annotation.html. A VCF with sample columns is read once and split into
+    per-sample spool files rather than held in memory; heteroplasmy levels
+    are collected while each sample's records are annotated. The site
+    variability rows of the split records are looked up in one batch.
+    """
+    d, g = load_mtoolbox_data(data_dir, annotation_db)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    names = set()
+    samples = []
+    occurrences = 0
+    matrix = {}
+    distinct = {}
+    with open_annotation_cache(data_dir, apply_acmg, annotation_cache, purge_annotation_cache) as cache, \
+            tempfile.TemporaryDirectory(dir=output_dir) as spool_dir:
+        for input_vcf in input_vcfs:
+            columns = vcf_samples(input_vcf)
+            sample_names = columns or [Path(input_vcf).name.split(".")[0]]
+            for sample in sample_names:
+                name = re.sub(r"[^\w.-]", "_", sample)
+                if name in names:
+                    raise ValueError(f"Duplicate sample name in cohort: {sample}")
+                names.add(name)
+            # Single-sample VCFs also go through split_samples for the GT filter and allele trimming
+            positions = set()
+            sources = split_samples(input_vcf, len(columns), Path(spool_dir), positions) if columns else [input_vcf]
+            if isinstance(g, SiteVarTable):
+                # One vectorized lookup for the site rows of every record the samples carry
+                g.prefetch(positions)
+            
+            for sample, source in zip(sample_names, sources):
+                samples.append(sample)
+                name = re.sub(r"[^\w.-]", "_", sample)
+                levels = {}
+                
+                def observe(annotation, sample=sample, levels=levels):
+                    key = (annotation["position"], annotation["ref"], annotation["alt"])
+                    distinct[key] = annotation
+                    if output_matrix:
+                        matrix.setdefault(key, {})[sample] = levels.get(key, "1")
+                
+                with open(source, "r") as f:
+                    stats = annotate_lines(
+                        collect_levels(f, levels) if output_matrix else f, output_dir / f"{name}.annotated.vcf",
+                        output_dir / f"{name}.annotation.json", output_dir / f"{name}.annotation.html", data_dir,
+                        d, g, include_mitomap, include_clinvar, max_frequency, apply_acmg, cache,
+                        output_dir / f"{name}.annotation.jsonl", observe
+                    )
+                if source != input_vcf:
+                    os.remove(source)
+                occurrences += stats["total_variants"]
+    
+    if output_matrix:
+        write_matrix(output_matrix, samples, matrix, distinct, apply_acmg)
+    
+    return {"samples": len(samples), "variant_occurrences": occurrences, "unique_variants": len(distinct),
+            "annotated": cache.misses, "cache_hits": cache.hits}
+
 def generate_html_report(report: dict, output_html: str):
     stats = report["statistics"]
     
@@ -550,7 +1250,7 @@ def generate_html_report(report: dict, output_html: str):
             <tbody>
 """
     
-    for ann in report["annotations"][:100]:
+    for ann in report["annotations"][:HTML_REPORT_ROWS]:
         disease = ann.get("mitomap_associated_disease") or "-"
         if disease == 'NA':
             disease = "-"
@@ -586,17 +1286,57 @@ def generate_html_report(report: dict, output_html: str):
     with open(output_html, "w") as f:
         f.write(html)
 
+def build_db_main(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="mtoolbox_annotate.py build-db",
+        description="Compile the MToolBox annotation tables into a versioned SQLite database"
+    )
+    parser.add_argument("--data-dir", default=MTOOLBOX_DATA_DIR,
+                        help=f"MToolBox data directory (default: {MTOOLBOX_DATA_DIR})")
+    parser.add_argument("--output", default=None,
+                        help=f"Database path (default: <data-dir>/{ANNOTATION_DB_NAME})")
+    args = parser.parse_args(argv)
+    
+    output = args.output or str(Path(args.data_dir) / ANNOTATION_DB_NAME)
+    meta = build_annotation_db(args.data_dir, output)
+    print(f"MToolBox annotation database written to {output}")
+    print(f"  Pathogenicity variants: {meta['patho_table_variants']}")
+    print(f"  Site positions: {meta['sitevar_positions']}")
+    for name, source in meta["sources"].items():
+        print(f"  {name}: sha256 {source['sha256']}")
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "build-db":
+        build_db_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(
-        description="MToolBox Annotate - mtDNA variant annotation using MToolBox data files (PMID:25028726)"
+        description="MToolBox Annotate - mtDNA variant annotation using MToolBox data files (PMID:25028726)",
+        epilog="Run 'mtoolbox_annotate.py build-db' once to precompile the data tables for faster start-up."
     )
     
-    parser.add_argument("--input-vcf", required=True)
-    parser.add_argument("--output-vcf", required=True)
-    parser.add_argument("--output-json", required=True)
-    parser.add_argument("--output-html", required=True)
+    parser.add_argument("--input-vcf", required=True, action="append",
+                        help="Input VCF; repeat with --cohort to annotate several VCFs")
+    parser.add_argument("--output-vcf")
+    parser.add_argument("--output-json")
+    parser.add_argument("--output-html")
+    parser.add_argument("--output-jsonl",
+                        help="Also write one JSON annotation per line, appended as each allele is annotated")
+    parser.add_argument("--cohort", action="store_true",
+                        help="Annotate every sample of the input VCFs (multi-sample VCFs are split per sample) "
+                             "with one table load, annotating each distinct variant once")
+    parser.add_argument("--output-dir", help="Cohort mode: directory for the per-sample VCF/JSON/HTML outputs")
+    parser.add_argument("--output-matrix", help="Cohort mode: variant x sample TSV of heteroplasmy levels")
     parser.add_argument("--data-dir", default=MTOOLBOX_DATA_DIR,
                         help=f"MToolBox data directory (default: {MTOOLBOX_DATA_DIR})")
+    parser.add_argument("--annotation-db", default=None,
+                        help=f"Annotation database from build-db (default: <data-dir>/{ANNOTATION_DB_NAME} if present)")
+    parser.add_argument("--annotation-cache", default=MTOOLBOX_ANNOTATION_CACHE,
+                        help="SQLite file that keeps computed annotations between runs; entries are "
+                             "keyed by the data tables' version (default: $MTOOLBOX_ANNOTATION_CACHE)")
+    parser.add_argument("--purge-annotation-cache", action="store_true",
+                        help="Delete annotation cache entries of other data versions; only use this when "
+                             "no job with other data tables shares the cache")
     parser.add_argument("--include-mitomap", action="store_true")
     parser.add_argument("--include-hmtdb", action="store_true")
     parser.add_argument("--include-clinvar", action="store_true")
@@ -609,13 +1349,52 @@ def main():
     parser.add_argument("--version", action="version", version=f"MToolBox Annotate {MTOOLBOX_VERSION}")
     
     args = parser.parse_args()
+    if args.purge_annotation_cache and not args.annotation_cache:
+        parser.error("--purge-annotation-cache needs --annotation-cache")
+    
+    for input_vcf in args.input_vcf:
+        if not Path(input_vcf).exists():
+            print(f"Error: Input VCF file not found: {input_vcf}", file=sys.stderr)
+            sys.exit(1)
+    
+    if args.cohort:
+        if not args.output_dir:
+            parser.error("--cohort requires --output-dir")
+        if args.output_jsonl:
+            parser.error("--output-jsonl is not used with --cohort; every sample gets DIR/<sample>.annotation.jsonl")
+        try:
+            summary = process_cohort(
+                input_vcfs=args.input_vcf,
+                output_dir=args.output_dir,
+                output_matrix=args.output_matrix,
+                data_dir=args.data_dir,
+                include_mitomap=args.include_mitomap,
+                include_clinvar=args.include_clinvar,
+                max_frequency=args.max_frequency,
+                apply_acmg=args.apply_acmg_criteria,
+                annotation_db=args.annotation_db,
+                annotation_cache=args.annotation_cache,
+                purge_annotation_cache=args.purge_annotation_cache,
+            )
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"MToolBox Cohort Annotation Complete")
+        print(f"  Samples: {summary['samples']}")
+        print(f"  Variants across samples: {summary['variant_occurrences']}")
+        print(f"  Distinct variants: {summary['unique_variants']} "
+              f"({summary['annotated']} annotated, {summary['cache_hits']} from cache)")
+        return
     
-    if not Path(args.input_vcf).exists():
-        print(f"Error: Input VCF file not found: {args.input_vcf}", file=sys.stderr)
-        sys.exit(1)
+    if len(args.input_vcf) > 1:
+        parser.error("several --input-vcf files need --cohort")
+    if args.output_dir or args.output_matrix:
+        parser.error("--output-dir and --output-matrix need --cohort")
+    if not (args.output_vcf and args.output_json and args.output_html):
+        parser.error("--output-vcf, --output-json and --output-html are required")
     
     stats = process_vcf(
-        input_vcf=args.input_vcf,
+        input_vcf=args.input_vcf[0],
         output_vcf=args.output_vcf,
         output_json=args.output_json,
         output_html=args.output_html,
@@ -624,6 +1403,10 @@ def main():
         include_clinvar=args.include_clinvar,
         max_frequency=args.max_frequency,
         apply_acmg=args.apply_acmg_criteria,
+        annotation_db=args.annotation_db,
+        annotation_cache=args.annotation_cache,
+        output_jsonl=args.output_jsonl,
+        purge_annotation_cache=args.purge_annotation_cache,
     )
     
     print(f"MToolBox Annotation Complete")
@@ -632,6 +1415,8 @@ def main():
     print(f"  Pathogenic: {stats['pathogenic']}")
     print(f"  Likely pathogenic: {stats['likely_pathogenic']}")
     print(f"  VUS: {stats['vus']}")
+    if args.annotation_cache:
+        print(f"  Annotation cache hits: {stats['cache_hits']}")
 
 if __name__ == "__main__":
     main()